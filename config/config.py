@@ -14,11 +14,15 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # Используем gpt-4o - самая новая и быстрая модель с лучшим пониманием контекста
 # Альтернативы: "gpt-4-turbo" (новая версия turbo), "gpt-4o-mini" (быстрее и дешевле)
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+# Быстрая модель для простых вопросов DOM Sub-agent'у (мало элементов, без уточнения расположения)
+OPENAI_MODEL_FAST = os.getenv("OPENAI_MODEL_FAST", "gpt-4o-mini")
 
 # Настройки браузера
 BROWSER_TYPE = os.getenv("BROWSER_TYPE", "chromium")  # chromium, firefox, webkit
 HEADLESS = os.getenv("HEADLESS", "false").lower() == "true"
 BROWSER_TIMEOUT = int(os.getenv("BROWSER_TIMEOUT", "30000"))  # мс
+# Типы ресурсов, загрузка которых блокируется (через запятую, например: image,font,media)
+BLOCK_RESOURCES = {t.strip() for t in os.getenv("BLOCK_RESOURCES", "").split(",") if t.strip()}
 
 # Настройки сессий
 SESSION_DIR = PROJECT_ROOT / "sessions"
@@ -3,6 +3,7 @@ import asyncio
 import sys
 import argparse
 from src.cli.interface import CLIInterface
+from src.browser.controller import BrowserController
 
 
 async def main(session_name: str = None, task: str = None):
@@ -43,6 +44,9 @@ if __name__ == "__main__":
     if args.task:
         task = " ".join(args.task)
     
+    # Быстрый event loop (если установлен) должен быть выбран до запуска браузера
+    BrowserController.install_fast_loop()
+    
     try:
         asyncio.run(main(session_name=args.session, task=task))
     except KeyboardInterrupt:
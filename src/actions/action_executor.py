@@ -1280,8 +1280,7 @@ class ActionExecutor:
                 # Прокручиваем вниз
                 result = await self.browser.scroll(direction="down", amount=amount)
                 
-                # Повторяем поиск после прокрутки
-                await asyncio.sleep(0.5)
+                # Повторяем поиск после прокрутки (scroll() уже дождался кадра с новой позицией)
                 element = await self.extractor.find_element_by_description(to_element_description)
                 
                 if element:
@@ -1396,22 +1395,20 @@ class ActionExecutor:
         timeout = parameters.get("timeout", 10000)
         
         if selector:
-            # Если селектор указан, сначала ждем появления элемента
-            wait_result = await self.browser.wait_for_element(selector, timeout=timeout)
-            if not wait_result.get("success"):
-                # Fallback: пробуем извлечь без ожидания
-                if self.logger:
-                    self.logger.warning(f"   Элемент не появился, пробуем извлечь напрямую...")
-                result = await self.browser.get_text(selector, include_children=True)
-                if result.get("success"):
-                    return result
+            # Если селектор указан, ждем появления элемента и читаем текст одним вызовом
+            # (если элемент не стал видимым - текст извлекается напрямую)
+            result = await self.browser.wait_and_get_text(selector, timeout=timeout, include_children=True)
+            if not result.get("success"):
                 return {
                     "success": False,
                     "error": f"Элемент с селектором '{selector}' не найден. Попробуйте прокрутить страницу или уточнить селектор.",
                     "suggestion": "Попробуйте прокрутить страницу (scroll) или использовать extract_text с описанием элемента вместо селектора."
                 }
+            if not result.pop("visible", True):
+                if self.logger:
+                    self.logger.warning(f"   Элемент не появился, текст извлечен напрямую")
+                return result
             
-            result = await self.browser.get_text(selector, include_children=True)
             if result.get("success"):
                 text_length = result.get("length", 0)
                 result["message"] = f"Текст извлечен из '{description}' ({text_length} символов)"
@@ -1456,14 +1453,12 @@ class ActionExecutor:
                     if self.logger:
                         self.logger.info(f"   Найден селектор: {selector}")
                     
-                    # Ждем появления элемента
-                    wait_result = await self.browser.wait_for_element(selector, timeout=timeout)
-                    if not wait_result.get("success"):
-                        # Если элемент не появился, пробуем извлечь текст без ожидания
-                        if self.logger:
-                            self.logger.warning(f"   Элемент не появился, пробуем извлечь напрямую...")
+                    # Ждем появления элемента и читаем текст одним вызовом
+                    # (если элемент не появился - текст извлекается без ожидания)
+                    result = await self.browser.wait_and_get_text(selector, timeout=timeout, include_children=True)
+                    if not result.pop("visible", True) and self.logger:
+                        self.logger.warning(f"   Элемент не появился, текст извлечен напрямую")
                     
-                    result = await self.browser.get_text(selector, include_children=True)
                     if result.get("success"):
                         text_length = result.get("length", 0)
                         result["message"] = f"Текст извлечен из '{description}' ({text_length} символов)"
@@ -1661,7 +1656,8 @@ class ActionExecutor:
                 save_result = await self.screenshot_manager.save_screenshot(
                     screenshot_bytes, 
                     description=description, 
-                    action=action
+                    action=action,
+                    image_format=result.get("format", "png")
                 )
                 
                 if save_result.get("success"):
@@ -1751,6 +1747,7 @@ class ActionExecutor:
                 image_bytes = image_file.read()
                 image_base64 = base64.b64encode(image_bytes).decode('utf-8')
                 base64_size_kb = len(image_base64) / 1024
+            mime_type = "image/png" if str(screenshot_path).lower().endswith(".png") else "image/jpeg"
             
             if self.logger:
                 self.logger.debug(f"Изображение закодировано в base64 ({base64_size_kb:.1f} KB), отправляю в {OPENAI_MODEL}...")
@@ -1802,7 +1799,7 @@ class ActionExecutor:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}"
+                                    "url": f"data:{mime_type};base64,{image_base64}"
                                 }
                             }
                         ]
@@ -1,9 +1,8 @@
 """Основной AI-агент для автоматизации браузера"""
 import asyncio
 import json
-import re
 from typing import Dict, Any, Optional, Callable
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 from src.browser.controller import BrowserController
 from src.browser.page_extractor import PageExtractor
@@ -15,7 +14,153 @@ from src.agent.sub_agents import SubAgentManager
 from src.agent.agent_state import AgentState, AgentStateManager
 from src.agent.action_validator import ActionResultValidator
 from src.error.error_handler import ErrorHandler
-from config import OPENAI_API_KEY, OPENAI_MODEL, MAX_ITERATIONS, ENABLE_SUB_AGENTS
+from config import OPENAI_API_KEY, OPENAI_MODEL, MAX_ITERATIONS, ENABLE_SUB_AGENTS, MAX_REQUEST_TOKENS
+
+# Базовое ожидание динамического контента после действия (секунды)
+_ACTION_BASE_DELAY: Dict[str, float] = {
+    "navigate": 2.0,
+    "click_element": 1.5,
+    "type_text": 0.5,
+    "scroll": 1.0,
+    "search_on_page": 2.0,
+    "reload_page": 2.0
+}
+
+# Действия, после которых кэш страницы в PageExtractor неактуален
+_DOM_MUTATING_ACTIONS = frozenset({"click_element", "type_text", "navigate", "reload_page", "scroll", "wait_for_element"})
+
+# Каркас user message для принятия решения (заполняется через %)
+_BASE_MESSAGE_TEMPLATE = """=== ТЕКУЩАЯ ЗАДАЧА ===
+%(task)s%(analysis)s
+
+=== КОНТЕКСТ СТРАНИЦЫ ===
+%(context)s
+
+=== ИСТОРИЯ ДЕЙСТВИЙ ===
+Всего выполнено действий: %(actions_count)d%(visited)s%(recent_actions)s%(loop_warning)s%(last_result)s%(dynamic_hint)s%(query_history)s"""
+
+# Признак загруженного контента: есть интерактивные элементы или модальное окно
+_CONTENT_READY_JS = """() => document.querySelector('button, a, input, textarea, select, [role="button"], [role="link"]') !== null
+    || document.querySelector('[role="dialog"], [aria-modal="true"]') !== null"""
+
+# Признак завершения перерисовки после действия: DOM не меняется quietMs миллисекунд.
+# Наблюдатель временный - отключается при ответе, не позже чем через maxMs
+_DOM_SETTLED_JS = """([quietMs, maxMs]) => new Promise(resolve => {
+    const finish = (settled) => {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(maxTimer);
+        resolve(settled);
+    };
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => finish(true), quietMs);
+    });
+    let quietTimer = setTimeout(() => finish(true), quietMs);
+    const maxTimer = setTimeout(() => finish(false), maxMs);
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+})"""
+
+# Сколько DOM должен оставаться без изменений, чтобы считать страницу готовой (мс)
+_DOM_QUIET_MS = 150
+
+
+def _salvage_json_object(args_str: str) -> Dict[str, Any]:
+    """
+    Частичное восстановление битого JSON-объекта аргументов
+    
+    Проходит строку один раз, учитывая строки, экранирование и стек открытых скобок.
+    Точки восстановления - запятые вне строк и конец текста: к префиксу дописываются
+    закрывающие скобки в обратном порядке, и пробуются кандидаты от самого длинного.
+    Оборванное строковое значение отбрасывается вместе со своим ключом.
+    
+    Args:
+        args_str: Строка аргументов функции от модели
+        
+    Returns:
+        Восстановленные параметры (пустой словарь если ничего не удалось)
+    """
+    start = args_str.find('{')
+    if start == -1:
+        return {}
+    
+    closing = {'{': '}', '[': ']'}
+    stack = []
+    # (позиция среза, закрывающие скобки на этот момент)
+    cut_points = []
+    in_string = False
+    escaped = False
+    end = len(args_str)
+    for i in range(start, len(args_str)):
+        ch = args_str[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in closing:
+            stack.append(closing[ch])
+        elif ch in '}]':
+            if not stack or stack[-1] != ch:
+                # Непарная скобка - дальше текст не разбираем
+                end = i
+                break
+            stack.pop()
+            if not stack:
+                end = i + 1
+                break
+        elif ch == ',':
+            cut_points.append((i, ''.join(reversed(stack))))
+    
+    candidates = []
+    if not in_string:
+        candidates.append(args_str[start:end].rstrip() + ''.join(reversed(stack)))
+    candidates.extend(args_str[start:pos] + closers for pos, closers in reversed(cut_points))
+    for candidate in candidates:
+        try:
+            obj = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(obj, dict):
+            return obj
+    return {}
+
+
+def _has_more_than_n_spaces(text: str, n: int = 5) -> bool:
+    """Проверка, что в строке больше n пробелов (останавливается на (n+1)-м пробеле)"""
+    idx = -1
+    for _ in range(n + 1):
+        idx = text.find(' ', idx + 1)
+        if idx == -1:
+            return False
+    return True
+
+
+async def _first_successful(*awaitables) -> bool:
+    """
+    Ожидание первого успешно завершившегося из нескольких независимых ожиданий
+    
+    Остальные ожидания отменяются, как только одно из них завершилось без ошибки.
+    
+    Returns:
+        True, если хотя бы одно ожидание завершилось успешно
+    """
+    pending = {asyncio.ensure_future(aw) for aw in awaitables}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(not task.cancelled() and task.exception() is None for task in done):
+                return True
+        return False
+    finally:
+        for task in pending:
+            task.cancel()
+        # Дожидаемся отмены, чтобы ошибки проигравших ожиданий не остались необработанными
+        await asyncio.gather(*pending, return_exceptions=True)
 
 
 class Logger:
@@ -88,8 +233,14 @@ class MainAgent:
         self.error_handler = ErrorHandler()
         self.action_validator = ActionResultValidator()
         
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        # Асинхронный клиент: запрос к LLM не блокирует event loop,
+        # а пул соединений httpx переиспользуется между итерациями
+        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
         self.action_tools = get_action_tools()
+        # Системный промпт и tools статичны в рамках сессии - считаем их токены один раз
+        self._system_prompt = self.context_manager.get_system_prompt()
+        self._system_tokens = self.context_manager.token_optimizer.count_tokens(self._system_prompt)
+        self._tools_tokens = self.context_manager.estimate_request_size("", "", self.action_tools)
         self.user_confirmation_callback = user_confirmation_callback
         
         self.max_iterations = MAX_ITERATIONS
@@ -146,10 +297,14 @@ class MainAgent:
                 self.state_manager.set_state(AgentState.OBSERVING)
                 self.logger.info("🔍 Наблюдение за текущим состоянием страницы...")
                 page_info = await self.page_extractor.extract_page_info()
+                # Колонки элементов для query_dom строятся сразу после извлечения страницы
+                # (для той же страницы из кэша PageExtractor повторно не строятся)
+                self.sub_agent_manager.ingest_page(page_info)
                 
                 # Получаем состояние страницы для обнаружения изменений
+                # metadata общий с кэшем PageExtractor - дополняем его копию, а не исходный словарь
                 page_state = await self.page_extractor.get_page_state_hash()
-                page_info["metadata"]["page_state"] = page_state
+                page_info["metadata"] = {**page_info["metadata"], "page_state": page_state}
                 
                 # Добавляем информацию о местоположении
                 try:
@@ -303,6 +458,8 @@ class MainAgent:
                         # Все равно выполняем действие, но предупреждаем агента
                 
                 action_result = await self._execute_action(decision)
+                if action_name in _DOM_MUTATING_ACTIONS:
+                    self.page_extractor.invalidate_cache()
                 
                 # Адаптивное ожидание загрузки динамического контента
                 await self._wait_for_dynamic_content(action_name, action_result)
@@ -363,6 +520,10 @@ class MainAgent:
                     "modals_info": page_state_after.get('modals', [])
                 }
                 
+                # Кэшированные рекомендации sub-агентов относятся к прежнему состоянию страницы
+                if page_changed:
+                    self.sub_agent_manager.invalidate_cache()
+                
                 # Добавляем информацию об изменении страницы в результат действия
                 action_result["page_changed"] = page_changed
                 action_result["url_before"] = self._page_state_before_action["url"]
@@ -1105,7 +1266,7 @@ vision_analysis: "Кнопка: Найти"
         # Определяем, является ли задача многошаговой
         multi_step_keywords = ["и", "затем", "после", "потом", "сначала", "потом", "предварительно", "изучив"]
         has_multiple_actions = any(keyword in task_lower for keyword in multi_step_keywords) or \
-                              task_lower.count(" ") > 5  # Длинные задачи обычно многошаговые
+                              _has_more_than_n_spaces(task_lower, 5)  # Длинные задачи обычно многошаговые
         
         if has_multiple_actions:
             task_analysis = "\n=== ПЛАНИРОВАНИЕ ЗАДАЧИ ===\n"
@@ -1140,7 +1301,8 @@ vision_analysis: "Кнопка: Найти"
         
         # Добавляем информацию о предыдущих query_dom вопросах и извлеченных селекторах
         query_dom_history_info = ""
-        recent_queries = self.state_manager.get_recent_query_dom_info(limit=5)
+        # Без действий не может быть и query_dom - не обращаемся к истории вопросов
+        recent_queries = self.state_manager.get_recent_query_dom_info(limit=5) if self.state_manager.action_history else ()
         if recent_queries:
             query_dom_history_info = "\n\n=== ПРЕДЫДУЩИЕ query_dom ВОПРОСЫ И ОТВЕТЫ ===\n"
             query_dom_history_info += "ВАЖНО: Эти вопросы уже были заданы! НЕ ПОВТОРЯЙ их! Используй ответы из истории!\n\n"
@@ -1152,7 +1314,10 @@ vision_analysis: "Кнопка: Найти"
                 query_dom_history_info += f"   Ответ: {answer_text}\n"
                 
                 # Извлекаем селектор из ответа если есть
-                selector = self.action_executor.extract_selector_from_answer(answer_text) if self.action_executor else None
+                # Дешевая проверка перед разбором: без #, . или [ селектора в ответе нет
+                selector = None
+                if self.action_executor and answer_text and ('#' in answer_text or '.' in answer_text or '[' in answer_text):
+                    selector = self.action_executor.extract_selector_from_answer(answer_text)
                 if selector:
                     extracted_selectors.append({
                         "query": query_text,
@@ -1179,14 +1344,18 @@ vision_analysis: "Кнопка: Найти"
             query_dom_history_info += "DOM Sub-agent дает детальные ответы с описанием визуального состояния элементов и селекторами - используй эту информацию для действий.\n"
         
         # Формируем итоговое сообщение
-        base_message = f"""=== ТЕКУЩАЯ ЗАДАЧА ===
-{task}{task_analysis}
-
-=== КОНТЕКСТ СТРАНИЦЫ ===
-{context}
-
-=== ИСТОРИЯ ДЕЙСТВИЙ ===
-Всего выполнено действий: {len(self.state_manager.action_history)}{visited_info}{recent_actions_info}{loop_warning}{last_action_result_info}{dynamic_content_hint}{query_dom_history_info}"""
+        base_message = _BASE_MESSAGE_TEMPLATE % {
+            "task": task,
+            "analysis": task_analysis,
+            "context": context,
+            "actions_count": len(self.state_manager.action_history),
+            "visited": visited_info,
+            "recent_actions": recent_actions_info,
+            "loop_warning": loop_warning,
+            "last_result": last_action_result_info,
+            "dynamic_hint": dynamic_content_hint,
+            "query_history": query_dom_history_info
+        }
         
         requirements_status = self.context_manager.get_requirements_status()
         if requirements_status:
@@ -1251,7 +1420,7 @@ vision_analysis: "Кнопка: Найти"
                 self.logger.warning(f"Не удалось получить рекомендацию от sub-агента: {e}")
         
         # Формируем промпт для принятия решения
-        system_prompt = self.context_manager.get_system_prompt()
+        system_prompt = self._system_prompt
         user_message = self._build_user_message(context, task)
         
         messages = [
@@ -1259,21 +1428,16 @@ vision_analysis: "Кнопка: Найти"
             {"role": "user", "content": user_message}
         ]
         
-        # Проверяем размер запроса перед отправкой
-        from config import MAX_REQUEST_TOKENS
-        request_size = self.context_manager.estimate_request_size(
-            system_prompt, 
-            user_message, 
-            self.action_tools
-        )
+        # Проверяем размер запроса перед отправкой (system и tools посчитаны заранее)
+        tools_tokens = self._tools_tokens
+        system_tokens = self._system_tokens
+        request_size = tools_tokens + system_tokens + self.context_manager.token_optimizer.count_tokens(user_message)
         
         # Если запрос слишком большой - уменьшаем контекст
         if request_size > MAX_REQUEST_TOKENS:
             self.logger.warning(f"⚠️  Запрос слишком большой ({request_size} токенов), оптимизирую...")
             
             # Вычисляем сколько токенов нужно освободить
-            tools_tokens = self.context_manager.estimate_request_size("", "", self.action_tools)
-            system_tokens = self.context_manager.token_optimizer.count_tokens(system_prompt)
             available_for_context = MAX_REQUEST_TOKENS - tools_tokens - system_tokens - 500  # Запас 500 токенов
             
             if available_for_context > 0:
@@ -1284,12 +1448,8 @@ vision_analysis: "Кнопка: Найти"
                 user_message = self._build_user_message(context, task)
                 messages[1]["content"] = user_message
                 
-                # Проверяем еще раз
-                request_size = self.context_manager.estimate_request_size(
-                    system_prompt, 
-                    user_message, 
-                    self.action_tools
-                )
+                # Проверяем еще раз (пересчитываем только user message)
+                request_size = tools_tokens + system_tokens + self.context_manager.token_optimizer.count_tokens(user_message)
                 self.logger.info(f"📊 Размер запроса после оптимизации: {request_size} токенов")
             else:
                 self.logger.error(f"❌ Невозможно уместить запрос даже после оптимизации. Tools: {tools_tokens}, System: {system_tokens}")
@@ -1303,7 +1463,7 @@ vision_analysis: "Кнопка: Найти"
             # Обычно достаточно 500, но для task_complete может потребоваться больше
             max_response_tokens = 1500
             
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=OPENAI_MODEL,
                 messages=messages,
                 tools=self.action_tools,
@@ -1370,12 +1530,8 @@ vision_analysis: "Кнопка: Найти"
                     except json.JSONDecodeError as e2:
                         # Если не удалось исправить - пробуем извлечь хотя бы часть параметров
                         self.logger.warning(f"Не удалось исправить JSON полностью: {e2}")
-                        function_args = {}
-                        # Пробуем извлечь хотя бы простые параметры через регулярные выражения
-                        # Ищем простые пары ключ-значение
-                        simple_params = re.findall(r'"(\w+)":\s*"([^"]*)"', args_str)
-                        for key, value in simple_params:
-                            function_args[key] = value
+                        # Восстанавливаем наибольший валидный префикс объекта (до последнего целого ключа)
+                        function_args = _salvage_json_object(args_str)
                         if function_args:
                             self.logger.info(f"Извлечены частичные параметры: {list(function_args.keys())}")
                     except Exception as e2:
@@ -1399,11 +1555,14 @@ vision_analysis: "Кнопка: Найти"
             if message.content:
                 # Логируем полный текст для диагностики (не только первые 100 символов)
                 full_content = message.content
-                content_preview = full_content[:500] + ("..." if len(full_content) > 500 else "")
+                content_preview, rest_len = (
+                    (full_content[:500] + "...", len(full_content) - 500)
+                    if len(full_content) > 500 else (full_content, 0)
+                )
                 self.logger.error(f"КРИТИЧЕСКАЯ ОШИБКА: Модель вернула текст вместо вызова функции (tool_choice='required' не сработал)")
                 self.logger.error(f"Полный текст ответа модели ({len(full_content)} символов): {content_preview}")
-                if len(full_content) > 500:
-                    self.logger.error(f"... (пропущено {len(full_content) - 500} символов)")
+                if rest_len:
+                    self.logger.error(f"... (пропущено {rest_len} символов)")
                 return {
                     "success": False,
                     "error": f"Модель не вызвала функцию, хотя это обязательно. Получен текст: {content_preview}"
@@ -1420,7 +1579,13 @@ vision_analysis: "Кнопка: Найти"
                 "error": f"Ошибка при принятии решения: {str(e)}"
             }
     
-    async def _wait_for_dynamic_content(self, action_name: str, action_result: Dict[str, Any], max_wait: float = 3.0) -> None:
+    async def _wait_for_dynamic_content(
+        self,
+        action_name: str,
+        action_result: Dict[str, Any],
+        max_wait: float = 3.0,
+        navigate_extra_wait: float = 2.0
+    ) -> None:
         """
         Адаптивное ожидание загрузки динамического контента
         
@@ -1428,16 +1593,10 @@ vision_analysis: "Кнопка: Найти"
             action_name: Название действия
             action_result: Результат действия
             max_wait: Максимальное время ожидания в секундах
+            navigate_extra_wait: Дополнительное ожидание появления элементов после navigate (секунды)
         """
         # Базовое ожидание зависит от типа действия
-        base_delay = {
-            "navigate": 2.0,
-            "click_element": 1.5,
-            "type_text": 0.5,
-            "scroll": 1.0,
-            "search_on_page": 2.0,
-            "reload_page": 2.0
-        }.get(action_name, 1.0)
+        base_delay = _ACTION_BASE_DELAY.get(action_name, 1.0)
         
         # Если действие завершилось ошибкой - минимальное ожидание
         if not action_result.get("success", True):
@@ -1447,30 +1606,22 @@ vision_analysis: "Кнопка: Найти"
         # Ждем базовую задержку
         await asyncio.sleep(base_delay)
         
-        # Проверяем, загрузился ли контент (network idle или появление элементов)
+        page = self.browser.page
         try:
-            # Пытаемся дождаться network idle (если доступно)
-            try:
-                await self.browser.page.wait_for_load_state("networkidle", timeout=1000)
-                return  # Если network idle достигнут - выходим
-            except:
-                pass  # Если не удалось - продолжаем адаптивное ожидание
+            # После перехода сначала ждем появления интерактивных элементов (или модального окна):
+            # пока SPA не отрисовалась, пустой DOM тоже не меняется и выглядел бы готовым
+            if action_name in ("navigate", "reload_page"):
+                try:
+                    await page.wait_for_function(_CONTENT_READY_JS, timeout=int(navigate_extra_wait * 1000))
+                except Exception:
+                    pass
             
-            # Проверяем изменения страницы с адаптивным увеличением задержки
-            for attempt in range(3):
-                page_state = await self.page_extractor.get_page_state_hash()
-                interactive_count = page_state.get('interactive_count', 0)
-                modal_count = page_state.get('visible_modal_count', 0)
-                
-                # Если есть интерактивные элементы или модальные окна - контент загрузился
-                if interactive_count > 0 or modal_count > 0:
-                    return
-                
-                # Если это navigate и нет элементов - увеличиваем ожидание
-                if action_name == "navigate" and attempt < 2:
-                    await asyncio.sleep(1.0)
-                else:
-                    break
+            # Затем выходим по первому сигналу: network idle или DOM без изменений _DOM_QUIET_MS
+            # (на сайтах с постоянными запросами networkidle не наступает вовсе)
+            await _first_successful(
+                page.wait_for_load_state("networkidle", timeout=1000),
+                page.evaluate(_DOM_SETTLED_JS, [_DOM_QUIET_MS, 1000])
+            )
         except Exception:
             # В случае ошибки просто ждем базовую задержку
             pass
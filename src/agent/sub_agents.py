@@ -1,46 +1,168 @@
 """Специализированные sub-агенты для разных типов задач"""
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Tuple, Awaitable
+import asyncio
+import bisect
+import functools
+import hashlib
+import heapq
+import importlib.util
+import io
 import json
 import re
-from openai import OpenAI
-from config import OPENAI_API_KEY, OPENAI_MODEL
-
-
-class SubAgent:
-    """Базовый класс для sub-агентов"""
+import string
+import time
+import httpx
+import tiktoken
+from openai import AsyncOpenAI
+from config import (
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MODEL_FAST
+)
+
+# Ограничение одновременных запросов sub-агентов к OpenAI (защита от RPM лимитов)
+_MAX_CONCURRENT_REQUESTS = 16
+
+# Один клиент на все sub-агенты: общий пул keep-alive соединений и состояние ретраев.
+# Клиент (пул соединений httpx) и семафор привязаны к event loop, поэтому создаются
+# при первом запросе в каждом loop (см. _get_client), а не при импорте модуля.
+# Клиент прежнего loop закрывается при смене loop и при завершении (shutdown_client)
+_CLIENT: Optional[AsyncOpenAI] = None
+_REQUEST_SEMAPHORE: Optional[asyncio.Semaphore] = None
+_CLIENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def _close_client(client: AsyncOpenAI):
+    """Закрытие клиента OpenAI с его пулом соединений (ошибки закрытия игнорируются)"""
+    try:
+        await client.close()
+    except Exception:
+        # Соединения клиента могли остаться от уже закрытого event loop
+        pass
+
+
+async def _get_client() -> Tuple[AsyncOpenAI, asyncio.Semaphore]:
+    """
+    Общий клиент OpenAI и семафор параллелизма для текущего event loop
     
-    def __init__(self, name: str, system_prompt: str):
-        """
-        Инициализация sub-агента
-        
-        Args:
-            name: Имя агента
-            system_prompt: Системный промпт для агента
-        """
-        self.name = name
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.system_prompt = system_prompt
+    HTTP/2 (мультиплексирование параллельных запросов в одном соединении) включается,
+    только если установлен пакет h2 - без него httpx не поддерживает http2=True.
+    Клиент прежнего event loop закрывается перед созданием нового.
     
-    async def analyze(self, context: str, task: str) -> Dict[str, Any]:
-        """
-        Анализ контекста и задачи
+    Returns:
+        (клиент, семафор)
+    """
+    global _CLIENT, _REQUEST_SEMAPHORE, _CLIENT_LOOP
+    loop = asyncio.get_running_loop()
+    if _CLIENT_LOOP is not loop:
+        previous, _CLIENT_LOOP = _CLIENT, loop
+        _CLIENT = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            max_retries=2,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            http_client=httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+            )
+        )
+        _REQUEST_SEMAPHORE = asyncio.Semaphore(_MAX_CONCURRENT_REQUESTS)
+        if previous is not None:
+            await _close_client(previous)
+    return _CLIENT, _REQUEST_SEMAPHORE
+
+
+async def shutdown_client():
+    """Закрытие общего клиента OpenAI sub-агентов (при завершении программы)"""
+    global _CLIENT, _REQUEST_SEMAPHORE, _CLIENT_LOOP
+    client, _CLIENT = _CLIENT, None
+    _REQUEST_SEMAPHORE = None
+    _CLIENT_LOOP = None
+    if client is not None:
+        await _close_client(client)
+
+# Токенизатор для ограничения динамического контекста по токенам, а не по символам
+try:
+    _ENC = tiktoken.encoding_for_model(OPENAI_MODEL)
+except KeyError:
+    # Fallback на cl100k_base для неизвестных моделей
+    _ENC = tiktoken.get_encoding("cl100k_base")
+
+# Начало блока истории действий в контексте (TokenOptimizer.format_context): до него идут
+# URL, заголовок и элементы страницы, после - история, которая растет с каждым шагом
+_HISTORY_MARKER = "\nИстория последних действий:"
+# Начало записи истории ("  3. ✓ click_element")
+_HISTORY_RECORD_RE = re.compile(r'\n  \d+\. ')
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Обрезка текста по границе токенов с выравниванием по концу предложения
+    
+    Args:
+        text: Исходный текст
+        max_tokens: Максимальное количество токенов
         
-        Args:
-            context: Контекст страницы
-            task: Текущая задача
-            
-        Returns:
-            Результат анализа с рекомендациями
-        """
-        prompt = f"""<context>
-{context[:800]}
-</context>
+    Returns:
+        Текст не длиннее max_tokens токенов
+    """
+    tokens = _ENC.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    # Токен может резать многобайтовый символ - убираем символ замены
+    truncated = _ENC.decode(tokens[:max_tokens]).rstrip('\ufffd')
+    # Обрезаем по последнему концу строки (элементы идут по одному на строку), а без него -
+    # по концу предложения в хвосте (последние 100 символов)
+    tail_start = max(0, len(truncated) - 100)
+    line_end = truncated.rfind('\n', tail_start)
+    if line_end != -1:
+        return truncated[:line_end].rstrip()
+    sentence_end = truncated.rfind('.', tail_start)
+    if sentence_end != -1:
+        truncated = truncated[:sentence_end + 1]
+    return truncated
+
+
+# Адаптивный лимит ответа analyze: стартуем с малого max_tokens и увеличиваем его,
+# только если ответ обрезан (finish_reason == "length"). Повтор сразу получает не меньше
+# min_retry токенов: 150 -> 300 часто снова обрезается и стоит лишнего полного запроса
+_DEFAULT_MAX_TOKENS_RAMP = {"multiplier": 2.0, "min_retry": 500, "cap": 800, "max_attempts": 2}
+
+# Кэш результатов analyze: (агент, хеш контекста, хеш задачи) -> (время, результат)
+_RESULT_CACHE: Dict[tuple, tuple] = {}
+_RESULT_CACHE_MAX_SIZE = 256
+_RESULT_CACHE_TTL = 60.0  # секунды
+
+# Кэш ответов DOMSubAgent.query_dom: sha256(url, title, вопрос, отпечаток DOM) -> (время, результат)
+_DOM_ANSWER_CACHE: Dict[str, tuple] = {}
+_DOM_ANSWER_CACHE_MAX_SIZE = 512
+_DOM_ANSWER_CACHE_TTL = 600.0  # секунды
+
+
+# Общие для всех агентов анализа правила (динамический контент, предотвращение циклов).
+# Идут первым system-блоком - общий префикс запросов всех sub-агентов для prompt caching
+BASE_AGENT_PREAMBLE = """<dynamic_content>
+Динамический контент:
+- SPA/AJAX: учитывай задержки загрузки
+- Lazy loading: после scroll проверь новые элементы
+- Если элементов нет сразу - возможно нужна задержка
+</dynamic_content>
 
-<task>
-{task}
-</task>
+<loop_prevention>
+ПРЕДОТВРАЩЕНИЕ ЦИКЛОВ:
+
+Правила:
+- Если page_changed=false - НЕ повторяй действие
+- Если ошибка - НЕ повторяй без изменений
+- Если 2+ одинаковых действий - это цикл! Измени стратегию немедленно!
 
-<thinking>
+Стратегии при цикле:
+- extract_text не работает → scroll → другой элемент/описание
+- click_element не работает → другой элемент/прокрутка/альтернативный подход
+- navigate не работает → проверь URL, попробуй другой способ навигации
+</loop_prevention>"""
+
+
+# Общая инструкция анализа для SubAgent.analyze. Вынесена в константу, чтобы байты
+# префикса запроса не менялись между вызовами и попадали в prompt cache OpenAI
+STATIC_ANALYSIS_TEMPLATE = """<thinking>
 Проведи анализ по шагам:
 
 1. Текущее состояние:
@@ -73,22 +195,530 @@ class SubAgent:
 Предложи конкретные действия, кратко и конкретно. Укажи последовательность действий с обоснованием.
 </recommendation>"""
 
+
+# Стоп-слова, синонимы и шаблон ключевых слов для фильтрации элементов в DOMSubAgent
+_STOP_WORDS = frozenset({
+    'есть', 'ли', 'на', 'странице', 'какой', 'у', 'неё', 'него', 'какие', 'селектор', 'селекторы',
+    'элемент', 'элементы', 'кнопка', 'кнопки', 'поле', 'поля', 'рядом', 'с', 'первой', 'второй',
+    'третьей', 'после', 'до', 'в', 'для', 'как', 'что', 'где', 'когда', 'почему'
+})
+
+_SYNONYMS: Dict[str, List[str]] = {
+    'письмо': ['email', 'mail', 'message', 'letter', 'сообщение'],
+    'письма': ['emails', 'mails', 'messages', 'letters', 'сообщения'],
+    'вакансия': ['job', 'vacancy', 'работа'],
+    'вакансии': ['jobs', 'vacancies', 'работы'],
+    'список': ['list', 'списки'],
+    'элемент': ['item', 'элементы'],
+    'кнопка': ['button', 'btn'],
+    'ссылка': ['link', 'a']
+}
+
+# Разбиение вопроса на слова без regex: пунктуация заменяется пробелами (str.translate),
+# затем str.split; словом считается токен от 3 букв только из _KEYWORD_ALPHABET
+# (цифры и "_" не разделяют слова, как и \b в regex)
+_KEYWORD_SEPARATORS = str.maketrans(dict.fromkeys(
+    string.punctuation.replace('_', '') + '«»„“”‘’—–…№', ' '
+))
+_KEYWORD_ALPHABET = 'abcdefghijklmnopqrstuvwxyzабвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+# Ключевые слова, дающие бонус элементам соответствующего типа
+_BUTTON_KEYWORDS = frozenset({'кнопка', 'button', 'btn'})
+_LINK_KEYWORDS = frozenset({'ссылка', 'link'})
+_INPUT_KEYWORDS = frozenset({'поле', 'input', 'ввод'})
+_LIST_KEYWORDS = frozenset({'список', 'list', 'элемент', 'item', 'письмо', 'email', 'mail', 'message', 'вакансия', 'job', 'vacancy'})
+
+
+# Ключевые слова задачи для выбора типа sub-агента
+_NAV_KEYWORDS_RE = re.compile('|'.join(map(re.escape, ["найди", "перейди", "открой", "ссылка", "find", "navigate", "go to"])))
+_FORM_KEYWORDS_RE = re.compile('|'.join(map(re.escape, ["заполни", "введи", "форма", "поле", "fill", "form", "input", "register", "login"])))
+_READING_KEYWORDS_RE = re.compile('|'.join(map(re.escape, ["прочитай", "извлеки", "найди информацию", "read", "extract", "get information"])))
+
+
+@functools.lru_cache(maxsize=512)
+def _classify_task_agent_type(task: str) -> Optional[str]:
+    """
+    Тип агента, определяемый только по тексту задачи
+    
+    Returns:
+        "navigation" или "form" если задача однозначно на них указывает, иначе None
+        (тогда решение зависит от контекста страницы)
+    """
+    task_lower = task.lower()
+    if _NAV_KEYWORDS_RE.search(task_lower):
+        return "navigation"
+    if _FORM_KEYWORDS_RE.search(task_lower):
+        return "form"
+    return None
+
+
+# Типы элементов, которые не схлопываются как дубликаты (у каждого своя позиция/назначение)
+_UNMERGED_ELEMENT_TYPES = frozenset({'list_item', 'input'})
+# Атрибуты, делающие элемент без текста различимым
+_UNIQUE_ELEMENT_ATTRS = ('id', 'aria_label', 'href', 'name', 'placeholder', 'label', 'clickable_elements')
+
+
+def _elements_fingerprint(elements: List[Dict[str, Any]]) -> str:
+    """
+    Стабильный отпечаток набора элементов страницы по (type, selector, text) и состоянию
+    (видимость, модальное окно, форма) - открытие модального окна меняет ответ на вопрос
+    """
+    canonical = json.dumps(
+        [
+            (elem.get('type'), elem.get('selector'), elem.get('text'),
+             elem.get('visible'), elem.get('in_modal'), elem.get('in_form'))
+            for elem in elements
+        ],
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+# Бюджет токенов списка элементов в промпте query_dom (раньше - 5000 символов)
+_DOM_ELEMENTS_TOKEN_BUDGET = 2000
+
+# Статичные инструкции промпта DOMSubAgent.query_dom. Сжаты вручную: убраны повторы
+# (гибкий поиск, "рядом с X", запрет обратных кавычек); вместо пошагового <thinking>
+# короткая памятка - для поиска селектора рассуждения только увеличивают задержку
+_DOM_SEARCH_RUBRIC = """<rubric>
+- Ищи по частичному совпадению текста (регистр не важен); списки (письма, вакансии) - type="list_item" и clickable_elements внутри
+- "Кнопка рядом с X": найди X, затем кнопку в той же карточке/блоке; приоритет in_modal > in_form > остальные
+- Если вопрос о деталях, а страница - список, укажи это
+</rubric>"""
+
+_DOM_ANSWER_INSTRUCTIONS = """<answer>
+Ответь КРАТКО (2-3 предложения, 100-200 токенов), только факты с селекторами из списка <elements>.
+Формат: "Да/Нет, [краткое описание]. Селектор: [селектор]"
+
+- Если селектор есть в списке - ОБЯЗАТЕЛЬНО укажи его
+- Если точного совпадения нет - укажи наиболее похожий по тексту/типу/контексту элемент и его селектор
+- БЕЗ фраз "не указаны в (предоставленных) данных", БЕЗ "водных" фраз и длинных объяснений
+
+СЕЛЕКТОР (КРИТИЧЕСКИ ВАЖНО): копируй ТОЧНО как в списке элементов (#delete, .class-name, div.MessageListItem__root, input[data-qa='search']),
+ничего не меняй и не добавляй, БЕЗ обратных кавычек: "Селектор: div.MessageListItem__root", а НЕ "Селектор: `div.MessageListItem__root`"
+</answer>"""
+
+_DOM_STATIC_INSTRUCTIONS = f"{_DOM_SEARCH_RUBRIC}\n\n{_DOM_ANSWER_INSTRUCTIONS}"
+
+
+@functools.lru_cache(maxsize=256)
+def _line_prefix_tokens(index: int) -> int:
+    """Количество токенов префикса строки элемента "N. | " в промпте query_dom"""
+    return len(_ENC.encode(f"{index}. | "))
+
+
+def _is_search_input(elem: Dict[str, Any]) -> bool:
+    """Поле ввода, по атрибутам похожее на поле поиска"""
+    if elem.get('type') != 'input':
+        return False
+    attributes = ' '.join(
+        str(elem.get(attr) or '') for attr in ('selector', 'input_type', 'name', 'placeholder', 'label', 'text')
+    ).lower()
+    return 'search' in attributes or 'поиск' in attributes
+
+
+# Правила ответа на типовые вопросы DOMSubAgent без запроса к API:
+# (шаблон вопроса, описание для ответа, проверка элемента)
+_RULE_BASED_QUERIES = [
+    (re.compile(r'пол[еяю] поиска|строк[аиу] поиска|search (?:field|input|box)'), "поле поиска", _is_search_input),
+]
+# Вопросы с уточнением расположения требуют анализа контекста - только через LLM
+_CONTEXTUAL_QUERY_RE = re.compile(r'рядом|внутри|после|перед|около|в модальном|в форме|near|inside|after|before')
+
+
+# Простой вопрос на небольшой странице отправляется быстрой модели (OPENAI_MODEL_FAST)
+_FAST_MODEL_MAX_ELEMENTS = 30
+
+
+def _try_rule_based_answer(query: str, elements: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Детерминированный ответ на типовой вопрос о странице
+    
+    Args:
+        query: Вопрос о странице
+        elements: Интерактивные элементы страницы
+        
+    Returns:
+        Ответ в формате DOMSubAgent или None, если вопрос требует LLM
+    """
+    query_lower = query.lower()
+    if _CONTEXTUAL_QUERY_RE.search(query_lower):
+        return None
+    for pattern, description, predicate in _RULE_BASED_QUERIES:
+        if not pattern.search(query_lower):
+            continue
+        for elem in elements:
+            if elem.get('selector') and elem.get('visible') is not False and predicate(elem):
+                return f"Да, на странице есть {description}. Селектор: {elem['selector']}"
+        # Не нашли по атрибутам - пусть решает LLM (может найти похожий элемент)
+        return None
+    return None
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Первый JSON-объект в тексте (допускаются обертка ```json и текст вокруг объекта)
+    
+    Returns:
+        Словарь или None, если ни с одной "{" не начинается корректный объект
+    """
+    start = text.find("{")
+    while start != -1:
         try:
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=400,
-                temperature=0.3
+            data, _ = _JSON_DECODER.raw_decode(text, start)
+        except ValueError:
+            start = text.find("{", start + 1)
+            continue
+        if isinstance(data, dict):
+            return data
+        start = text.find("{", start + 1)
+    return None
+
+
+def _recommendation_complete(text: str) -> bool:
+    """Ответ analyze содержит закрытый блок рекомендации - дальше только лишние токены"""
+    return "</recommendation>" in text
+
+
+def _dom_answer_complete(text: str) -> bool:
+    """
+    Ответ DOMSubAgent завершен: после "Селектор: <селектор>" идет пустая строка
+    
+    Конец предложения не считается концом ответа - после селектора часто идут
+    пояснения и альтернативные селекторы. Без пустой строки ответ ограничивает max_tokens
+    """
+    selector_pos = text.find("Селектор:")
+    if selector_pos == -1:
+        return False
+    return "\n\n" in text[selector_pos:]
+
+
+def _json_object_complete(text: str) -> bool:
+    """Ответ содержит завершенный JSON-объект"""
+    if not text.rstrip().endswith("}"):
+        return False
+    start = text.find("{")
+    if start == -1:
+        return False
+    try:
+        _JSON_DECODER.raw_decode(text, start)
+    except ValueError:
+        return False
+    return True
+
+
+def _build_inverted_index(values: List[str]) -> Dict[str, Any]:
+    """
+    Инвертированный индекс: слово (по пробельным символам) -> номера значений, где оно встречается
+    
+    Кроме индекса хранятся все слова одной строкой (через перевод строки) и смещения начала каждого
+    слова - поиск подстроки по всем словам выполняется одним str.find на уровне C.
+    """
+    postings: Dict[str, List[int]] = {}
+    for position, value in enumerate(values):
+        for token in set(value.split()):
+            postings.setdefault(token, []).append(position)
+    tokens = list(postings)
+    starts = []
+    offset = 0
+    for token in tokens:
+        starts.append(offset)
+        offset += len(token) + 1
+    return {"postings": postings, "tokens": tokens, "starts": starts, "text": "\n".join(tokens)}
+
+
+def _match_postings(index: Dict[str, Any], keyword: str) -> set:
+    """
+    Номера значений, содержащих keyword как подстроку
+    
+    Ключевое слово не содержит пробелов, поэтому оно входит в значение тогда и только
+    тогда, когда входит в одно из его слов - достаточно найти его в строке словаря.
+    """
+    text = index["text"]
+    starts = index["starts"]
+    tokens = index["tokens"]
+    postings = index["postings"]
+    matched = set()
+    pos = text.find(keyword)
+    while pos != -1:
+        token_index = bisect.bisect_right(starts, pos) - 1
+        token = tokens[token_index]
+        matched.update(postings[token])
+        # Слово уже учтено - продолжаем поиск со следующего
+        pos = text.find(keyword, starts[token_index] + len(token) + 1)
+    return matched
+
+
+class _PendingBatch:
+    """
+    Объединение одновременных вопросов с одинаковым ключом в один вызов
+    
+    Вопрос без запроса в полете по своему ключу выполняется сразу, без ожидания.
+    Вопросы, пришедшие, пока запрос по ключу выполняется, собираются в следующий
+    батч: он запускается одним вызовом run_batch после завершения текущего.
+    """
+    
+    def __init__(self):
+        # Ключ -> событие завершения запроса, который сейчас выполняется
+        self._running: Dict[Any, asyncio.Event] = {}
+        # Ключ -> вопросы, ожидающие завершения текущего запроса
+        self._waiting: Dict[Any, List[tuple]] = {}
+    
+    async def submit(
+        self,
+        key: Any,
+        query: str,
+        run_batch: Callable[[List[str]], Awaitable[List[Any]]]
+    ) -> Any:
+        """
+        Добавление вопроса в батч
+        
+        Args:
+            key: Ключ батча (вопросы с разными ключами не объединяются)
+            query: Вопрос
+            run_batch: Корутина, отвечающая на список вопросов списком результатов в том же порядке
+            
+        Returns:
+            Результат для этого вопроса
+        """
+        batch = self._waiting.get(key)
+        if batch is not None:
+            future = asyncio.get_running_loop().create_future()
+            batch.append((query, future))
+            return await future
+        
+        batch = [(query, None)]
+        try:
+            running = self._running.get(key)
+            if running is not None:
+                # По ключу уже идет запрос - собираем вопросы до его завершения
+                self._waiting[key] = batch
+                try:
+                    await running.wait()
+                finally:
+                    if self._waiting.get(key) is batch:
+                        del self._waiting[key]
+            
+            done = self._running[key] = asyncio.Event()
+            try:
+                results = await run_batch([item[0] for item in batch])
+            finally:
+                done.set()
+                if self._running.get(key) is done:
+                    del self._running[key]
+        except BaseException as e:
+            # Ожидающие вопросы не должны зависнуть при ошибке или отмене первого
+            for _, future in batch[1:]:
+                if not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else RuntimeError("Батч вопросов отменен"))
+            raise
+        for (_, future), result in zip(batch[1:], results[1:]):
+            if not future.done():
+                future.set_result(result)
+        return results[0]
+
+
+class SubAgent:
+    """Базовый класс для sub-агентов"""
+    
+    def __init__(
+        self,
+        name: str,
+        system_prompt: str,
+        initial_max_tokens: int = 150,
+        context_token_budget: int = 500
+    ):
+        """
+        Инициализация sub-агента
+        
+        Args:
+            name: Имя агента
+            system_prompt: Системный промпт для агента
+            initial_max_tokens: Стартовый лимит токенов ответа в analyze
+            context_token_budget: Сколько последних токенов контекста попадает в запрос
+        """
+        self.name = name
+        self.system_prompt = system_prompt
+        self.initial_max_tokens = initial_max_tokens
+        self.context_token_budget = context_token_budget
+    
+    async def _create_completion(self, **kwargs):
+        """Запрос к chat.completions через общий клиент с ограничением параллелизма"""
+        client, semaphore = await _get_client()
+        async with semaphore:
+            return await client.chat.completions.create(**kwargs)
+    
+    def _truncate_context(self, context: str, token_budget: Optional[int] = None) -> str:
+        """
+        Ограничение контекста по токенам с сохранением шапки страницы
+        
+        URL, заголовок и верхние (самые релевантные) элементы сохраняются всегда - они
+        обрезаются с конца по границе предложения. Скользящее окно применяется только
+        к истории действий: от нее остаются последние записи, так что размер запроса
+        остается постоянным на длинной сессии. Истории отводится не больше трети бюджета,
+        если шапке не хватает места. Контекст - динамическая часть запроса и должен
+        идти после статичных блоков (prompt caching).
+        
+        Args:
+            context: Контекст страницы
+            token_budget: Лимит токенов (по умолчанию context_token_budget агента)
+            
+        Returns:
+            Контекст не длиннее token_budget токенов
+        """
+        if token_budget is None:
+            token_budget = self.context_token_budget
+        head, marker, history = context.partition(_HISTORY_MARKER)
+        head_tokens = len(_ENC.encode(head))
+        history_tokens = _ENC.encode(history) if marker else []
+        marker_tokens = len(_ENC.encode(marker)) if marker else 0
+        if head_tokens + marker_tokens + len(history_tokens) <= token_budget:
+            return context
+        
+        # Бюджет истории: остаток после шапки, но не меньше трети общего бюджета
+        history_budget = 0
+        if history_tokens:
+            history_budget = min(
+                len(history_tokens),
+                max(token_budget - head_tokens - marker_tokens, token_budget // 3 - marker_tokens, 0)
             )
+        head = _truncate_to_tokens(head, token_budget - history_budget - (marker_tokens if history_budget else 0))
+        if not history_budget:
+            return head
+        
+        if history_budget < len(history_tokens):
+            # Токен может резать многобайтовый символ - убираем символ замены;
+            # неполная первая запись отбрасывается целиком
+            history = _ENC.decode(history_tokens[-history_budget:]).lstrip('\ufffd')
+            record_start = _HISTORY_RECORD_RE.search(history)
+            history = history[record_start.start():] if record_start else ""
+        return head + marker + history
+    
+    async def _stream_completion(
+        self,
+        is_complete: Callable[[str], bool],
+        **kwargs
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Потоковый запрос к chat.completions с досрочной остановкой
+        
+        Args:
+            is_complete: Проверка накопленного текста - True, если остаток ответа не нужен
+            **kwargs: Параметры chat.completions.create
             
-            return {
+        Returns:
+            (текст ответа, finish_reason); при досрочной остановке finish_reason = "stop"
+        """
+        client, semaphore = await _get_client()
+        async with semaphore:
+            stream = await client.chat.completions.create(stream=True, **kwargs)
+            parts = []
+            finish_reason = None
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+                        if is_complete("".join(parts)):
+                            # Нужный блок получен - закрываем соединение, не дожидаясь генерации остатка
+                            finish_reason = "stop"
+                            break
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+            finally:
+                await stream.close()
+        return "".join(parts), finish_reason
+    
+    def _build_analysis_messages(self, context: str, task: str) -> List[Dict[str, str]]:
+        """Формирование сообщений для анализа контекста и задачи"""
+        # Общая преамбула и статичная инструкция идут отдельными system-блоками вокруг
+        # system_prompt агента, динамические context/task - только в конце (стабильный префикс для prompt caching)
+        prompt = f"""<context>
+{self._truncate_context(context)}
+</context>
+
+<task>
+{task}
+</task>"""
+        return [
+            {"role": "system", "content": BASE_AGENT_PREAMBLE},
+            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": STATIC_ANALYSIS_TEMPLATE},
+            {"role": "user", "content": prompt}
+        ]
+    
+    async def analyze(
+        self,
+        context: str,
+        task: str,
+        max_tokens_ramp: Optional[Dict[str, float]] = None
+    ) -> Dict[str, Any]:
+        """
+        Анализ контекста и задачи
+        
+        Args:
+            context: Контекст страницы
+            task: Текущая задача
+            max_tokens_ramp: Параметры повтора при обрезке ответа
+                (multiplier, min_retry, cap, max_attempts), по умолчанию _DEFAULT_MAX_TOKENS_RAMP
+            
+        Returns:
+            Результат анализа с рекомендациями (truncated=True, если ответ обрезан
+            даже после всех попыток)
+        """
+        # Точный повтор (тот же агент, контекст и задача) в пределах TTL - без запроса к API
+        cache_key = (
+            self.name,
+            hashlib.blake2b(context.encode(), digest_size=16).digest(),
+            hashlib.blake2b(task.encode(), digest_size=16).digest()
+        )
+        cached = _RESULT_CACHE.get(cache_key)
+        if cached and time.monotonic() - cached[0] < _RESULT_CACHE_TTL:
+            return {**cached[1], "from_cache": True}
+        
+        ramp = {**_DEFAULT_MAX_TOKENS_RAMP, **(max_tokens_ramp or {})}
+        
+        try:
+            messages = self._build_analysis_messages(context, task)
+            max_tokens = self.initial_max_tokens
+            for _ in range(max(1, int(ramp["max_attempts"]))):
+                analysis, finish_reason = await self._stream_completion(
+                    _recommendation_complete,
+                    model=OPENAI_MODEL,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.3
+                )
+                truncated = finish_reason == "length"
+                if not truncated or max_tokens >= ramp["cap"]:
+                    break
+                # Ответ обрезан - повторяем с увеличенным лимитом
+                max_tokens = min(
+                    int(ramp["cap"]),
+                    max(int(ramp["min_retry"]), int(max_tokens * ramp["multiplier"]))
+                )
+            
+            result = {
                 "success": True,
-                "analysis": response.choices[0].message.content.strip(),
+                "analysis": analysis.strip(),
                 "agent": self.name
             }
+            if truncated:
+                # Обрезанный ответ не кэшируем, чтобы повторный вызов мог получить полный
+                result["truncated"] = True
+                return result
+            _RESULT_CACHE.pop(cache_key, None)
+            _RESULT_CACHE[cache_key] = (time.monotonic(), result)
+            # Ограничиваем размер кэша (удаляем самую старую запись)
+            if len(_RESULT_CACHE) > _RESULT_CACHE_MAX_SIZE:
+                del _RESULT_CACHE[next(iter(_RESULT_CACHE))]
+            return result
         except Exception as e:
             return {
                 "success": False,
@@ -119,12 +749,7 @@ class NavigationAgent(SubAgent):
    - Приоритет: модальные окна > формы > основной контент
 
 2. Проверка результата:
-   - Если page_changed=false - НЕ повторяй действие
    - Предложи альтернативу: scroll, другой элемент, поиск
-
-3. Динамический контент:
-   - SPA/AJAX: учитывай задержки загрузки
-   - Lazy loading: после scroll проверь новые элементы
 </analysis>
 
 <examples>
@@ -212,8 +837,7 @@ class ReadingAgent(SubAgent):
    - Предложи следующий шаг задачи
    - Если page_changed=false после extract_text - другой подход
 
-3. Динамический контент:
-   - Lazy loading: после scroll проверь новые элементы
+3. Прокрутка:
    - Если is_at_bottom=true - не прокручивай дальше
 </analysis>
 
@@ -263,44 +887,27 @@ class DecisionAgent(SubAgent):
    - Если 2+ одинаковых действий БЕЗ page_changed - это цикл!
    - Были ли ошибки? Как их обработал?
 
-3. Динамический контент:
-   - SPA/AJAX: учитывай задержки загрузки
-   - Lazy loading: после scroll проверь новые элементы
-   - Если элементов нет сразу - возможно нужна задержка
-
-4. Планирование:
+3. Планирование:
    - Какое действие максимально приблизит к цели?
    - Отличается ли от последних действий?
    - Если страница не изменилась - нужен СОВЕРШЕННО ДРУГОЙ подход
 
-5. Самокритика:
+4. Самокритика:
    - Достигнет ли это действие прогресса?
    - Не повторяет ли последние действия?
    - Учитывает ли динамический контент?
    - Есть ли альтернативные подходы?
 </analysis_process>
 
-<loop_prevention>
-ПРЕДОТВРАЩЕНИЕ ЦИКЛОВ:
-
-Правила:
-- Если page_changed=false - НЕ повторяй действие
-- Если ошибка - НЕ повторяй без изменений
-- Если 2+ одинаковых действий - это цикл! Измени стратегию немедленно!
-
-Стратегии при цикле:
-- extract_text не работает → scroll → другой элемент/описание
-- click_element не работает → другой элемент/прокрутка/альтернативный подход
-- navigate не работает → проверь URL, попробуй другой способ навигации
-</loop_prevention>
-
 <recommendations>
 Рекомендации должны:
 - Продвигать задачу к цели
 - Избегать повторений последних действий
 - Учитывать динамический контент
 - Если задача выполнена - предложить task_complete
-</recommendations>"""
+</recommendations>""",
+            # Решения обычно развернутые - стартуем с большего лимита
+            initial_max_tokens=300
         )
 
 
@@ -354,7 +961,25 @@ class SubAgentManager:
             agent = self.agents["decision"]
         
         return await agent.analyze(context, task)
-
+    
+    def ingest_page(self, page_info: Dict[str, Any]):
+        """
+        Передать DOM Sub-agent'у элементы обновленной страницы для предварительной нормализации
+        
+        Args:
+            page_info: Информация о странице (словарь с элементами, URL, и т.д.)
+        """
+        if not self.enable_sub_agents:
+            return
+        agent = self.agents.get("dom")
+        if agent:
+            agent.ingest_page(page_info)
+    
+    def invalidate_cache(self):
+        """Сброс кэшей результатов sub-агентов и ответов DOM Sub-agent'а (вызывается после изменения страницы)"""
+        _RESULT_CACHE.clear()
+        _DOM_ANSWER_CACHE.clear()
+    
     async def query_dom(self, query: str, context: str, page_info: Dict[str, Any]) -> Dict[str, Any]:
         """
         Задать конкретный вопрос о структуре страницы DOM Sub-agent'у
@@ -396,22 +1021,17 @@ class SubAgentManager:
         Returns:
             Тип агента
         """
-        task_lower = task.lower()
-        context_lower = context.lower()
+        # Классификация по задаче кэшируется - задача не меняется между итерациями
+        task_agent_type = _classify_task_agent_type(task)
+        if task_agent_type:
+            return task_agent_type
         
-        # Проверка на навигацию
-        nav_keywords = ["найди", "перейди", "открой", "ссылка", "find", "navigate", "go to"]
-        if any(keyword in task_lower for keyword in nav_keywords):
-            return "navigation"
-        
-        # Проверка на работу с формами
-        form_keywords = ["заполни", "введи", "форма", "поле", "fill", "form", "input", "register", "login"]
-        if any(keyword in task_lower or keyword in context_lower for keyword in form_keywords):
+        # Проверка на работу с формами по контексту страницы
+        if _FORM_KEYWORDS_RE.search(context.lower()):
             return "form"
         
         # Проверка на чтение информации
-        reading_keywords = ["прочитай", "извлеки", "найди информацию", "read", "extract", "get information"]
-        if any(keyword in task_lower for keyword in reading_keywords):
+        if _READING_KEYWORDS_RE.search(task.lower()):
             return "reading"
         
         # По умолчанию используем DecisionAgent
@@ -421,6 +1041,9 @@ class SubAgentManager:
 class DOMSubAgent(SubAgent):
     """Агент для ответов на конкретные вопросы о структуре страницы и элементах"""
     
+    # Сколько самых релевантных элементов возвращает фильтрация и показывает query_dom
+    TOP_K = 20
+    
     def __init__(self):
         super().__init__(
             "DOMSubAgent",
@@ -428,139 +1051,52 @@ class DOMSubAgent(SubAgent):
 Эксперт по анализу структуры веб-страниц и ответам на вопросы о элементах. Ты отвечаешь на конкретные вопросы о структуре страницы, находишь элементы по описанию и предоставляешь селекторы.
 </role>
 
-<task>
-Отвечать на вопросы о структуре страницы, находить элементы по описанию, предоставлять селекторы, анализировать состояние элементов.
-</task>
-
-<analysis_process>
-Chain-of-Thought процесс (думай пошагово):
-
-ШАГ 1: Анализ типа страницы
-   - Список элементов (list_item, card) или детальная страница?
-   - Есть ли элементы с type="list_item" в списке элементов?
-   - Сколько элементов списка видно?
-   - Если вопрос о деталях, но страница - список - найди элементы списка!
-
-ШАГ 2: Понимание вопроса
-   - Что именно спрашивается? (элемент, селектор, состояние, элемент списка)
-   - Какие ключевые слова в вопросе? (письмо, вакансия, кнопка, список и т.д.)
-   - Есть ли упоминание "список", "элементы списка", "письма", "вакансии"?
-
-ШАГ 3: Поиск элементов (ВСЕГДА используй селекторы из списка!)
-   - Сначала найди элементы с type="list_item" если вопрос про список
-   - Ищи в интерактивных элементах (button, link, input, list_item)
-   - Проверь clickable_elements внутри list_item если есть
-   - Приоритет: элементы in_modal > элементы in_form > основной контент
-   - Используй частичное совпадение текста (case-insensitive)
-   - Если точного совпадения нет - найди наиболее похожий элемент И УКАЖИ ЕГО СЕЛЕКТОР
-
-ШАГ 4: Формирование ответа
-   - Естественным языком, КРАТКО но ДЕТАЛЬНО (максимум 2-3 предложения)
-   - ВСЕГДА включай селекторы из списка элементов - НИКОГДА не говори "не указаны в данных"
-   - ВСЕГДА описывай визуальное состояние элементов (текст, иконки, стрелки, счетчики, состояние) когда это релевантно для понимания функциональности
-   - Если элемент не найден точно - найди похожий и укажи его селектор с объяснением
-   - БЕЗ "воды", только факты с селекторами и описанием визуального состояния
-</analysis_process>
-
 <search_rules>
-КРИТИЧЕСКИ ВАЖНО: Используй ГИБКИЙ ПОИСК по частичному совпадению текста!
-
-ПРАВИЛА ПОИСКА:
-1. ЧАСТИЧНОЕ СОВПАДЕНИЕ ТЕКСТА:
-   - Ищи элементы по ЧАСТИЧНОМУ совпадению текста (не только точное совпадение)
-   - Регистр НЕ важен: "Откликнуться" = "откликнуться" = "ОТКЛИКНУТЬСЯ"
-   - Игнорируй лишние пробелы и знаки препинания
-   - Примеры: "Откликнуться" найдет "Откликнуться", "откликнуться", "Откликнуться на вакансию"
-   
-2. КОНТЕКСТНЫЙ ПОИСК:
-   - Если вопрос про "кнопку рядом с первой вакансией GO разработчика":
-     * Сначала найди элементы, связанные с "GO разработчик" или "Go разработчик"
-     * Затем найди кнопки рядом с этими элементами (в том же контейнере/карточке)
-     * Учитывай структуру: элементы в одной карточке/блоке находятся рядом
-   - Если вопрос про "кнопку в форме" - ищи элементы с in_form=true
-   - Если вопрос про "кнопку в модальном окне" - ищи элементы с in_modal=true
-   
-3. ПОИСК ПОХОЖИХ ЭЛЕМЕНТОВ:
-   - Если точного совпадения нет - найди наиболее похожий элемент
-   - Учитывай тип элемента (button, link, input)
-   - Учитывай контекст (рядом с чем находится элемент)
-   - Учитывай aria-label, title, data-атрибуты если они есть
+- Учитывай тип элемента (button, link, input, list_item), aria-label, title и data-атрибуты
+- Элементы одной карточки/блока находятся рядом: "кнопка в форме" - in_form=true, "в модальном окне" - in_modal=true
+- Если элемент не найден точно - найди наиболее похожий и укажи его селектор с кратким объяснением
+- Если элемента нет среди найденных - скажи, что нужна прокрутка страницы
 </search_rules>
 
 <answer_rules>
-КРИТИЧЕСКИ ВАЖНО: ВСЕГДА используй селекторы из списка элементов! НИКОГДА не говори "не указаны в данных"!
-
-ПРАВИЛА ОТВЕТА:
-- Прямо на вопрос, естественным языком, МАКСИМУМ 2-3 предложения
-- ВСЕГДА селекторы из списка элементов - если элемент есть в списке, ОБЯЗАТЕЛЬНО укажи его селектор
-- ВСЕГДА описывай визуальное состояние элементов (текст, иконки, стрелки, счетчики, состояние) когда это релевантно для понимания функциональности
-- Наличие: "да/нет" + селектор + описание визуального состояния (что отображается, какие иконки, стрелки, счетчики)
-- Селектор: конкретный селектор БЕЗ лишних слов, формат: "Селектор: [селектор]"
-- Визуальное состояние: опиши что отображается на элементе (текст, иконки, стрелки, счетчики, состояние) - это помогает понять функциональность
-- Состояние: кратко (текст, счетчики, видимость) + селектор + описание визуального состояния
-- Несколько элементов: перечисли с селекторами и описанием визуального состояния, формат: "[селектор1] (что отображается), [селектор2] (что отображается)"
-- Элементы списков: если вопрос про список - найди элементы с type="list_item" и укажи их селекторы + описание визуального состояния
-- Если элемент не найден точно - найди наиболее похожий в списке и укажи его селектор + кратко объясни почему
-- Не найден: кратко почему (1 предложение максимум)
-- БЕЗ фраз "не указаны в предоставленных данных", "не указаны в данных", "отсутствуют в списке" - ВСЕГДА используй селекторы!
-- БЕЗ длинных объяснений, БЕЗ формальной структуры, БЕЗ "водных" фраз
-
-ЗАПРЕЩЕНО:
-✗ "На странице видны вакансии Go разработчика, но конкретные селекторы для этих вакансий не указаны в предоставленных данных..."
-✗ "Селекторы не указаны в данных"
-✗ "Отсутствуют в списке элементов"
-✗ Длинные объяснения без селекторов
-
-ОБЯЗАТЕЛЬНО:
-✓ Найди элементы в списке (даже если они не идеально совпадают) и укажи их селекторы
-✓ Если есть элементы с type="list_item" - используй их для ответов про списки
-✓ Если элемент не найден точно - найди похожий и укажи его селектор
+- Когда это важно для понимания функциональности, описывай визуальное состояние элемента: текст, иконки, стрелки, счетчики
+- Несколько элементов перечисляй с селекторами: "[селектор1] (что отображается), [селектор2] (что отображается)"
 </answer_rules>
 
 <examples>
-✗ ПЛОХО (много воды):
-"На странице видны вакансии Go разработчика, но конкретные селекторы для этих вакансий не указаны в предоставленных данных. Однако, в видимом тексте упоминается вакансия 'Golang-разработчик в DevPlatform...'"
-
-✓ ХОРОШО (кратко, по делу, с описанием визуального состояния):
-"Да, есть вакансии Go разработчика. Первая вакансия: селектор .vacancy-card:first-child, кнопка 'Откликнуться': селектор .vacancy-card:first-child .apply-btn"
+✗ ПЛОХО (много воды, нет селекторов):
+"На странице видны вакансии Go разработчика, но конкретные селекторы для этих вакансий не указаны в предоставленных данных..."
 
-✓ ХОРОШО (с описанием визуального состояния):
-"Да, есть кнопка 'Откликнуться'. Селектор: .vacancy-card:first-child .apply-btn"
+✓ ХОРОШО:
+"Да, есть кнопка 'Откликнуться' рядом с первой вакансией. Вакансия: .vacancy-item:first-child, кнопка: .vacancy-item:first-child .apply-button"
 
-✓ ХОРОШО (с описанием визуального состояния):
+✓ ХОРОШО (несколько элементов):
 "3 кнопки: #submit-btn (Отправить), .cancel-btn (Отмена), .close-btn (Закрыть)"
 
-✓ ХОРОШО (с описанием визуального состояния):
-"Форма открылась. Поля: input[name='email'], input[name='password'], кнопка: button[type='submit']"
-
-✓ ОТЛИЧНО (детальное описание визуального состояния):
-"Да, есть кнопка с адресом доставки (.context_235.24342) в шапке сайта. Отображается: 'Такой то адрес' с иконкой геолокации и стрелкой вниз, что указывает на возможность изменить адрес."
-
-✓ ОТЛИЧНО (детальное описание счетчика):
+✓ ХОРОШО (визуальное состояние):
 "Счетчик корзины показывает число 1. Селектор: .cart-counter. Отображается: 'В корзину 388 ₽' с иконкой корзины."
 
-✓ ОТЛИЧНО (детальное описание кнопки):
-"Есть кнопка добавления в корзину. Селектор: .add-to-cart-btn. Отображается: текст '+ 1' с иконкой плюса, что указывает на возможность добавить товар."
-
-✓ ХОРОШО (если не найден точно):
-"Похожий элемент: .vacancy-item:first-child (возможно это вакансия Go разработчика). Селектор кнопки: .vacancy-item:first-child .btn-apply"
-
-✓ ХОРОШО (если не найден):
-"Нет. Нужна прокрутка страницы"
-
-✓ ХОРОШО (частичное совпадение):
-"Да, есть кнопка с текстом 'Откликнуться на вакансию'. Селектор: .vacancy-card:first-child button"
-
-✓ ХОРОШО (контекстный поиск):
-"Да, есть кнопка 'Откликнуться' рядом с первой вакансией. Вакансия: .vacancy-item:first-child, кнопка: .vacancy-item:first-child .apply-button"
-
 ✓ ХОРОШО (элементы списков):
 "Да, есть список писем. Первое письмо: селектор [role='listitem']:first-child, кликабельный элемент внутри: a.mail-link"
 
 ✓ ХОРОШО (похожий элемент вместо "не найдено"):
 "Похожий элемент: .mail-item:first-child (возможно это письмо). Селектор: .mail-item:first-child"
-</examples>"""
+
+✓ ХОРОШО (не найден):
+"Нет. Нужна прокрутка страницы"
+</examples>""",
+            initial_max_tokens=300,
+            # Вопросы о DOM требуют больше контекста страницы
+            context_token_budget=1500
         )
+        # (элементы, колонки) последней обработанной страницы
+        self._page_columns: Optional[tuple] = None
+        # (исходные элементы, элементы без дубликатов) последней обработанной страницы
+        self._merged_elements: Optional[tuple] = None
+        # id(элемент) -> (элемент, описание, токены описания) для элементов текущей страницы
+        self._element_descriptions: Dict[int, tuple] = {}
+        # Сбор вопросов к одной странице, пришедших во время запроса, в следующий запрос
+        self._pending_batch = _PendingBatch()
     
     def _filter_elements_by_relevance(self, elements: List[Dict[str, Any]], query: str) -> List[Dict[str, Any]]:
         """
@@ -571,122 +1107,210 @@ Chain-of-Thought процесс (думай пошагово):
             query: Вопрос пользователя
             
         Returns:
-            Отфильтрованный и отсортированный список элементов по релевантности
+            До TOP_K элементов, отсортированных по релевантности
         """
         # Защита от None: если elements равен None, заменяем на пустой список
-        if elements is None:
-            elements = []
+        elements = elements or []
         
         # Извлекаем ключевые слова из вопроса (убираем стоп-слова)
         query_lower = query.lower()
-        stop_words = {'есть', 'ли', 'на', 'странице', 'какой', 'у', 'неё', 'него', 'какие', 'селектор', 'селекторы', 
-                     'элемент', 'элементы', 'кнопка', 'кнопки', 'поле', 'поля', 'рядом', 'с', 'первой', 'второй',
-                     'третьей', 'после', 'до', 'в', 'для', 'как', 'что', 'где', 'когда', 'почему'}
-        
-        # Словарь синонимов для улучшения поиска
-        synonyms = {
-            'письмо': ['email', 'mail', 'message', 'letter', 'сообщение'],
-            'письма': ['emails', 'mails', 'messages', 'letters', 'сообщения'],
-            'вакансия': ['job', 'vacancy', 'работа'],
-            'вакансии': ['jobs', 'vacancies', 'работы'],
-            'список': ['list', 'списки'],
-            'элемент': ['item', 'элементы'],
-            'кнопка': ['button', 'btn'],
-            'ссылка': ['link', 'a']
-        }
         
         # Извлекаем значимые слова из вопроса
-        words = re.findall(r'\b[а-яёa-z]{3,}\b', query_lower)
-        keywords = [w for w in words if w not in stop_words]
+        words = query_lower.translate(_KEYWORD_SEPARATORS).split()
+        keywords = [
+            w for w in words
+            if len(w) >= 3 and not w.strip(_KEYWORD_ALPHABET) and w not in _STOP_WORDS
+        ]
         
         # Расширяем ключевые слова синонимами
         expanded_keywords = set(keywords)
         for keyword in keywords:
-            if keyword in synonyms:
-                expanded_keywords.update(synonyms[keyword])
+            keyword_synonyms = _SYNONYMS.get(keyword)
+            if keyword_synonyms:
+                expanded_keywords.update(keyword_synonyms)
         keywords = list(expanded_keywords)
         
-        # Если нет ключевых слов, возвращаем все элементы
+        # Если нет ключевых слов, возвращаем первые TOP_K элементов в порядке страницы
         if not keywords:
-            return elements
+            return elements[:self.TOP_K]
         
-        # Вычисляем релевантность каждого элемента
-        scored_elements = []
-        for elem in elements:
-            score = 0
-            elem_text = (elem.get('text', '') or '').lower()
-            elem_type = (elem.get('type', '') or '').lower()
-            elem_selector = (elem.get('selector', '') or '').lower()
-            elem_aria_label = (elem.get('aria_label', '') or '').lower() if elem.get('aria_label') else ''
-            
-            # Проверяем совпадение ключевых слов
+        # Колонки страницы строятся один раз на набор элементов и переиспользуются между вопросами
+        columns = self._get_page_columns(elements)
+        
+        # Веса типов элементов не зависят от конкретного элемента - считаем один раз на вопрос
+        type_bonus = {
+            'button': 5 * sum(1 for keyword in keywords if keyword in _BUTTON_KEYWORDS),
+            'link': 5 * sum(1 for keyword in keywords if keyword in _LINK_KEYWORDS),
+            'input': 5 * sum(1 for keyword in keywords if keyword in _INPUT_KEYWORDS),
+            # Высокий бонус за элементы списков
+            'list_item': 15 * sum(1 for keyword in keywords if keyword in _LIST_KEYWORDS)
+        }
+        
+        # Стартуем с бонусов, не зависящих от вопроса (модальное окно, форма, id, list_item),
+        # и добавляем совпадения ключевых слов по инвертированному индексу каждой колонки:
+        # текст 10, селектор 3, aria-label 8, родительский контейнер 7
+        scores = [
+            static + type_bonus.get(elem_type, 0)
+            for static, elem_type in zip(columns["static_scores"], columns["types"])
+        ]
+        for weight, index in (
+            (10, columns["text_index"]),
+            (3, columns["selector_index"]),
+            (8, columns["aria_label_index"]),
+            (7, columns["container_index"])
+        ):
             for keyword in keywords:
-                # Точное совпадение в тексте элемента
-                if keyword in elem_text:
-                    score += 10
-                # Частичное совпадение (подстрока)
-                elif any(keyword in word for word in elem_text.split()):
-                    score += 5
-                # Совпадение в селекторе
-                if keyword in elem_selector:
-                    score += 3
-                # Совпадение в aria-label
-                if keyword in elem_aria_label:
-                    score += 8
-                # Совпадение типа элемента с ключевыми словами
-                if keyword in ['кнопка', 'button', 'btn'] and elem_type == 'button':
-                    score += 5
-                if keyword in ['ссылка', 'link'] and elem_type == 'link':
-                    score += 5
-                if keyword in ['поле', 'input', 'ввод'] and elem_type == 'input':
-                    score += 5
-                # Бонус за элементы списков (list_item)
-                if keyword in ['список', 'list', 'элемент', 'item', 'письмо', 'email', 'mail', 'message', 'вакансия', 'job', 'vacancy'] and elem_type == 'list_item':
-                    score += 15  # Высокий бонус за элементы списков
-                
-                # Бонус за совпадение в родительском контейнере (для контекстного поиска)
-                parent_container = elem.get('parent_container')
-                if parent_container:
-                    container_text = (parent_container.get('text_preview', '') or '').lower()
-                    if keyword in container_text:
-                        score += 7  # Элемент находится в контейнере, релевантном к вопросу
-                
-                # Проверяем кликабельные элементы внутри list_item
-                if elem_type == 'list_item':
-                    clickable_elements = elem.get('clickable_elements', [])
-                    # Защита от None: если clickable_elements равен None, заменяем на пустой список
-                    if clickable_elements is None:
-                        clickable_elements = []
-                    for clickable in clickable_elements:
-                        clickable_text = (clickable.get('text', '') or '').lower()
-                        if keyword in clickable_text:
-                            score += 10  # Бонус за совпадение в кликабельных элементах списка
+                for i in _match_postings(index, keyword):
+                    scores[i] += weight
+        
+        # Кликабельные элементы внутри list_item (10 за каждое совпадение в каждом из них)
+        clickable_owners = columns["clickable_owners"]
+        for keyword in keywords:
+            for clickable_id in _match_postings(columns["clickable_index"], keyword):
+                scores[clickable_owners[clickable_id]] += 10
+        
+        # Ни одного релевантного элемента - порядок страницы сохраняется, куча не нужна
+        if max(scores, default=0) <= 0:
+            return elements[:self.TOP_K]
+        
+        # Выбираем TOP_K индексов по релевантности (от большего к меньшему, при равенстве - порядок страницы)
+        order = heapq.nlargest(self.TOP_K, range(len(scores)), key=scores.__getitem__)
+        return [elements[i] for i in order]
+    
+    def _get_page_columns(self, elements: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Колонки нормализованных полей элементов страницы
+        
+        Текстовые поля хранятся как инвертированные индексы (слово -> номера элементов),
+        типы и бонусы - как параллельные списки. Для того же списка элементов возвращает
+        ранее построенные колонки, иначе строит их заново (см. ingest_page).
+        
+        Args:
+            elements: Список элементов страницы
             
-            # Бонус за элементы в модальных окнах (высокий приоритет)
+        Returns:
+            Словарь колонок, номер в индексах и списках совпадает с индексом элемента
+        """
+        if self._page_columns is not None and self._page_columns[0] is elements:
+            return self._page_columns[1]
+        
+        texts = []
+        selectors = []
+        aria_labels = []
+        containers = []
+        types = []
+        static_scores = []
+        clickable_texts = []
+        clickable_owners = []
+        for i, elem in enumerate(elements):
+            elem_type = (elem.get('type') or '').lower()
+            texts.append((elem.get('text') or '').lower())
+            selectors.append((elem.get('selector') or '').lower())
+            aria_labels.append((elem.get('aria_label') or '').lower())
+            parent_container = elem.get('parent_container')
+            containers.append((parent_container.get('text_preview') or '').lower() if parent_container else '')
+            types.append(elem_type)
+            
+            # Бонусы, не зависящие от вопроса: модальное окно 20, форма 10, id 5, list_item 5
+            static_score = 0
             if elem.get('in_modal'):
-                score += 20
-            # Бонус за элементы в формах
+                static_score += 20
             if elem.get('in_form'):
-                score += 10
-            # Бонус за элементы с id
+                static_score += 10
             if elem.get('id'):
-                score += 5
-            # Бонус за элементы списков (list_item) - они важны для поиска элементов в списках
+                static_score += 5
             if elem_type == 'list_item':
-                score += 5
+                static_score += 5
+                for clickable in (elem.get('clickable_elements') or []):
+                    clickable_texts.append((clickable.get('text') or '').lower())
+                    clickable_owners.append(i)
+            static_scores.append(static_score)
+        
+        columns = {
+            "text_index": _build_inverted_index(texts),
+            "selector_index": _build_inverted_index(selectors),
+            "aria_label_index": _build_inverted_index(aria_labels),
+            "container_index": _build_inverted_index(containers),
+            "types": types,
+            "static_scores": static_scores,
+            # Индекс по текстам кликабельных элементов list_item и владелец каждого из них
+            "clickable_index": _build_inverted_index(clickable_texts),
+            "clickable_owners": clickable_owners
+        }
+        self._page_columns = (elements, columns)
+        return columns
+    
+    def ingest_page(self, page_info: Dict[str, Any]):
+        """
+        Предварительная нормализация элементов страницы (один раз на обновление страницы)
+        
+        Args:
+            page_info: Информация о странице (словарь с элементами, URL, и т.д.)
+        """
+        self._get_page_columns(self._merge_equivalent_elements(page_info.get("interactive_elements") or []))
+    
+    def _merge_equivalent_elements(self, elements: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Схлопывание функционально эквивалентных элементов перед формированием промпта
+        
+        Элементы одного типа с одинаковым нормализованным текстом в одном родительском
+        контейнере объединяются в первый из них (селекторы остальных сохраняются
+        в duplicate_selectors). Контейнеры без текста и без уникальных атрибутов
+        отбрасываются. Элементы списков и поля ввода не объединяются.
+        
+        Args:
+            elements: Список элементов страницы
             
-            scored_elements.append((score, elem))
+        Returns:
+            Список элементов без дубликатов (тот же список, если объединять нечего)
+        """
+        if self._merged_elements is not None and self._merged_elements[0] is elements:
+            return self._merged_elements[1]
+        # Новая страница - описания элементов прежней больше не понадобятся
+        self._element_descriptions.clear()
         
-        # Сортируем по релевантности (от большего к меньшему)
-        scored_elements.sort(key=lambda x: x[0], reverse=True)
+        merged = []
+        by_key: Dict[tuple, int] = {}
+        changed = False
+        for elem in elements:
+            elem_type = elem.get('type')
+            text = ' '.join((elem.get('text') or '').lower().split())
+            if elem_type in _UNMERGED_ELEMENT_TYPES:
+                merged.append(elem)
+                continue
+            if not text and not any(elem.get(attr) for attr in _UNIQUE_ELEMENT_ATTRS):
+                # Чистый контейнер - не несет информации для ответа
+                changed = True
+                continue
+            if not text:
+                merged.append(elem)
+                continue
+            parent_container = elem.get('parent_container')
+            key = (elem_type, parent_container.get('selector') if parent_container else None, text)
+            position = by_key.get(key)
+            if position is None:
+                by_key[key] = len(merged)
+                merged.append(elem)
+                continue
+            # Дубликат: копируем первый элемент (исходный page_info не изменяется) и дописываем селектор
+            original = merged[position]
+            if 'duplicate_selectors' not in original:
+                original = merged[position] = {**original, 'duplicate_selectors': []}
+            if elem.get('selector'):
+                original['duplicate_selectors'].append(elem['selector'])
+            changed = True
         
-        # Возвращаем элементы (без score)
-        return [elem for score, elem in scored_elements]
+        result = merged if changed else elements
+        self._merged_elements = (elements, result)
+        return result
     
     def _format_element_info(self, elem: Dict[str, Any], index: int) -> str:
         """
         Форматирование информации об элементе с большим контекстом
         
+        Описание элемента (без индекса) строится один раз и переиспользуется
+        во всех вопросах к той же странице.
+        
         Args:
             elem: Элемент для форматирования
             index: Индекс элемента
@@ -694,27 +1318,56 @@ Chain-of-Thought процесс (думай пошагово):
         Returns:
             Отформатированная строка с информацией об элементе
         """
-        parts = [f"{index}."]
+        description = self._get_element_description(elem)[0]
+        return f"{index}. | {description}" if description else f"{index}."
+    
+    def _get_element_description(self, elem: Dict[str, Any]) -> Tuple[str, int]:
+        """
+        Описание элемента и его длина в токенах (считаются один раз на страницу)
+        
+        Returns:
+            (описание без индекса, количество токенов описания)
+        """
+        cached = self._element_descriptions.get(id(elem))
+        if cached is not None and cached[0] is elem:
+            return cached[1], cached[2]
+        description = self._describe_element(elem)
+        tokens = len(_ENC.encode(description))
+        # Элемент хранится вместе с описанием - его id не может быть переиспользован
+        self._element_descriptions[id(elem)] = (elem, description, tokens)
+        return description, tokens
+    
+    def _describe_element(self, elem: Dict[str, Any]) -> str:
+        """Описание элемента для промпта (поля через " | ", без индекса)"""
+        parts = []
+        # Каждое поле читается из словаря один раз
+        text = elem.get("text")
+        selector = elem.get("selector")
+        elem_type = elem.get("type")
+        tag = elem.get("tag")
+        elem_id = elem.get("id")
+        aria_label = elem.get("aria_label")
+        clickable_elements = elem.get("clickable_elements") or []
         
         # Текст элемента (не обрезаем слишком агрессивно)
-        if elem.get("text"):
-            text = elem.get('text', '').strip()
+        if text:
+            text = text.strip()
             # Ограничиваем до 200 символов вместо 100
             if len(text) > 200:
                 text = text[:200] + "..."
             parts.append(f"Текст: '{text}'")
         
         # Селектор (обязательно)
-        if elem.get("selector"):
-            parts.append(f"Селектор: {elem.get('selector')}")
+        if selector:
+            parts.append(f"Селектор: {selector}")
         
         # Тип элемента
-        if elem.get("type"):
-            parts.append(f"Тип: {elem.get('type')}")
+        if elem_type:
+            parts.append(f"Тип: {elem_type}")
         
         # Тег
-        if elem.get("tag"):
-            parts.append(f"Тег: {elem.get('tag')}")
+        if tag:
+            parts.append(f"Тег: {tag}")
         
         # Контекстная информация
         context_parts = []
@@ -724,27 +1377,30 @@ Chain-of-Thought процесс (думай пошагово):
             context_parts.append("в форме")
         if elem.get('visible') is False:
             context_parts.append("невидим")
-        if elem.get('id'):
-            context_parts.append(f"id={elem.get('id')}")
-        if elem.get('aria_label'):
-            context_parts.append(f"aria-label='{elem.get('aria_label')[:50]}'")
+        if elem_id:
+            context_parts.append(f"id={elem_id}")
+        if aria_label:
+            context_parts.append(f"aria-label='{aria_label[:50]}'")
+        duplicate_selectors = elem.get('duplicate_selectors')
+        if duplicate_selectors:
+            context_parts.append(f"такие же элементы: {', '.join(duplicate_selectors[:3])}")
         
         # Информация о родительском контейнере (для контекстного поиска)
         parent_container = elem.get('parent_container')
         if parent_container:
-            container_text = parent_container.get('text_preview', '')
+            container_text = parent_container.get('text_preview')
             if container_text:
                 # Берем первые 50 символов текста контейнера
                 container_preview = container_text[:50] + ("..." if len(container_text) > 50 else "")
                 context_parts.append(f"в контейнере '{container_preview}'")
         
         # Информация о элементах списков (list_item)
-        if elem.get('type') == 'list_item':
-            if elem.get('list_index') is not None:
-                context_parts.append(f"индекс в списке: {elem.get('list_index')}")
-            if elem.get('clickable_elements'):
-                clickable_count = len(elem.get('clickable_elements', []))
-                context_parts.append(f"кликабельных элементов внутри: {clickable_count}")
+        if elem_type == 'list_item':
+            list_index = elem.get('list_index')
+            if list_index is not None:
+                context_parts.append(f"индекс в списке: {list_index}")
+            if clickable_elements:
+                context_parts.append(f"кликабельных элементов внутри: {len(clickable_elements)}")
             if elem.get('is_clickable'):
                 context_parts.append("сам элемент кликабелен")
         
@@ -752,14 +1408,10 @@ Chain-of-Thought процесс (думай пошагово):
             parts.append(f"({', '.join(context_parts)})")
         
         # Для элементов списков добавляем информацию о кликабельных элементах внутри
-        if elem.get('type') == 'list_item' and elem.get('clickable_elements'):
+        if elem_type == 'list_item' and clickable_elements:
             clickable_info = []
-            clickable_elements = elem.get('clickable_elements', [])
-            # Защита от None: если clickable_elements равен None, заменяем на пустой список
-            if clickable_elements is None:
-                clickable_elements = []
             for clickable in clickable_elements[:3]:  # Показываем первые 3
-                clickable_text = clickable.get('text', '')[:30]
+                clickable_text = (clickable.get('text') or '')[:30]
                 clickable_selector = clickable.get('selector', '')
                 if clickable_text:
                     clickable_info.append(f"{clickable.get('type')} '{clickable_text}' ({clickable_selector})")
@@ -783,68 +1435,114 @@ Chain-of-Thought процесс (думай пошагово):
             Результат с ответом на вопрос
         """
         # Формируем информацию о странице для анализа
-        interactive_elements = page_info.get("interactive_elements", [])
         # Защита от None: если interactive_elements равен None, заменяем на пустой список
-        if interactive_elements is None:
-            interactive_elements = []
+        interactive_elements = page_info.get("interactive_elements") or []
+        url = page_info.get("url", "")
+        title = page_info.get("title", "")
+        fingerprint = _elements_fingerprint(interactive_elements)
+        
+        # Тот же вопрос на той же странице (URL, заголовок, набор элементов) - ответ из кэша
+        cache_key = hashlib.sha256("\x00".join((
+            str(url),
+            str(title),
+            query.lower().strip(),
+            fingerprint
+        )).encode()).hexdigest()
+        cached = _DOM_ANSWER_CACHE.get(cache_key)
+        if cached and time.monotonic() - cached[0] < _DOM_ANSWER_CACHE_TTL:
+            return {**cached[1], "from_cache": True}
+        
+        # Типовой вопрос с однозначным ответом по атрибутам элементов - без запроса к API
+        rule_based_answer = _try_rule_based_answer(query, interactive_elements)
+        if rule_based_answer:
+            return {
+                "success": True,
+                "answer": rule_based_answer,
+                "agent": "DOMSubAgent",
+                "rule_based": True
+            }
+        
+        # Одновременные вопросы к той же странице (и тому же контексту) объединяются в один запрос
+        page_key = (url, title, fingerprint, hashlib.blake2b(context.encode(), digest_size=16).digest())
+        result = await self._pending_batch.submit(
+            page_key,
+            query,
+            functools.partial(self._answer_dom_queries, context=context, page_info=page_info)
+        )
+        
+        if result.get("success"):
+            _DOM_ANSWER_CACHE.pop(cache_key, None)
+            _DOM_ANSWER_CACHE[cache_key] = (time.monotonic(), result)
+            # Ограничиваем размер кэша (удаляем самую старую запись)
+            if len(_DOM_ANSWER_CACHE) > _DOM_ANSWER_CACHE_MAX_SIZE:
+                del _DOM_ANSWER_CACHE[next(iter(_DOM_ANSWER_CACHE))]
+        return result
+    
+    async def _answer_dom_queries(
+        self,
+        queries: List[str],
+        context: str,
+        page_info: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """
+        Ответы на вопросы о странице одним запросом к API
+        
+        Args:
+            queries: Вопросы о странице (один или несколько, собранные _PendingBatch)
+            context: Контекст страницы (текстовое описание)
+            page_info: Информация о странице (словарь с элементами, URL, и т.д.)
+            
+        Returns:
+            Результаты в порядке вопросов
+        """
+        interactive_elements = page_info.get("interactive_elements") or []
         visible_text = page_info.get("visible_text_preview", "")
         url = page_info.get("url", "")
         title = page_info.get("title", "")
+        # Для нескольких вопросов релевантность считается по всем сразу
+        query = " ".join(queries)
+        if len(queries) == 1:
+            question_text = queries[0]
+        else:
+            question_text = "\n".join(f"{i}. {q}" for i, q in enumerate(queries, 1))
         
-        # Умная фильтрация элементов по релевантности к вопросу
-        filtered_elements = self._filter_elements_by_relevance(interactive_elements, query)
-        # Защита от None: если filtered_elements равен None, заменяем на пустой список
-        if filtered_elements is None:
-            filtered_elements = []
-        
-        # Формируем список элементов для анализа с улучшенным форматированием
-        elements_info = []
-        # Берем больше элементов (до 200), но приоритизированных по релевантности
-        max_elements = min(200, len(filtered_elements))
-        for i, elem in enumerate(filtered_elements[:max_elements], 1):
-            elem_desc = self._format_element_info(elem, i)
-            elements_info.append(elem_desc)
+        # Эквивалентные элементы схлопываются до фильтрации - меньше токенов в промпте
+        merged_elements = self._merge_equivalent_elements(interactive_elements)
         
-        elements_text = "\n".join(elements_info) if elements_info else "Нет интерактивных элементов"
+        # Умная фильтрация элементов по релевантности к вопросу
+        # (колонки элементов переиспользуются, если страница уже была обработана через ingest_page)
+        filtered_elements = self._filter_elements_by_relevance(merged_elements, query)
         
-        # Динамически определяем лимит на основе размера (минимум 2000 символов, максимум 5000)
-        # Это позволяет включить больше элементов, если они релевантны, но не перегружать промпт
-        elements_text_limit = min(5000, max(2000, len(elements_text)))
-        elements_text_truncated = elements_text[:elements_text_limit]
+        # Формируем список элементов для анализа с улучшенным форматированием:
+        # до TOP_K элементов по убыванию релевантности, пока укладываемся в бюджет токенов
+        # (форматирование прекращается, как только следующий элемент не помещается)
+        # Строки пишутся сразу в один буфер, без промежуточного списка и join
+        elements_buffer = io.StringIO()
+        max_elements = 0
+        used_tokens = 0
+        for i, elem in enumerate(filtered_elements[:self.TOP_K], 1):
+            elem_desc = self._format_element_info(elem, i)
+            # Токены описания закэшированы на страницу - кодируется только префикс с индексом
+            elem_tokens = self._get_element_description(elem)[1] + _line_prefix_tokens(i) + 1  # +1 на перевод строки
+            if used_tokens + elem_tokens > _DOM_ELEMENTS_TOKEN_BUDGET:
+                break
+            if max_elements:
+                elements_buffer.write("\n")
+            elements_buffer.write(elem_desc)
+            max_elements += 1
+            used_tokens += elem_tokens
         
-        if len(elements_text) > elements_text_limit:
+        elements_text_truncated = elements_buffer.getvalue() if max_elements else "Нет интерактивных элементов"
+        if max_elements < min(self.TOP_K, len(filtered_elements)):
             elements_text_truncated += f"\n... (показано {max_elements} из {len(interactive_elements)} элементов, отсортированных по релевантности)"
         
         
-        prompt = f"""<question>
-{query}
-</question>
-
-<page_info>
+        # Только динамические данные: инструкции идут отдельным статичным system-блоком
+        prompt = f"""<page_info>
 URL: {url}
 Заголовок: {title}
 </page_info>
 
-<thinking>
-1. Определи тип страницы по элементам (список vs детальная)
-   - Если вопрос о деталях, но страница - список - укажи это!
-
-2. Проанализируй вопрос:
-   - Что спрашивается? (элемент, селектор, состояние)
-   - Какие ключевые слова в вопросе? (извлеки существительные и действия)
-   - Есть ли контекст? (например, "рядом с вакансией", "в форме", "в модальном окне")
-   - Соответствует ли типу страницы?
-
-3. Найди элементы используя ГИБКИЙ ПОИСК:
-   - Если вопрос про список (письма, вакансии и т.д.) - сначала найди элементы с type="list_item"
-   - Ищи по ЧАСТИЧНОМУ совпадению текста (регистр не важен)
-   - Если вопрос про "кнопку рядом с X" - найди сначала X, затем кнопки рядом с ним
-   - Для элементов списков проверь clickable_elements внутри list_item
-   - Учитывай контекст: элементы в одной карточке/блоке находятся рядом
-   - Приоритет: элементы in_modal > элементы in_form > остальные
-   - Ищи в интерактивных элементах (button, link, input, list_item), формах, visible_text_preview
-</thinking>
-
 <elements>
 Элементы (показано {max_elements} наиболее релевантных из {len(interactive_elements)}, отсортированы по релевантности к вопросу):
 {elements_text_truncated}
@@ -855,57 +1553,95 @@ URL: {url}
 </visible_text>
 
 <context>
-{context[:800]}
+{self._truncate_context(context)}
 </context>
 
-<answer>
-Ответь естественным языком, КРАТКО (максимум 2-3 предложения, 100-200 токенов), ВСЕГДА включай селекторы из списка элементов выше.
-
-КРИТИЧЕСКИ ВАЖНО:
-- Используй ГИБКИЙ ПОИСК: ищи по частичному совпадению текста (регистр не важен)
-- Если вопрос про "кнопку рядом с X" - найди сначала X, затем кнопки в том же контексте/карточке
-- Если селектор есть в списке элементов - ОБЯЗАТЕЛЬНО укажи его
-- Если элемент не найден точно - найди наиболее похожий по тексту/типу/контексту и укажи его селектор
-- БЕЗ фраз "не указаны в данных" или "не указаны в предоставленных данных"
-- БЕЗ длинных объяснений, только факты с селекторами
-- Формат: "Да/Нет, [краткое описание]. Селектор: [селектор]"
-
-ФОРМАТ СЕЛЕКТОРОВ (КРИТИЧЕСКИ ВАЖНО!):
-- Если селектор начинается с # - используй как есть: "Селектор: #delete" (БЕЗ обратных кавычек!)
-- Если селектор начинается с . - используй как есть: "Селектор: .class-name" (БЕЗ обратных кавычек!)
-- Если селектор содержит тег и класс - используй как есть: "Селектор: div.MessageListItem__root" (БЕЗ обратных кавычек!)
-- Если селектор содержит атрибуты - используй как есть: "Селектор: input[data-qa='search']" (БЕЗ обратных кавычек!)
-- ВСЕГДА используй селектор ТОЧНО как он указан в списке элементов выше!
-- НЕ изменяй селектор, НЕ добавляй лишние пробелы или символы!
-- НЕ используй обратные кавычки вокруг селектора! Используй формат: "Селектор: div.MessageListItem__root" а НЕ "Селектор: `div.MessageListItem__root`"
-
-БЕЗ "водных" фраз, БЕЗ формальной структуры, БЕЗ длинных объяснений!
-</answer>"""
-
+<question>
+{question_text}
+</question>"""
+        if len(queries) > 1:
+            prompt += f"""
+
+<output_format>
+Вопросов несколько ({len(queries)}). Ответь строго в JSON: {{"answers": ["ответ на вопрос 1", "ответ на вопрос 2", ...]}} - по одному ответу на каждый вопрос в том же порядке, формат каждого ответа как описано выше.
+</output_format>"""
+
+        # Неизменный префикс (system_prompt + инструкции) одинаков во всех вызовах query_dom
+        # и попадает в prompt cache OpenAI; страница и вопрос - только в конце
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": _DOM_STATIC_INSTRUCTIONS},
+            {"role": "user", "content": prompt}
+        ]
+        # Мало элементов и нет уточнений расположения ("рядом с", "в модальном") - быстрая модель
+        is_simple = len(filtered_elements) < _FAST_MODEL_MAX_ELEMENTS and not any(
+            _CONTEXTUAL_QUERY_RE.search(q.lower()) for q in queries
+        )
+        model = OPENAI_MODEL_FAST if is_simple else OPENAI_MODEL
+        
+        if len(queries) > 1:
+            try:
+                response = await self._create_completion(
+                    model=model,
+                    messages=messages,
+                    max_tokens=200 * len(queries),
+                    temperature=0.3,
+                    response_format={"type": "json_object"}
+                )
+                answers = json.loads(response.choices[0].message.content).get("answers")
+                if not isinstance(answers, list):
+                    answers = []
+            except Exception as e:
+                return [{"success": False, "error": str(e), "agent": "DOMSubAgent"} for _ in queries]
+            results = []
+            for i in range(len(queries)):
+                if i < len(answers) and answers[i]:
+                    results.append({"success": True, "answer": str(answers[i]).strip(), "agent": "DOMSubAgent"})
+                else:
+                    results.append({"success": False, "error": "Нет ответа на вопрос в общем ответе", "agent": "DOMSubAgent"})
+            return results
+        
         try:
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
+            # Поток обрывается на первой пустой строке после "Селектор:" - остальное не используется
+            answer, _ = await self._stream_completion(
+                _dom_answer_complete,
+                model=model,
+                messages=messages,
                 max_tokens=200,  # Краткие ответы без воды, только факты с селекторами
                 temperature=0.3
             )
+            answer = answer.strip()
             
-            answer = response.choices[0].message.content.strip()
-            
-            return {
+            return [{
                 "success": True,
                 "answer": answer,
                 "agent": "DOMSubAgent"
-            }
+            }]
         except Exception as e:
-            return {
+            return [{
                 "success": False,
                 "error": str(e),
                 "agent": "DOMSubAgent"
-            }
+            }]
+
+
+# Structured output для OutcomeAgent: сервер гарантирует JSON по схеме
+_OUTCOME_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "outcome",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "resume_wizard": {"type": "boolean"},
+                "reason": {"type": "string"}
+            },
+            "required": ["resume_wizard", "reason"],
+            "additionalProperties": False
+        }
+    }
+}
 
 
 class OutcomeAgent(SubAgent):
@@ -914,7 +1650,8 @@ class OutcomeAgent(SubAgent):
     def __init__(self):
         super().__init__(
             "OutcomeAgent",
-            "Ты эксперт по оценке результата действий. Определи, ведет ли текущая страница к мастеру создания резюме или к реальному процессу отклика."
+            "Ты эксперт по оценке результата действий. Определи, ведет ли текущая страница к мастеру создания резюме или к реальному процессу отклика.",
+            context_token_budget=200
         )
 
     async def evaluate_outcome(self, context: str, task: str, last_action: str) -> Dict[str, Any]:
@@ -925,29 +1662,39 @@ class OutcomeAgent(SubAgent):
 {last_action}
 
 === СОСТОЯНИЕ СТРАНИЦЫ ПОСЛЕ ДЕЙСТВИЯ ===
-{context}
+{self._truncate_context(context)}
 
 Ответь строго в JSON:
 {{
   "resume_wizard": true/false,  # true если страница похожа на мастер создания/редактирования резюме
-  "reason": "краткое объяснение"
+  "reason": "краткое объяснение (одно предложение)"
 }}
 """
         try:
-            response = self.client.chat.completions.create(
+            # Поток обрывается на закрывающей скобке JSON-объекта
+            content, _ = await self._stream_completion(
+                _json_object_complete,
                 model=OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": self.system_prompt},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=150,
-                temperature=0
+                # Схема ограничивает ответ двумя полями; запас на reason на русском
+                # (около 2 токенов на слово), чтобы JSON не обрезался по лимиту
+                max_tokens=120,
+                temperature=0,
+                response_format=_OUTCOME_RESPONSE_FORMAT
             )
-            content = response.choices[0].message.content.strip()
-            try:
-                data = json.loads(content)
-            except json.JSONDecodeError:
-                data = {"resume_wizard": False, "reason": content[:100]}
+            content = content.strip()
+            # Сервер гарантирует JSON по схеме; ошибка разбора возможна только при обрезке по max_tokens
+            data = _parse_json_object(content)
+            if data is None:
+                # Не маскируем неразобранный ответ под "не мастер резюме" - возвращаем ошибку
+                return {
+                    "success": False,
+                    "resume_wizard": False,
+                    "error": f"Не удалось разобрать JSON ответа: {content[:100]}"
+                }
             return {
                 "success": True,
                 "resume_wizard": bool(data.get("resume_wizard", False)),
@@ -1,50 +1,703 @@
 """Контроллер браузера на базе Playwright"""
-from playwright.async_api import async_playwright, Browser, BrowserContext, Page
-from typing import Optional, Dict, Any
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Locator
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from typing import Optional, Dict, Any, Set
 import asyncio
-from config import BROWSER_TYPE, HEADLESS, BROWSER_TIMEOUT
+import json
+import re
+import secrets
+from config import BROWSER_TYPE, HEADLESS, BROWSER_TIMEOUT, BLOCK_RESOURCES
+
+
+# Простые селекторы (#id или имя тега): клик по ним выполняется напрямую через page.click
+# без цепочки locator(...).first
+_SIMPLE_SELECTOR_RE = re.compile(r'^(?:#[\w-]+|[a-zA-Z][\w-]*)$')
+
+# Один процесс драйвера Playwright на всю программу (общий для всех контроллеров)
+# Экземпляр привязан к event loop, в котором запущен: в новом loop драйвер запускается заново.
+# Драйвер останавливается, когда его освобождает последний пользователь
+_PLAYWRIGHT = None
+_PLAYWRIGHT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_PLAYWRIGHT_LOCK: Optional[asyncio.Lock] = None
+_PLAYWRIGHT_USERS = 0
+
+
+async def get_playwright():
+    """
+    Получение общего экземпляра Playwright (драйвер запускается один раз)
+    
+    Каждый вызов должен завершаться release_playwright()
+    
+    Returns:
+        Запущенный экземпляр Playwright
+    """
+    global _PLAYWRIGHT, _PLAYWRIGHT_LOOP, _PLAYWRIGHT_LOCK, _PLAYWRIGHT_USERS
+    loop = asyncio.get_running_loop()
+    if _PLAYWRIGHT_LOOP is not loop:
+        _PLAYWRIGHT = None
+        _PLAYWRIGHT_LOOP = loop
+        _PLAYWRIGHT_LOCK = asyncio.Lock()
+        _PLAYWRIGHT_USERS = 0
+    async with _PLAYWRIGHT_LOCK:
+        if _PLAYWRIGHT is None:
+            _PLAYWRIGHT = await async_playwright().start()
+            _PLAYWRIGHT_USERS = 0
+        _PLAYWRIGHT_USERS += 1
+        return _PLAYWRIGHT
+
+
+async def release_playwright(playwright):
+    """
+    Освобождение общего драйвера Playwright: останавливается, когда его больше никто не использует
+    
+    Args:
+        playwright: Экземпляр, полученный через get_playwright()
+    """
+    global _PLAYWRIGHT, _PLAYWRIGHT_USERS
+    # Драйвер уже остановлен или перезапущен в другом loop - счетчик относится к новому
+    if playwright is None or playwright is not _PLAYWRIGHT:
+        return
+    async with _PLAYWRIGHT_LOCK:
+        if playwright is not _PLAYWRIGHT:
+            return
+        _PLAYWRIGHT_USERS = max(_PLAYWRIGHT_USERS - 1, 0)
+        if _PLAYWRIGHT_USERS > 0:
+            return
+        _PLAYWRIGHT = None
+        try:
+            await playwright.stop()
+        except Exception:
+            # Игнорируем ошибки при остановке (драйвер может быть уже остановлен)
+            pass
+
+
+async def shutdown_playwright():
+    """Принудительная остановка общего драйвера Playwright (при завершении программы)"""
+    global _PLAYWRIGHT, _PLAYWRIGHT_USERS
+    playwright, _PLAYWRIGHT = _PLAYWRIGHT, None
+    _PLAYWRIGHT_USERS = 0
+    if playwright:
+        try:
+            await playwright.stop()
+        except Exception:
+            # Игнорируем ошибки при остановке (драйвер может быть уже остановлен)
+            pass
+
+
+# Размер дискового кэша Chromium для persistent session (байты): статика сайтов
+# переживает перезапуск и не скачивается заново при повторных переходах
+_PERSISTENT_DISK_CACHE_SIZE = 256 * 1024 * 1024
+
+# Максимум закэшированных locator'ов на страницу (SPA может долго жить без навигации)
+_LOCATOR_CACHE_MAX_SIZE = 256
+
+# Общий JS поиска прокручиваемого контейнера (для SPA типа Яндекс Почты)
+# Сначала проверяются типичные контейнеры прокрутки по тегу/роли/классу; полный обход
+# нужен, только если среди них нет достаточно большого. TreeWalker пропускает элементы
+# без достаточной прокручиваемой области до вызова getComputedStyle, а поиск
+# останавливается на первом "достаточно большом" контейнере
+_FIND_SCROLL_CONTAINER_JS = """
+    const findScrollContainer = () => {
+        const windowScrollHeight = (document.scrollingElement || document.documentElement).scrollHeight;
+        const windowScrollableArea = windowScrollHeight > window.innerHeight ? (windowScrollHeight - window.innerHeight) : 0;
+        const goodEnoughArea = window.innerHeight * 3;
+        const minArea = Math.max(500, windowScrollableArea * 0.3);
+        // Ненулевые offsetWidth/offsetHeight уже исключают display: none у элемента и предков,
+        // offsetParent отсекает отключенные ветки без пересчета стилей. offsetParent равен null
+        // также у html/body и у position: fixed - только для последних нужен getComputedStyle
+        const isVisible = (el) => {
+            if (el.offsetWidth <= 100 || el.offsetHeight <= 100) return false;
+            if (el.offsetParent !== null || el === document.body || el === document.documentElement) return true;
+            return window.getComputedStyle(el).position === 'fixed';
+        };
+        
+        // Быстрый путь: кандидаты по индексируемым селекторам; стиль проверяется
+        // только у кандидатов в порядке убывания области, до первого видимого
+        const candidates = [];
+        const candidatesSelector = 'main, [role="main"], #main, #content, .main, .content, body > div, ' +
+                                   '[data-scroll], [class*="scroll" i], [class*="overflow" i]';
+        for (const el of document.querySelectorAll(candidatesSelector)) {
+            const area = el.scrollHeight - el.clientHeight;
+            if (area > goodEnoughArea && area > minArea) {
+                candidates.push([el, area]);
+            }
+        }
+        candidates.sort((a, b) => b[1] - a[1]);
+        for (const [el, area] of candidates) {
+            try {
+                if (isVisible(el)) {
+                    return {container: el, scrollableArea: area, windowScrollableArea: windowScrollableArea};
+                }
+            } catch (e) {
+                // Игнорируем ошибки
+            }
+        }
+        
+        // Прокручивается сам документ - обход всего дерева ради безымянных вложенных панелей
+        // не нужен; полный поиск остается для страниц, где window не прокручивается (SPA)
+        if (windowScrollableArea > 100) {
+            return {container: null, scrollableArea: windowScrollableArea, windowScrollableArea: windowScrollableArea};
+        }
+        
+        // FILTER_SKIP, а не FILTER_REJECT - внутри непрокручиваемого элемента может быть прокручиваемый
+        const walker = document.createTreeWalker(document.documentElement, NodeFilter.SHOW_ELEMENT, {
+            acceptNode: (el) => (el.scrollHeight - el.clientHeight > 500) ? NodeFilter.FILTER_ACCEPT : NodeFilter.FILTER_SKIP
+        });
+        let bestContainer = null;
+        let maxScrollableArea = 0;
+        
+        // Корень walker не проходит через фильтр, поэтому начинаем с него и проверяем условие явно
+        for (let el = walker.currentNode; el; el = walker.nextNode()) {
+            try {
+                const scrollableArea = el.scrollHeight - el.clientHeight;
+                // getComputedStyle (в isVisible) вызывается только для кандидата, который
+                // лучше текущего и прошел дешевую проверку размеров
+                if (scrollableArea > maxScrollableArea && scrollableArea > 500) {
+                    if (isVisible(el)) {
+                        maxScrollableArea = scrollableArea;
+                        bestContainer = el;
+                        if (scrollableArea > goodEnoughArea) {
+                            break;
+                        }
+                    }
+                }
+            } catch (e) {
+                // Игнорируем ошибки
+            }
+        }
+        
+        // Контейнер используется, только если его область заметна на фоне прокрутки window
+        if (bestContainer && maxScrollableArea > minArea) {
+            return {container: bestContainer, scrollableArea: maxScrollableArea, windowScrollableArea: windowScrollableArea};
+        }
+        return {container: null, scrollableArea: windowScrollableArea, windowScrollableArea: windowScrollableArea};
+    };
+"""
+
+# Прокрутка с замером позиции до и после за один вызов evaluate
+# Ранее найденный контейнер (scrollContainerRef в замыкании helpers документа) используется
+# без поиска; если он пропал или не может сдвинуться в нужную сторону, контейнер ищется заново.
+# Все чтения layout выполняются до единственной записи (scrollBy), затем одно
+# чтение результата в следующем кадре - без чередования чтений и записей
+_READ_SCROLL_STATE_JS = """
+    const readState = (el) => el ? {
+        scrollTop: el.scrollTop,
+        scrollLeft: el.scrollLeft,
+        scrollHeight: el.scrollHeight,
+        clientHeight: el.clientHeight
+    } : {
+        scrollTop: window.scrollY || window.pageYOffset,
+        scrollLeft: window.scrollX || window.pageXOffset,
+        scrollHeight: document.documentElement.scrollHeight,
+        clientHeight: window.innerHeight
+    };
+"""
+
+_SCROLL_JS = "async ([dx, dy, targetSelector]) => {" + _FIND_SCROLL_CONTAINER_JS + _READ_SCROLL_STATE_JS + """
+    // Прокрутка до элемента; если элемент не найден - обычная прокрутка ниже
+    if (targetSelector) {
+        let target = null;
+        try {
+            target = document.querySelector(targetSelector);
+        } catch (e) {
+            // Селектор не CSS (text=, :has-text, >>) - элемент ищет Playwright
+            return {path: 'not_css'};
+        }
+        if (target) {
+            if (target.scrollIntoViewIfNeeded) {
+                target.scrollIntoViewIfNeeded(true);
+            } else {
+                target.scrollIntoView({block: 'center', inline: 'nearest', behavior: 'instant'});
+            }
+            // Позиция после отрисовки (два кадра; setTimeout - страховка для фоновой вкладки без кадров)
+            await new Promise(resolve => {
+                requestAnimationFrame(() => requestAnimationFrame(resolve));
+                setTimeout(resolve, 100);
+            });
+            return {
+                path: 'element',
+                position: {
+                    x: window.scrollX || window.pageXOffset,
+                    y: window.scrollY || window.pageYOffset
+                }
+            };
+        }
+    }
+    
+    const canMove = (el, state) => {
+        const maxTop = state.scrollHeight - state.clientHeight;
+        const maxLeft = el ? el.scrollWidth - el.clientWidth : document.documentElement.scrollWidth - window.innerWidth;
+        return (dy > 0 && state.scrollTop < maxTop) || (dy < 0 && state.scrollTop > 0) ||
+               (dx > 0 && state.scrollLeft < maxLeft) || (dx < 0 && state.scrollLeft > 0);
+    };
+    
+    // Чтения: выбор контейнера и позиция до прокрутки
+    let container = scrollContainerRef ? scrollContainerRef.deref() : null;
+    if (container && !container.isConnected) container = null;
+    let before = container ? readState(container) : null;
+    if (container && !canMove(container, before)) {
+        // Запомненный контейнер упирается в край - страница могла перестроиться
+        const fresh = findScrollContainer().container;
+        if (fresh !== container) {
+            container = fresh;
+            before = readState(container);
+        }
+    } else if (!container) {
+        container = findScrollContainer().container;
+        before = readState(container);
+    }
+    
+    // Могла ли позиция сдвинуться (не у края и ненулевое смещение) - иначе жест не нужен
+    const couldMove = canMove(container, before);
+    
+    // Запись: единственная прокрутка
+    (container || window).scrollBy({left: dx, top: dy, behavior: 'instant'});
+    
+    // Чтение результата: scrollBy применяется синхронно, один кадр дает странице
+    // отрисовать новую позицию (setTimeout - страховка для фоновой вкладки без кадров)
+    await new Promise(resolve => {
+        requestAnimationFrame(resolve);
+        setTimeout(resolve, 50);
+    });
+    const after = readState(container);
+    
+    // Контейнер запоминается для следующих прокруток и повторного замера после жеста;
+    // WeakRef не удерживает узел, удаленный из документа
+    scrollContainerRef = container ? new WeakRef(container) : null;
+    
+    // Точка для жеста прокрутки (центр видимой части контейнера)
+    const r = container ? container.getBoundingClientRect() : null;
+    const left = r ? Math.max(r.left, 0) : 0;
+    const top = r ? Math.max(r.top, 0) : 0;
+    const right = r ? Math.min(r.right, window.innerWidth) : window.innerWidth;
+    const bottom = r ? Math.min(r.bottom, window.innerHeight) : window.innerHeight;
+    
+    return {
+        path: 'scroll',
+        found: !!container,
+        before: before,
+        after: after,
+        scrolled: after.scrollTop !== before.scrollTop || after.scrollLeft !== before.scrollLeft,
+        canMove: couldMove,
+        point: {x: (left + right) / 2, y: (top + bottom) / 2}
+    };
+}"""
+
+# Позиция контейнера, выбранного последним вызовом _SCROLL_JS (после жеста прокрутки через CDP)
+_SCROLL_STATE_JS = "() => {" + _READ_SCROLL_STATE_JS + """
+    const container = scrollContainerRef ? scrollContainerRef.deref() : null;
+    return readState(container && container.isConnected ? container : null);
+}"""
+
+# Скорость жеста Input.synthesizeScrollGesture (px/s): по умолчанию в Chromium 800,
+# что растягивает прокрутку на сотни миллисекунд
+_SCROLL_GESTURE_SPEED = 50000
+
+
+# Ограничение длины текста, возвращаемого get_text по умолчанию (символов)
+_GET_TEXT_MAX_LENGTH = 65536
+
+# Текст элемента: textContent (без пересчета layout) или innerText (только видимый текст
+# с форматированием - требует пересчета стилей и layout)
+_GET_TEXT_JS = """
+    ([selector, includeChildren, visibleOnly, maxLength]) => {
+        try {
+            const element = document.querySelector(selector);
+            if (!element) return null;
+            
+            // innerText нужен только для фильтрации скрытого текста - он вызывает layout
+            let text = includeChildren && visibleOnly
+                ? (element.innerText || element.textContent || '')
+                : (element.textContent || '');
+            
+            // Обрезка пробелов и ограничение длины выполняются в странице,
+            // чтобы по CDP передавался только нужный текст
+            text = text.trim();
+            return {
+                text: maxLength ? text.slice(0, maxLength) : text,
+                length: text.length,
+                truncated: !!maxLength && text.length > maxLength
+            };
+        } catch (e) {
+            return null;
+        }
+    }
+"""
+
+# Попадание в viewport определяется через IntersectionObserver (без принудительного
+# layout из getBoundingClientRect); getComputedStyle нужен только для display/visibility/opacity
+_CHECK_VISIBILITY_JS = """
+    (selector) => new Promise(resolve => {
+        try {
+            const element = document.querySelector(selector);
+            if (!element) {
+                resolve({visible: false, error: 'Element not found'});
+                return;
+            }
+            
+            const finish = (rect, isInViewport) => {
+                const style = window.getComputedStyle(element);
+                
+                // Проверка стилей
+                const isDisplayed = style.display !== 'none' && 
+                                  style.visibility !== 'hidden' && 
+                                  style.opacity !== '0';
+                
+                // Проверка размеров
+                const hasSize = rect.width > 0 && rect.height > 0;
+                
+                resolve({
+                    visible: isDisplayed && hasSize && isInViewport,
+                    isDisplayed: isDisplayed,
+                    hasSize: hasSize,
+                    isInViewport: isInViewport,
+                    rect: {
+                        top: rect.top,
+                        bottom: rect.bottom,
+                        left: rect.left,
+                        right: rect.right,
+                        width: rect.width,
+                        height: rect.height
+                    }
+                });
+            };
+            
+            const observer = new IntersectionObserver(entries => {
+                observer.disconnect();
+                clearTimeout(timer);
+                const entry = entries[entries.length - 1];
+                finish(entry.boundingClientRect, entry.isIntersecting);
+            });
+            // Страховка для фоновой вкладки, где observer не получает кадров
+            const timer = setTimeout(() => {
+                observer.disconnect();
+                const rect = element.getBoundingClientRect();
+                const isInViewport = rect.top < window.innerHeight && rect.bottom > 0 && 
+                                    rect.left < window.innerWidth && rect.right > 0;
+                finish(rect, isInViewport);
+            }, 100);
+            observer.observe(element);
+        } catch (e) {
+            resolve({visible: false, error: e.message});
+        }
+    })
+"""
+
+# Ожидание видимости элемента и чтение его текста за один вызов evaluate:
+# MutationObserver реагирует на изменения DOM сразу, а проверка раз в кадр (с интервалом -
+# страховкой для фоновой вкладки) ловит видимость, которая меняется без мутаций
+# (CSS анимации, media queries, стили предков). По таймауту текст читается без ожидания.
+# Текст обрезается в странице, по CDP передается не больше maxLength символов
+_WAIT_AND_GET_TEXT_JS = """
+    async ([selector, includeChildren, timeout, maxLength]) => {
+        try {
+            document.querySelector(selector);
+        } catch (e) {
+            return null;  // Невалидный селектор - ждать нечего
+        }
+        
+        const readText = (el, visible) => {
+            const text = (includeChildren ? (el.innerText || el.textContent || '') : (el.textContent || '')).trim();
+            return {
+                text: maxLength ? text.slice(0, maxLength) : text,
+                length: text.length,
+                truncated: !!maxLength && text.length > maxLength,
+                visible: visible
+            };
+        };
+        const findVisible = () => {
+            const el = document.querySelector(selector);
+            if (!el || el.getClientRects().length === 0) return null;
+            return window.getComputedStyle(el).visibility !== 'hidden' ? el : null;
+        };
+        
+        let el = findVisible();
+        if (!el) {
+            el = await new Promise(resolve => {
+                let done = false;
+                let frame = 0;
+                const finish = (found) => {
+                    if (done) return;
+                    done = true;
+                    observer.disconnect();
+                    cancelAnimationFrame(frame);
+                    clearInterval(interval);
+                    clearTimeout(timer);
+                    resolve(found);
+                };
+                const check = () => {
+                    const found = findVisible();
+                    if (found) finish(found);
+                };
+                const poll = () => {
+                    check();
+                    if (!done) frame = requestAnimationFrame(poll);
+                };
+                const observer = new MutationObserver(check);
+                const interval = setInterval(check, 100);
+                const timer = setTimeout(() => finish(null), timeout);
+                observer.observe(document.documentElement, {
+                    childList: true,
+                    subtree: true,
+                    attributes: true,
+                    attributeFilter: ['style', 'class', 'hidden']
+                });
+                frame = requestAnimationFrame(poll);
+            });
+        }
+        if (el) {
+            return readText(el, true);
+        }
+        
+        // Элемент не стал видимым - пробуем извлечь текст напрямую
+        const fallback = document.querySelector(selector);
+        return fallback ? readText(fallback, false) : null;
+    }
+"""
+
+# Служебные скрипты, устанавливаемые в каждый документ (init script контекста): при вызове
+# по CDP передается только имя функции и аргумент, а не исходный код.
+# Состояние helpers (контейнер прокрутки) хранится в замыкании и живет, пока живет документ
+_PAGE_HELPERS = {
+    "scroll": _SCROLL_JS,
+    "scrollState": _SCROLL_STATE_JS,
+    "text": _GET_TEXT_JS,
+    "visibility": _CHECK_VISIBILITY_JS,
+    "waitText": _WAIT_AND_GET_TEXT_JS,
+}
+
+# Имя свойства window с helpers: случайное для каждого процесса, чтобы скрипты страницы
+# не могли заранее подменить helpers под известным именем
+_PAGE_HELPERS_NAME = f"__jarvis_{secrets.token_hex(16)}"
+
+# Helpers - замороженный объект в незаписываемом и ненастраиваемом свойстве window
+_PAGE_HELPERS_INIT_JS = """(() => {
+    const name = %s;
+    if (Object.getOwnPropertyDescriptor(window, name)) return;
+    let scrollContainerRef = null;
+    Object.defineProperty(window, name, {
+        value: Object.freeze({%s}),
+        writable: false,
+        configurable: false,
+        enumerable: false
+    });
+})();""" % (
+    json.dumps(_PAGE_HELPERS_NAME),
+    ",".join(f"{name}: {script.strip()}" for name, script in _PAGE_HELPERS.items())
+)
+
+# Признак документа без установленных helpers (загружен до add_init_script)
+_HELPER_MISSING = "__jarvis_helper_missing__"
+
+# Вызов helper по имени; свойство проверяется перед вызовом - подмененные helpers не вызываются
+_CALL_PAGE_HELPER_JS = """([name, arg]) => {
+    const descriptor = Object.getOwnPropertyDescriptor(window, %s);
+    if (!descriptor || descriptor.writable || descriptor.configurable || !Object.isFrozen(descriptor.value)) {
+        return %s;
+    }
+    return descriptor.value[name](arg);
+}""" % (json.dumps(_PAGE_HELPERS_NAME), json.dumps(_HELPER_MISSING))
+
+
+# Типы ошибок Playwright в порядке приоритета проверки (сопоставляются с текстом в нижнем регистре)
+_CLICK_ERROR_KINDS = (
+    ("timeout", re.compile(r"timeout|timed out")),
+    ("intercepted", re.compile(r"intercepts")),
+    ("not_visible", re.compile(r"not visible|not attached")),
+    ("not_clickable", re.compile(r"not clickable|not actionable")),
+)
+# Для клика через Mouse API различаются только таймаут и невидимый элемент
+_MOUSE_CLICK_ERROR_KINDS = (_CLICK_ERROR_KINDS[0], _CLICK_ERROR_KINDS[2])
+# Ошибки, которые может решить клик через реальные события мыши
+_MOUSE_FALLBACK_ERROR_RE = re.compile(r"not clickable|not actionable|intercepts", re.IGNORECASE)
+
+_CLICK_ERROR_MESSAGES = {
+    "timeout": "Таймаут ожидания элемента '{selector}': элемент не появился или не стал кликабельным за {timeout}мс",
+    "intercepted": "Элемент '{selector}' перехватывается другим элементом (overlay, modal, другой элемент). Попробуйте force=True или use_mouse_fallback=True",
+    "not_visible": "Элемент '{selector}' не виден или не прикреплен к DOM",
+    "not_clickable": "Элемент '{selector}' не кликабелен (может быть disabled, readonly, или перекрыт). Попробуйте use_mouse_fallback=True",
+    None: "Ошибка клика по элементу '{selector}': {error}",
+}
+_MOUSE_CLICK_ERROR_MESSAGES = {
+    "timeout": "Таймаут ожидания элемента '{selector}' для клика через Mouse API: элемент не появился или не стал видимым за {timeout}мс",
+    "not_visible": "Элемент '{selector}' не виден или не прикреплен к DOM для клика через Mouse API",
+    None: "Ошибка клика через Mouse API по элементу '{selector}': {error}",
+}
+
+
+def _classify_click_error(
+    error_str: str,
+    selector: str,
+    timeout: int,
+    kinds: tuple = _CLICK_ERROR_KINDS,
+    messages: Dict[Optional[str], str] = _CLICK_ERROR_MESSAGES
+) -> Dict[str, Any]:
+    """
+    Детализация ошибки клика Playwright для лучшей диагностики
+    
+    Args:
+        error_str: Текст ошибки Playwright
+        selector: CSS селектор элемента
+        timeout: Таймаут ожидания элемента (мс)
+        kinds: Проверяемые типы ошибок в порядке приоритета
+        messages: Шаблоны сообщений по типу ошибки (None - прочие ошибки)
+        
+    Returns:
+        Результат операции с описанием ошибки
+    """
+    error_lower = error_str.lower()
+    kind = next((name for name, pattern in kinds if pattern.search(error_lower)), None)
+    return {
+        "success": False,
+        "error": messages[kind].format(selector=selector, timeout=timeout, error=error_str)
+    }
 
 
 class BrowserController:
     """Контроллер для управления браузером через Playwright"""
     
-    def __init__(self, user_data_dir: Optional[str] = None):
+    # Общий браузер для контроллеров без persistent session:
+    # каждый контроллер получает свой context, а браузер закрывается с последним из них
+    _shared_browser: Optional[Browser] = None
+    _shared_browser_playwright = None  # экземпляр Playwright, которым запущен общий браузер
+    _refcount: int = 0
+    _lock: Optional[asyncio.Lock] = None
+    _lock_loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def __init__(self, user_data_dir: Optional[str] = None, block_resources: Optional[Set[str]] = None):
         """
         Инициализация контроллера браузера
         
         Args:
             user_data_dir: Путь к директории пользовательских данных для persistent session
+            block_resources: Типы ресурсов, загрузка которых блокируется (например {"image", "font", "media"}
+                для сценариев, где нужен только текст и DOM). По умолчанию берется из BLOCK_RESOURCES
         """
         self.playwright = None
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
         self.user_data_dir = user_data_dir
+        self.block_resources = set(BLOCK_RESOURCES if block_resources is None else block_resources)
+        # selector -> locator(selector).first для текущей страницы, сбрасывается при навигации
+        self._locator_cache: Dict[str, Locator] = {}
+        # Заголовок текущего документа, сбрасывается при навигации и событии load
+        self._title_cache: Optional[str] = None
+        # CDP сессия для _fast_eval (только Chromium) и страница, для которой она создана
+        self._is_chromium = False
+        self._cdp = None
+        self._cdp_page: Optional[Page] = None
+        
+    @classmethod
+    def install_fast_loop(cls) -> Optional[str]:
+        """
+        Установка более быстрого event loop для обмена с драйвером Playwright
+        
+        Каждый вызов Playwright - это JSON-RPC сообщение через pipe к node-драйверу,
+        поэтому задержка определяется пробуждениями event loop и системными вызовами.
+        Вызывается при старте процесса до asyncio.run(): start() должен выполняться
+        уже под установленной политикой. Пакеты uringcore/uvloop необязательны -
+        если ни один не установлен, остается стандартный asyncio.
+        
+        Returns:
+            Имя установленного event loop или None, если используется стандартный
+        """
+        try:
+            import uringcore
+            asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
+            return "uringcore"
+        except Exception:
+            pass
+        try:
+            import uvloop
+            uvloop.install()
+            return "uvloop"
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _get_browser_launcher(playwright):
+        """Выбор типа браузера"""
+        return {
+            "chromium": playwright.chromium,
+            "firefox": playwright.firefox,
+            "webkit": playwright.webkit
+        }.get(BROWSER_TYPE, playwright.chromium)
+    
+    @classmethod
+    def _get_lock(cls) -> asyncio.Lock:
+        """Блокировка общего браузера для текущего event loop"""
+        loop = asyncio.get_running_loop()
+        if cls._lock is None or cls._lock_loop is not loop:
+            cls._lock = asyncio.Lock()
+            cls._lock_loop = loop
+        return cls._lock
+    
+    @classmethod
+    async def _acquire_shared_browser(cls, playwright) -> Browser:
+        """
+        Получение общего браузера (запускается один раз для всех контроллеров)
         
+        Args:
+            playwright: Общий экземпляр Playwright, которым запускается браузер
+        
+        Returns:
+            Общий экземпляр браузера
+        """
+        async with cls._get_lock():
+            if (cls._shared_browser is None or cls._shared_browser_playwright is not playwright
+                    or not cls._shared_browser.is_connected()):
+                cls._shared_browser = await cls._get_browser_launcher(playwright).launch(
+                    headless=HEADLESS
+                )
+                cls._shared_browser_playwright = playwright
+                cls._refcount = 0
+            cls._refcount += 1
+            return cls._shared_browser
+    
+    @classmethod
+    async def _release_shared_browser(cls, browser: Browser):
+        """
+        Освобождение общего браузера: закрывается, когда его больше никто не использует
+        
+        Args:
+            browser: Браузер, полученный контроллером в _acquire_shared_browser
+        """
+        async with cls._get_lock():
+            # Браузер уже был перезапущен (старый отключился) - счетчик относится к новому
+            if browser is not cls._shared_browser:
+                return
+            cls._refcount = max(cls._refcount - 1, 0)
+            if cls._refcount > 0:
+                return
+            cls._shared_browser = None
+            try:
+                if browser:
+                    await browser.close()
+            except Exception:
+                # Игнорируем ошибки при закрытии (браузер может быть уже закрыт)
+                pass
+    
     async def start(self):
         """Запуск браузера"""
-        self.playwright = await async_playwright().start()
-        
-        # Выбор типа браузера
-        browser_launcher = {
-            "chromium": self.playwright.chromium,
-            "firefox": self.playwright.firefox,
-            "webkit": self.playwright.webkit
-        }.get(BROWSER_TYPE, self.playwright.chromium)
-        
-        # Параметры запуска
-        launch_options = {
-            "headless": HEADLESS
-        }
+        self.playwright = await get_playwright()
+        self._is_chromium = self._get_browser_launcher(self.playwright) is self.playwright.chromium
         
         # Если указана директория для persistent session
         if self.user_data_dir:
+            browser_launcher = self._get_browser_launcher(self.playwright)
+            
             # Для persistent context используем launch_persistent_context
             # который возвращает BrowserContext напрямую
+            # Для Chromium увеличиваем дисковый кэш, чтобы статика сохранялась между запусками
+            persistent_args = []
+            if browser_launcher is self.playwright.chromium:
+                persistent_args.append(f"--disk-cache-size={_PERSISTENT_DISK_CACHE_SIZE}")
             self.context = await browser_launcher.launch_persistent_context(
                 user_data_dir=self.user_data_dir,
                 headless=HEADLESS,
-                viewport={"width": 1280, "height": 720}
+                viewport={"width": 1280, "height": 720},
+                args=persistent_args
             )
             # Для persistent context получаем страницы напрямую
             pages = self.context.pages
@@ -54,41 +707,165 @@ class BrowserController:
                 self.page = await self.context.new_page()
             self.browser = None  # При persistent context browser не используется напрямую
         else:
-            self.browser = await browser_launcher.launch(**launch_options)
+            # Без persistent session используем общий браузер - запуск драйвера и браузера
+            # происходит один раз, а контроллер создает только свой context
+            self.browser = await self._acquire_shared_browser(self.playwright)
             self.context = await self.browser.new_context(
                 viewport={"width": 1280, "height": 720}
             )
             self.page = await self.context.new_page()
         
+        # Маршрутизация включается только при непустом списке - иначе каждый запрос
+        # лишний раз проходил бы через обработчик в Python
+        if self.block_resources:
+            await self.context.route("**/*", self._route_blocked_resources)
+        
+        # Служебные скрипты в каждом новом документе
+        await self.context.add_init_script(_PAGE_HELPERS_INIT_JS)
+        
+        self._setup_page(self.page)
+    
+    def _setup_page(self, page: Page):
+        """
+        Настройка страницы и назначение ее текущей
+        
+        Args:
+            page: Страница Playwright
+        """
+        self.page = page
+        self._locator_cache.clear()
+        self._title_cache = None
+        
         # Настройка таймаутов
-        self.page.set_default_timeout(BROWSER_TIMEOUT)
-        self.page.set_default_navigation_timeout(BROWSER_TIMEOUT)
+        page.set_default_timeout(BROWSER_TIMEOUT)
+        page.set_default_navigation_timeout(BROWSER_TIMEOUT)
+        
+        # Кэши locator'ов и заголовка относятся к текущему документу - сбрасываем их при навигации;
+        # заголовок дополнительно сбрасывается на load (скрипты страницы часто меняют его при загрузке)
+        page.on("framenavigated", self._on_frame_navigated)
+        page.on("load", self._on_page_load)
+    
+    async def _route_blocked_resources(self, route):
+        """Отмена загрузки ресурсов заблокированных типов"""
+        if route.request.resource_type in self.block_resources:
+            await route.abort()
+        else:
+            await route.continue_()
+    
+    def _on_frame_navigated(self, frame):
+        """Сброс кэшей страницы при навигации основного фрейма"""
+        if frame == self.page.main_frame:
+            self._locator_cache.clear()
+            self._title_cache = None
+    
+    def _on_page_load(self, page):
+        """Сброс кэша заголовка после загрузки документа"""
+        if page == self.page:
+            self._title_cache = None
+    
+    async def _fast_eval(self, script: str, arg: Any = None) -> Any:
+        """
+        Выполнение JS функции на странице напрямую через CDP Runtime.evaluate
+        
+        Используется для служебных скриптов контроллера: один CDP вызов вместо обертки
+        page.evaluate. Для Firefox/WebKit (или если CDP сессию создать не удалось)
+        выполняется через page.evaluate.
+        
+        Args:
+            script: Текст JS функции, принимающей один аргумент
+            arg: Аргумент функции (должен сериализоваться в JSON)
+            
+        Returns:
+            Результат выполнения функции
+        """
+        if self._is_chromium and self._cdp_page is not self.page:
+            try:
+                self._cdp = await self.context.new_cdp_session(self.page)
+                self._cdp_page = self.page
+            except Exception:
+                self._cdp = None
+                self._is_chromium = False
+        if not self._cdp:
+            return await self.page.evaluate(script, arg)
+        
+        response = await self._cdp.send("Runtime.evaluate", {
+            "expression": f"({script})({json.dumps(arg)})",
+            "returnByValue": True,
+            "awaitPromise": True
+        })
+        if "exceptionDetails" in response:
+            details = response["exceptionDetails"]
+            raise Exception(details.get("exception", {}).get("description") or details.get("text", "Ошибка выполнения скрипта"))
+        return response.get("result", {}).get("value")
+    
+    async def _call_page_helper(self, name: str, arg: Any = None) -> Any:
+        """
+        Вызов служебного скрипта из helpers документа
+        
+        В документ, загруженный до установки init script, helpers устанавливаются при первом вызове.
+        Если после установки свойство с helpers не прошло проверку (подменено страницей),
+        вызывается исключение.
+        
+        Args:
+            name: Имя скрипта в _PAGE_HELPERS
+            arg: Аргумент скрипта
+            
+        Returns:
+            Результат выполнения скрипта
+        """
+        result = await self._fast_eval(_CALL_PAGE_HELPER_JS, [name, arg])
+        if result == _HELPER_MISSING:
+            await self._fast_eval("() => {" + _PAGE_HELPERS_INIT_JS + "}")
+            result = await self._fast_eval(_CALL_PAGE_HELPER_JS, [name, arg])
+            if result == _HELPER_MISSING:
+                raise Exception("Служебные скрипты страницы недоступны")
+        return result
+    
+    def _loc(self, selector: str) -> Locator:
+        """
+        Locator первого элемента по селектору (кэшируется до навигации)
+        
+        Locator ленивый - закэшированный объект заново ищет элемент в DOM при каждом использовании
+        
+        Args:
+            selector: CSS селектор элемента
+            
+        Returns:
+            Locator первого подходящего элемента
+        """
+        locator = self._locator_cache.get(selector)
+        if locator is None:
+            if len(self._locator_cache) >= _LOCATOR_CACHE_MAX_SIZE:
+                self._locator_cache.clear()
+            locator = self.page.locator(selector).first
+            self._locator_cache[selector] = locator
+        return locator
         
     async def close(self):
         """Закрытие браузера"""
         try:
             if self.user_data_dir:
                 # Для persistent context - просто закрываем context
-                # Playwright автоматически сохранит данные в user_data_dir
+                # Playwright сохраняет данные в user_data_dir при закрытии context
                 if self.context:
                     await self.context.close()
-                # Даем время на сохранение данных
-                import asyncio
-                await asyncio.sleep(0.5)
             else:
-                # Для обычного контекста закрываем страницу и context
-                if self.page:
-                    await self.page.close()
+                # Для обычного контекста закрываем context (вместе с ним закрываются и его страницы);
+                # общий браузер освобождается параллельно и закрывается вместе с последним контроллером
+                cleanup = []
                 if self.context:
-                    await self.context.close()
+                    cleanup.append(self.context.close())
                 if self.browser:
-                    await self.browser.close()
-            
-            if self.playwright:
-                await self.playwright.stop()
+                    cleanup.append(self._release_shared_browser(self.browser))
+                    self.browser = None
+                await asyncio.gather(*cleanup, return_exceptions=True)
         except Exception as e:
             # Игнорируем ошибки при закрытии (браузер может быть уже закрыт)
             pass
+        
+        # Драйвер Playwright общий - он останавливается вместе с последним контроллером
+        playwright, self.playwright = self.playwright, None
+        await release_playwright(playwright)
             
     async def navigate(self, url: str, wait_for_content: bool = True, max_retries: int = 3) -> Dict[str, Any]:
         """
@@ -119,31 +896,17 @@ class BrowserController:
                     timeout=navigation_timeout
                 )
                 
-                # Адаптивное ожидание для рендеринга динамического контента
+                # Ожидание рендеринга динамического контента: networkidle на многих сайтах
+                # не наступает вовсе, поэтому ждем появления первого интерактивного элемента
                 if wait_for_content:
-                    # Ждем готовности DOM
-                    try:
-                        await self.page.wait_for_load_state("domcontentloaded", timeout=5000)
-                    except:
-                        pass  # Игнорируем ошибку, если уже загружено
-                    
-                    # Пытаемся дождаться network idle для лучшего обнаружения загрузки
                     try:
-                        await self.page.wait_for_load_state("networkidle", timeout=3000)
-                    except:
-                        # Если network idle не достигнут - используем адаптивное ожидание
-                        # Базовое ожидание зависит от попытки
-                        base_delay = 2.0 if attempt == 0 else 3.0
-                        await asyncio.sleep(base_delay)
-                        
-                        # Проверяем наличие интерактивных элементов
-                        try:
-                            element_count = await self.page.evaluate("() => document.querySelectorAll('button, a, input, select, textarea').length")
-                            if element_count == 0 and attempt < max_retries - 1:
-                                # Если элементов нет - увеличиваем ожидание
-                                await asyncio.sleep(2.0)
-                        except:
-                            pass
+                        await self.page.wait_for_selector(
+                            "button, a, input, select, textarea",
+                            state="attached",
+                            timeout=1500
+                        )
+                    except Exception:
+                        pass  # Страница без интерактивных элементов - продолжаем
                 
                 # Проверяем, что страница действительно загрузилась
                 current_url = self.page.url
@@ -210,89 +973,78 @@ class BrowserController:
         Returns:
             Результат операции
         """
+        timeout = timeout or BROWSER_TIMEOUT
+        
+        # Для сложных селекторов используем locator для более гибкого управления кликом,
+        # простые (#id, имя тега) кликаем напрямую через page.click с strict=False.
+        # Оба варианта автоматически ждут появления элемента в DOM, поэтому
+        # отдельная проверка count() не нужна - отсутствие элемента выясняется по таймауту
+        simple_selector = bool(_SIMPLE_SELECTOR_RE.match(selector))
+        
+        # Пробуем клик с учетом опций Playwright
+        # Playwright автоматически:
+        # - Ждет видимости элемента (если не force)
+        # - Прокручивает до элемента
+        # - Ждет стабильности элемента (если не force)
+        # - Ждет отсутствия анимаций (если не force)
+        # - Ждет завершения навигации после клика (если не no_wait_after)
         try:
-            timeout = timeout or BROWSER_TIMEOUT
-            
-            # Используем locator для более гибкого управления кликом
-            # Locator автоматически ждет появления элемента в DOM
-            locator = self.page.locator(selector).first
-            
-            # Проверяем наличие элемента
-            count = await locator.count()
-            if count == 0:
-                return {
-                    "success": False,
-                    "error": f"Элемент с селектором '{selector}' не найден на странице"
-                }
-            
-            # Пробуем клик с учетом опций Playwright
-            # Playwright автоматически:
-            # - Ждет видимости элемента (если не force)
-            # - Прокручивает до элемента
-            # - Ждет стабильности элемента (если не force)
-            # - Ждет отсутствия анимаций (если не force)
-            # - Ждет завершения навигации после клика (если не no_wait_after)
-            try:
-                await locator.click(
+            if simple_selector:
+                await self.page.click(
+                    selector,
+                    timeout=timeout,
+                    force=force,
+                    trial=trial,
+                    strict=False
+                )
+            else:
+                await self._loc(selector).click(
                     timeout=timeout,
                     force=force,
                     trial=trial,
                     # no_wait_after=False - ждем завершения навигации после клика (по умолчанию)
                     # position=None - клик по центру элемента (по умолчанию)
                 )
-                
-                return {"success": True}
-            except Exception as click_error:
-                # Если обычный клик не сработал и включен fallback - пробуем Mouse API
-                if use_mouse_fallback and not trial:
-                    error_str = str(click_error).lower()
-                    # Пробуем Mouse API для определенных типов ошибок
-                    # которые могут быть решены через реальные события мыши
-                    should_try_mouse = (
-                        "not clickable" in error_str or
-                        "not actionable" in error_str or
-                        "intercepts pointer events" in error_str or
-                        "intercepts" in error_str
-                    )
-                    
-                    if should_try_mouse:
-                        # Пробуем клик через Mouse API как fallback
-                        mouse_result = await self.click_with_mouse_events(selector, timeout)
-                        if mouse_result.get("success"):
-                            return {"success": True, "used_mouse_fallback": True}
-                        # Если Mouse API тоже не сработал, возвращаем исходную ошибку
-                
-                # Пробрасываем исходную ошибку для обработки ниже
-                raise click_error
-                
-        except Exception as e:
-            error_str = str(e)
-            # Детализируем ошибки Playwright для лучшей диагностики
-            if "timeout" in error_str.lower() or "timed out" in error_str.lower():
-                return {
-                    "success": False,
-                    "error": f"Таймаут ожидания элемента '{selector}': элемент не появился или не стал кликабельным за {timeout}мс"
-                }
-            elif "intercepts pointer events" in error_str.lower() or "intercepts" in error_str.lower():
-                return {
-                    "success": False,
-                    "error": f"Элемент '{selector}' перехватывается другим элементом (overlay, modal, другой элемент). Попробуйте force=True или use_mouse_fallback=True"
-                }
-            elif "not visible" in error_str.lower() or "not attached" in error_str.lower():
-                return {
-                    "success": False,
-                    "error": f"Элемент '{selector}' не виден или не прикреплен к DOM"
-                }
-            elif "not clickable" in error_str.lower() or "not actionable" in error_str.lower():
-                return {
-                    "success": False,
-                    "error": f"Элемент '{selector}' не кликабелен (может быть disabled, readonly, или перекрыт). Попробуйте use_mouse_fallback=True"
-                }
-            else:
+            
+            return {"success": True}
+        except Exception as click_error:
+            error_str = str(click_error)
+            
+            # Если обычный клик не сработал и включен fallback - пробуем Mouse API
+            # Пробуем Mouse API для определенных типов ошибок
+            # которые могут быть решены через реальные события мыши
+            if use_mouse_fallback and not trial and _MOUSE_FALLBACK_ERROR_RE.search(error_str):
+                # Пробуем клик через Mouse API как fallback
+                mouse_result = await self.click_with_mouse_events(selector, timeout)
+                if mouse_result.get("success"):
+                    return {"success": True, "used_mouse_fallback": True}
+                # Если Mouse API тоже не сработал, возвращаем исходную ошибку
+            
+            if isinstance(click_error, PlaywrightTimeoutError):
+                not_found = await self._not_found_error(selector)
+                if not_found:
+                    return not_found
+            return _classify_click_error(error_str, selector, timeout)
+    
+    async def _not_found_error(self, selector: str) -> Optional[Dict[str, Any]]:
+        """
+        Проверка наличия элемента после таймаута действия
+        
+        Вызывается только при неудаче, чтобы успешный клик обходился
+        одним обращением к драйверу Playwright
+        
+        Returns:
+            Результат операции с ошибкой "не найден" или None, если элемент есть в DOM
+        """
+        try:
+            if await self.page.locator(selector).count() == 0:
                 return {
                     "success": False,
-                    "error": f"Ошибка клика по элементу '{selector}': {error_str}"
+                    "error": f"Элемент с селектором '{selector}' не найден на странице"
                 }
+        except Exception:
+            pass
+        return None
     
     async def click_with_mouse_events(self, selector: str, timeout: Optional[int] = None) -> Dict[str, Any]:
         """
@@ -314,15 +1066,7 @@ class BrowserController:
             timeout = timeout or BROWSER_TIMEOUT
             
             # Используем locator для получения элемента
-            locator = self.page.locator(selector).first
-            
-            # Проверяем наличие элемента
-            count = await locator.count()
-            if count == 0:
-                return {
-                    "success": False,
-                    "error": f"Элемент с селектором '{selector}' не найден на странице"
-                }
+            locator = self._loc(selector)
             
             # Ждем видимости элемента
             await locator.wait_for(state="visible", timeout=timeout)
@@ -348,23 +1092,16 @@ class BrowserController:
             
             return {"success": True}
         except Exception as e:
-            error_str = str(e)
+            if isinstance(e, PlaywrightTimeoutError):
+                not_found = await self._not_found_error(selector)
+                if not_found:
+                    return not_found
             # Детализируем ошибки для лучшей диагностики
-            if "timeout" in error_str.lower() or "timed out" in error_str.lower():
-                return {
-                    "success": False,
-                    "error": f"Таймаут ожидания элемента '{selector}' для клика через Mouse API: элемент не появился или не стал видимым за {timeout}мс"
-                }
-            elif "not visible" in error_str.lower() or "not attached" in error_str.lower():
-                return {
-                    "success": False,
-                    "error": f"Элемент '{selector}' не виден или не прикреплен к DOM для клика через Mouse API"
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"Ошибка клика через Mouse API по элементу '{selector}': {error_str}"
-                }
+            return _classify_click_error(
+                str(e), selector, timeout,
+                kinds=_MOUSE_CLICK_ERROR_KINDS,
+                messages=_MOUSE_CLICK_ERROR_MESSAGES
+            )
     
     async def _fill_element(self, selector: str, text: str, timeout: Optional[int] = None) -> Dict[str, Any]:
         """
@@ -372,7 +1109,7 @@ class BrowserController:
         """
         try:
             timeout = timeout or BROWSER_TIMEOUT
-            await self.page.fill(selector, text, timeout=timeout)
+            await self._loc(selector).fill(text, timeout=timeout)
             return {"success": True}
         except Exception as e:
             return {
@@ -398,136 +1135,21 @@ class BrowserController:
         
         Улучшения:
         - Автоматически находит прокручиваемый контейнер внутри страницы (для SPA типа Яндекс Почты)
-        - Использует встроенные методы Playwright для более надежной прокрутки
-        - Поддерживает прокрутку до конкретного элемента
-        - Проверяет результат прокрутки (изменение позиции, новые элементы)
+        - Прокручивает и проверяет результат (изменение позиции) за один вызов evaluate
+        - Если scrollBy не сдвинул страницу, повторяет прокрутку быстрым жестом колеса через CDP (Chromium)
+        - Поддерживает прокрутку до конкретного элемента (для CSS селектора - в том же вызове,
+          для селектора Playwright - через locator; если элемент не найден - выполняется
+          обычная прокрутка по направлению)
         
         Args:
             direction: Направление прокрутки ("up", "down", "left", "right")
             amount: Количество пикселей для прокрутки
-            to_element: Селектор элемента для прокрутки до него (опционально)
+            to_element: CSS селектор или селектор Playwright элемента для прокрутки до него (опционально)
             
         Returns:
             Результат операции с информацией об изменениях
         """
         try:
-            # Если указан элемент для прокрутки до него
-            if to_element:
-                try:
-                    # Используем Playwright locator для прокрутки до элемента
-                    locator = self.page.locator(to_element).first
-                    await locator.scroll_into_view_if_needed()
-                    
-                    await asyncio.sleep(0.5)  # Задержка для завершения прокрутки
-                    
-                    # Получаем новую позицию прокрутки
-                    scroll_after = await self.page.evaluate("""
-                        () => {
-                            return {
-                                x: window.scrollX || window.pageXOffset,
-                                y: window.scrollY || window.pageYOffset
-                            };
-                        }
-                    """)
-                    
-                    return {
-                        "success": True,
-                        "scroll_position": {"x": scroll_after["x"], "y": scroll_after["y"]},
-                        "scroll_type": "to_element",
-                        "scrolled": True,
-                        "element": to_element,
-                        "message": f"Прокрутка до элемента '{to_element}' выполнена"
-                    }
-                except Exception as e:
-                    # Если не удалось прокрутить до элемента - продолжаем с обычной прокруткой
-                    pass
-            
-            # Находим прокручиваемый контейнер (для SPA типа Яндекс Почты)
-            scroll_container_info = await self.page.evaluate("""
-                () => {
-                    // Ищем прокручиваемый контейнер внутри страницы
-                    // Проверяем элементы с overflow: auto/scroll и достаточным scrollHeight
-                    const allElements = document.querySelectorAll('*');
-                    let bestContainer = null;
-                    let maxScrollHeight = 0;
-                    let maxScrollableArea = 0;
-                    
-                    for (const el of allElements) {
-                        try {
-                            const style = window.getComputedStyle(el);
-                            const hasOverflow = style.overflow === 'auto' || style.overflow === 'scroll' || 
-                                               style.overflowY === 'auto' || style.overflowY === 'scroll' ||
-                                               style.overflow === 'hidden'; // hidden тоже может быть прокручиваемым
-                            
-                            // Проверяем, можно ли прокручивать элемент
-                            const scrollable = el.scrollHeight > el.clientHeight;
-                            const scrollableArea = scrollable ? (el.scrollHeight - el.clientHeight) : 0;
-                            
-                            if (scrollable && scrollableArea > maxScrollableArea) {
-                                maxScrollableArea = scrollableArea;
-                                maxScrollHeight = el.scrollHeight;
-                                bestContainer = el;
-                            }
-                        } catch (e) {
-                            // Игнорируем ошибки
-                        }
-                    }
-                    
-                    // Также проверяем элементы с большим scrollHeight даже без явного overflow
-                    // (для виртуальных скроллеров и динамических списков)
-                    if (!bestContainer || maxScrollableArea < 500) {
-                        for (const el of allElements) {
-                            try {
-                                const scrollableArea = el.scrollHeight > el.clientHeight ? (el.scrollHeight - el.clientHeight) : 0;
-                                // Ищем элементы с большой прокручиваемой областью
-                                if (scrollableArea > maxScrollableArea && scrollableArea > 500) {
-                                    const style = window.getComputedStyle(el);
-                                    // Проверяем, что элемент видим и имеет размеры
-                                    if (el.offsetWidth > 100 && el.offsetHeight > 100 && 
-                                        style.display !== 'none' && style.visibility !== 'hidden') {
-                                        maxScrollableArea = scrollableArea;
-                                        maxScrollHeight = el.scrollHeight;
-                                        bestContainer = el;
-                                    }
-                                }
-                            } catch (e) {
-                                // Игнорируем ошибки
-                            }
-                        }
-                    }
-                    
-                    // Если нашли контейнер с достаточной прокручиваемой областью - используем его
-                    const windowScrollHeight = document.documentElement.scrollHeight;
-                    const windowScrollableArea = windowScrollHeight > window.innerHeight ? (windowScrollHeight - window.innerHeight) : 0;
-                    
-                    if (bestContainer && maxScrollableArea > Math.max(500, windowScrollableArea * 0.3)) {
-                        return {
-                            found: true,
-                            selector: bestContainer.id ? `#${bestContainer.id}` : 
-                                     bestContainer.className ? `.${bestContainer.className.split(' ')[0]}` : null,
-                            scrollHeight: bestContainer.scrollHeight,
-                            clientHeight: bestContainer.clientHeight,
-                            scrollTop: bestContainer.scrollTop,
-                            scrollLeft: bestContainer.scrollLeft,
-                            scrollableArea: maxScrollableArea
-                        };
-                    }
-                    
-                    // Иначе используем window
-                    return {
-                        found: false,
-                        scrollHeight: document.documentElement.scrollHeight,
-                        clientHeight: window.innerHeight,
-                        scrollTop: window.scrollY || window.pageYOffset,
-                        scrollLeft: window.scrollX || window.pageXOffset,
-                        scrollableArea: windowScrollableArea
-                    };
-                }
-            """)
-            
-            # Получаем текущую позицию прокрутки до прокрутки
-            scroll_before = scroll_container_info
-            
             # Определяем направление прокрутки
             delta_x = 0
             delta_y = 0
@@ -541,204 +1163,84 @@ class BrowserController:
             elif direction == "left":
                 delta_x = -amount
             
-            # Прокручиваем: сначала пробуем через wheel (работает для контейнеров)
-            try:
-                await self.page.mouse.wheel(delta_x, delta_y)
-                await asyncio.sleep(0.5)
-                
-                # Проверяем результат прокрутки
-                scroll_after = await self.page.evaluate("""
-                    () => {
-                        // Проверяем window
-                        const windowScroll = {
-                            x: window.scrollX || window.pageXOffset,
-                            y: window.scrollY || window.pageYOffset,
-                            scrollHeight: document.documentElement.scrollHeight,
-                            clientHeight: window.innerHeight
-                        };
-                        
-                        // Ищем прокручиваемый контейнер снова (улучшенный поиск)
-                        const allElements = document.querySelectorAll('*');
-                        let bestContainer = null;
-                        let maxScrollableArea = 0;
-                        
-                        for (const el of allElements) {
-                            try {
-                                const scrollableArea = el.scrollHeight > el.clientHeight ? (el.scrollHeight - el.clientHeight) : 0;
-                                
-                                if (scrollableArea > maxScrollableArea && scrollableArea > 500) {
-                                    const style = window.getComputedStyle(el);
-                                    if (el.offsetWidth > 100 && el.offsetHeight > 100 && 
-                                        style.display !== 'none' && style.visibility !== 'hidden') {
-                                        maxScrollableArea = scrollableArea;
-                                        bestContainer = el;
-                                    }
-                                }
-                            } catch (e) {
-                                // Игнорируем ошибки
-                            }
-                        }
-                        
-                        const windowScrollableArea = windowScroll.scrollHeight > windowScroll.clientHeight ? 
-                                                   (windowScroll.scrollHeight - windowScroll.clientHeight) : 0;
-                        
-                        if (bestContainer && maxScrollableArea > Math.max(500, windowScrollableArea * 0.3)) {
-                            return {
-                                found: true,
-                                scrollHeight: bestContainer.scrollHeight,
-                                clientHeight: bestContainer.clientHeight,
-                                scrollTop: bestContainer.scrollTop,
-                                scrollLeft: bestContainer.scrollLeft,
-                                windowScroll: windowScroll
-                            };
-                        }
-                        
-                        return {
-                            found: false,
-                            scrollTop: windowScroll.y,
-                            scrollLeft: windowScroll.x,
-                            scrollHeight: windowScroll.scrollHeight,
-                            clientHeight: windowScroll.clientHeight,
-                            windowScroll: windowScroll
-                        };
+            # Прокрутка (до элемента, если он указан и найден, иначе по направлению) и замер позиции
+            # выполняются в странице за один вызов; найденный ранее контейнер helpers документа
+            # запоминают сами
+            scroll_info = await self._call_page_helper("scroll", [delta_x, delta_y, to_element])
+            
+            # Селекторы Playwright (text=, :has-text, >>) querySelector не понимает -
+            # до такого элемента прокручивает locator, а без совпадений выполняется обычная прокрутка
+            if scroll_info.get("path") == "not_css":
+                locator = self._loc(to_element)
+                if await locator.count() > 0:
+                    await locator.scroll_into_view_if_needed()
+                    scroll_info = {
+                        "path": "element",
+                        "position": await self._fast_eval(
+                            "() => ({x: window.scrollX || window.pageXOffset, y: window.scrollY || window.pageYOffset})"
+                        )
                     }
-                """)
-                
-                # Определяем, произошла ли прокрутка
-                if scroll_container_info.get("found"):
-                    scrolled = (scroll_after.get("scrollTop", 0) != scroll_container_info.get("scrollTop", 0) or
-                               scroll_after.get("scrollLeft", 0) != scroll_container_info.get("scrollLeft", 0))
-                    scroll_type = "container"
-                else:
-                    scrolled = (scroll_after.get("windowScroll", {}).get("y", 0) != scroll_container_info.get("scrollTop", 0) or
-                               scroll_after.get("windowScroll", {}).get("x", 0) != scroll_container_info.get("scrollLeft", 0))
-                    scroll_type = "window"
-                
-                # Проверяем, достигли ли мы конца
-                if scroll_container_info.get("found"):
-                    is_at_bottom = scroll_after.get("scrollTop", 0) >= scroll_after.get("scrollHeight", 0) - scroll_after.get("clientHeight", 0) - 10
-                    is_at_top = scroll_after.get("scrollTop", 0) <= 10
                 else:
-                    window_scroll = scroll_after.get("windowScroll", {})
-                    is_at_bottom = window_scroll.get("y", 0) >= window_scroll.get("scrollHeight", 0) - window_scroll.get("clientHeight", 0) - 10
-                    is_at_top = window_scroll.get("y", 0) <= 10
-                
+                    scroll_info = await self._call_page_helper("scroll", [delta_x, delta_y, None])
+            
+            if scroll_info.get("path") == "element":
+                scroll_after = scroll_info.get("position", {})
                 return {
                     "success": True,
-                    "scroll_position": {
-                        "x": scroll_after.get("scrollLeft", 0) if scroll_container_info.get("found") else scroll_after.get("windowScroll", {}).get("x", 0),
-                        "y": scroll_after.get("scrollTop", 0) if scroll_container_info.get("found") else scroll_after.get("windowScroll", {}).get("y", 0)
-                    },
-                    "scroll_type": scroll_type,
-                    "scrolled": scrolled,
-                    "direction": direction,
-                    "amount": amount,
-                    "is_at_bottom": is_at_bottom,
-                    "is_at_top": is_at_top,
-                    "can_scroll_more": not (is_at_bottom and direction == "down") and not (is_at_top and direction == "up"),
-                    "message": f"Прокрутка {direction} на {amount}px выполнена ({scroll_type})" if scrolled else "Прокрутка не изменила позицию (возможно, достигнут конец)"
+                    "scroll_position": {"x": scroll_after.get("x", 0), "y": scroll_after.get("y", 0)},
+                    "scroll_type": "to_element",
+                    "scrolled": True,
+                    "element": to_element,
+                    "message": f"Прокрутка до элемента '{to_element}' выполнена"
                 }
-            except Exception as e:
-                # Fallback: прокручиваем через JavaScript напрямую в контейнер
-                scroll_result = await self.page.evaluate("""
-                    ([direction, amount]) => {
-                        // Находим прокручиваемый контейнер (улучшенный поиск)
-                        const allElements = document.querySelectorAll('*');
-                        let bestContainer = null;
-                        let maxScrollableArea = 0;
-                        
-                        for (const el of allElements) {
-                            try {
-                                const style = window.getComputedStyle(el);
-                                const scrollableArea = el.scrollHeight > el.clientHeight ? (el.scrollHeight - el.clientHeight) : 0;
-                                
-                                if (scrollableArea > maxScrollableArea && scrollableArea > 500) {
-                                    // Проверяем, что элемент видим и имеет размеры
-                                    if (el.offsetWidth > 100 && el.offsetHeight > 100 && 
-                                        style.display !== 'none' && style.visibility !== 'hidden') {
-                                        maxScrollableArea = scrollableArea;
-                                        bestContainer = el;
-                                    }
-                                }
-                            } catch (e) {
-                                // Игнорируем ошибки
-                            }
-                        }
-                        
-                        const windowScrollableArea = document.documentElement.scrollHeight > window.innerHeight ? 
-                                                   (document.documentElement.scrollHeight - window.innerHeight) : 0;
-                        
-                        const container = bestContainer && maxScrollableArea > Math.max(500, windowScrollableArea * 0.3)
-                                       ? bestContainer : document.documentElement;
-                        
-                        const currentScroll = {
-                            x: container === document.documentElement ? (window.scrollX || window.pageXOffset) : container.scrollLeft,
-                            y: container === document.documentElement ? (window.scrollY || window.pageYOffset) : container.scrollTop
-                        };
-                        
-                        let newX = currentScroll.x;
-                        let newY = currentScroll.y;
-                        const maxY = container === document.documentElement 
-                                   ? (document.documentElement.scrollHeight - window.innerHeight)
-                                   : (container.scrollHeight - container.clientHeight);
-                        const maxX = container === document.documentElement
-                                   ? (document.documentElement.scrollWidth - window.innerWidth)
-                                   : (container.scrollWidth - container.clientWidth);
-                        
-                        if (direction === 'down') {
-                            newY = Math.min(currentScroll.y + amount, maxY);
-                        } else if (direction === 'up') {
-                            newY = Math.max(currentScroll.y - amount, 0);
-                        } else if (direction === 'right') {
-                            newX = Math.min(currentScroll.x + amount, maxX);
-                        } else if (direction === 'left') {
-                            newX = Math.max(currentScroll.x - amount, 0);
-                        }
-                        
-                        if (container === document.documentElement) {
-                            window.scrollTo(newX, newY);
-                        } else {
-                            container.scrollTop = newY;
-                            container.scrollLeft = newX;
-                        }
-                        
-                        // Проверяем реальную позицию после прокрутки
-                        // scrollTop/scrollLeft устанавливаются синхронно, но проверяем для надежности
-                        const actualScroll = {
-                            x: container === document.documentElement ? (window.scrollX || window.pageXOffset) : container.scrollLeft,
-                            y: container === document.documentElement ? (window.scrollY || window.pageYOffset) : container.scrollTop
-                        };
-                        
-                        return {
-                            success: true,
-                            scrolled: actualScroll.x !== currentScroll.x || actualScroll.y !== currentScroll.y,
-                            scrollPosition: { x: actualScroll.x, y: actualScroll.y },
-                            scrollType: container === document.documentElement ? 'window' : 'container'
-                        };
-                    }
-                """, [direction, amount])
-                
-                await asyncio.sleep(0.5)
-                
-                if scroll_result.get("success"):
-                    scroll_after = scroll_result.get("scrollPosition", {})
-                    scrolled = scroll_result.get("scrolled", False)
-                    scroll_type = scroll_result.get("scrollType", "window")
-                    
-                    return {
-                        "success": True,
-                        "scroll_position": scroll_after,
-                        "scroll_type": scroll_type,
-                        "scrolled": scrolled,
-                        "direction": direction,
-                        "amount": amount,
-                        "message": f"Прокрутка {direction} на {amount}px выполнена ({scroll_type}, через JavaScript fallback)" if scrolled else "Прокрутка не изменила позицию"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": f"Не удалось выполнить прокрутку: {str(e)}"
-                    }
+            
+            scroll_after = scroll_info.get("after", {})
+            scrolled = scroll_info.get("scrolled", False)
+            
+            # scrollBy не сдвинул страницу, хотя контейнер не у края (например, прокрутка реализована
+            # обработчиками колеса) - повторяем как жест колесом через CDP в центре контейнера.
+            # У края страницы и при нулевом смещении жест ничего не даст - пропускаем его
+            if not scrolled and scroll_info.get("canMove") and self._cdp and scroll_info.get("point"):
+                try:
+                    point = scroll_info["point"]
+                    # В CDP положительная дистанция означает прокрутку вверх/влево
+                    await self._cdp.send("Input.synthesizeScrollGesture", {
+                        "x": point["x"],
+                        "y": point["y"],
+                        "xDistance": -delta_x,
+                        "yDistance": -delta_y,
+                        "speed": _SCROLL_GESTURE_SPEED,
+                        "gestureSourceType": "mouse"
+                    })
+                    scroll_after = await self._call_page_helper("scrollState")
+                    before = scroll_info.get("before", {})
+                    scrolled = (
+                        scroll_after.get("scrollTop") != before.get("scrollTop")
+                        or scroll_after.get("scrollLeft") != before.get("scrollLeft")
+                    )
+                except Exception:
+                    pass
+            scroll_type = "container" if scroll_info.get("found") else "window"
+            
+            # Проверяем, достигли ли мы конца
+            is_at_bottom = scroll_after.get("scrollTop", 0) >= scroll_after.get("scrollHeight", 0) - scroll_after.get("clientHeight", 0) - 10
+            is_at_top = scroll_after.get("scrollTop", 0) <= 10
+            
+            return {
+                "success": True,
+                "scroll_position": {
+                    "x": scroll_after.get("scrollLeft", 0),
+                    "y": scroll_after.get("scrollTop", 0)
+                },
+                "scroll_type": scroll_type,
+                "scrolled": scrolled,
+                "direction": direction,
+                "amount": amount,
+                "is_at_bottom": is_at_bottom,
+                "is_at_top": is_at_top,
+                "can_scroll_more": not (is_at_bottom and direction == "down") and not (is_at_top and direction == "up"),
+                "message": f"Прокрутка {direction} на {amount}px выполнена ({scroll_type})" if scrolled else "Прокрутка не изменила позицию (возможно, достигнут конец)"
+            }
         except Exception as e:
             return {
                 "success": False,
@@ -766,87 +1268,142 @@ class BrowserController:
                 "error": str(e)
             }
     
-    async def get_text(self, selector: str, include_children: bool = True) -> Dict[str, Any]:
+    async def wait_and_get_text(
+        self,
+        selector: str,
+        timeout: Optional[int] = None,
+        include_children: bool = True,
+        max_length: int = _GET_TEXT_MAX_LENGTH
+    ) -> Dict[str, Any]:
         """
-        Получение текста элемента с поддержкой больших блоков и неинтерактивных элементов
+        Ожидание появления элемента и получение его текста за одно обращение к странице
+        
+        Заменяет пару wait_for_element + get_text. Если элемент не стал видимым за таймаут,
+        текст извлекается без ожидания (как fallback на get_text).
         
         Args:
             selector: CSS селектор элемента
+            timeout: Таймаут ожидания (мс)
             include_children: Включать ли текст дочерних элементов (по умолчанию True)
+            max_length: Максимальная длина возвращаемого текста (0 - без ограничения);
+                length в результате - полная длина текста
             
         Returns:
-            Результат с текстом элемента
+            Результат с текстом элемента и флагом visible (дождались ли видимости)
         """
         try:
-            # Используем innerText для получения видимого текста (включая форматирование)
-            # или textContent для получения всего текста включая скрытый
-            # В Playwright Python аргументы передаются как отдельные параметры
-            text = await self.page.evaluate("""
-            ([selector, includeChildren]) => {
-                try {
-                    const element = document.querySelector(selector);
-                    if (!element) return null;
-                    
-                    // Для больших блоков текста используем innerText (видимый текст)
-                    // Это лучше работает для резюме, описаний и т.д.
-                    if (includeChildren) {
-                        // Получаем весь видимый текст элемента и его детей
-                        return element.innerText || element.textContent || '';
-                    } else {
-                        // Только текст самого элемента без детей
-                        return element.textContent || '';
-                    }
-                } catch (e) {
-                    return null;
-                }
-            }
-            """, [selector, include_children])
-            
-            if text is None:
-                return {
-                    "success": False,
-                    "error": f"Элемент с селектором '{selector}' не найден"
-                }
-            
-            # Очищаем текст от лишних пробелов, но сохраняем структуру
-            text = text.strip() if text else ""
-            
+            timeout = timeout or BROWSER_TIMEOUT
+            info = await self._call_page_helper("waitText", [selector, include_children, timeout, max_length])
+            result = self._text_result(selector, info)
+            if result["success"]:
+                result["visible"] = info.get("visible", False)
+            return result
+        except Exception as e:
             return {
-                "success": True,
-                "text": text,
-                "length": len(text)
+                "success": False,
+                "error": str(e)
             }
+    
+    async def get_text(
+        self,
+        selector: str,
+        include_children: bool = True,
+        visible_only: bool = False,
+        max_length: int = _GET_TEXT_MAX_LENGTH
+    ) -> Dict[str, Any]:
+        """
+        Получение текста элемента с поддержкой больших блоков и неинтерактивных элементов
+        
+        Args:
+            selector: CSS селектор элемента
+            include_children: Включать ли текст дочерних элементов (по умолчанию True)
+            visible_only: Только видимый текст с форматированием (innerText, вызывает пересчет layout).
+                По умолчанию используется textContent
+            max_length: Максимальная длина возвращаемого текста (0 - без ограничения);
+                length в результате - полная длина текста
+            
+        Returns:
+            Результат с текстом элемента
+        """
+        try:
+            # Аргументы передаются одним списком
+            info = await self._call_page_helper("text", [selector, include_children, visible_only, max_length])
+            return self._text_result(selector, info)
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e)
             }
     
+    @staticmethod
+    def _text_result(selector: str, info: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Формирование результата get_text из данных, полученных на странице (текст уже обрезан)"""
+        if not isinstance(info, dict):
+            return {
+                "success": False,
+                "error": f"Элемент с селектором '{selector}' не найден"
+            }
+        
+        return {
+            "success": True,
+            "text": info.get("text") or "",
+            "length": info.get("length", 0),
+            "truncated": info.get("truncated", False)
+        }
+    
     async def get_current_url(self) -> str:
-        """Получение текущего URL"""
+        """Получение текущего URL (page.url хранится на стороне Python и не требует обращения к браузеру)"""
         return self.page.url if self.page else ""
     
     async def get_title(self) -> str:
-        """Получение заголовка страницы"""
-        return await self.page.title() if self.page else ""
+        """Получение заголовка страницы (запрашивается из браузера один раз на документ)"""
+        if not self.page:
+            return ""
+        if self._title_cache is None:
+            title = await self._fast_eval("() => document.title")
+            # Пустой заголовок не кэшируем - документ может быть еще не разобран
+            if title:
+                self._title_cache = title
+            return title or ""
+        return self._title_cache
     
-    async def take_screenshot(self, path: Optional[str] = None, full_page: bool = True) -> Dict[str, Any]:
+    async def take_screenshot(
+        self,
+        path: Optional[str] = None,
+        full_page: bool = True,
+        format: str = "jpeg",
+        quality: int = 70,
+        clip: Optional[Dict[str, float]] = None
+    ) -> Dict[str, Any]:
         """
         Создание скриншота страницы
         
+        По умолчанию снимок делается в JPEG: для анализа через Vision API потеря качества
+        не важна, а кодирование и передача по CDP в разы быстрее, чем у PNG.
+        
         Args:
             path: Путь для сохранения скриншота (опционально)
             full_page: Делать скриншот всей страницы (True) или только видимой области (False)
+            format: Формат изображения ("jpeg" или "png")
+            quality: Качество JPEG (0-100), для PNG игнорируется
+            clip: Область снимка {"x", "y", "width", "height"} (опционально)
             
         Returns:
             Результат операции
         """
         try:
-            screenshot_bytes = await self.page.screenshot(path=path, full_page=full_page)
+            screenshot_bytes = await self.page.screenshot(
+                path=path,
+                full_page=full_page,
+                type=format,
+                quality=quality if format == "jpeg" else None,
+                clip=clip
+            )
             return {
                 "success": True,
                 "screenshot": screenshot_bytes if not path else None,
-                "path": path
+                "path": path,
+                "format": format
             }
         except Exception as e:
             return {
@@ -881,52 +1438,8 @@ class BrowserController:
         Returns:
             Результат проверки видимости
         """
-        script = """
-        (selector) => {
-            try {
-                const element = document.querySelector(selector);
-                if (!element) {
-                    return {visible: false, error: 'Element not found'};
-                }
-                
-                const style = window.getComputedStyle(element);
-                const rect = element.getBoundingClientRect();
-                const viewportHeight = window.innerHeight || document.documentElement.clientHeight;
-                const viewportWidth = window.innerWidth || document.documentElement.clientWidth;
-                
-                // Проверка стилей
-                const isDisplayed = style.display !== 'none' && 
-                                  style.visibility !== 'hidden' && 
-                                  style.opacity !== '0';
-                
-                // Проверка размеров
-                const hasSize = rect.width > 0 && rect.height > 0;
-                
-                // Проверка попадания в viewport
-                const isInViewport = rect.top < viewportHeight && rect.bottom > 0 && 
-                                    rect.left < viewportWidth && rect.right > 0;
-                
-                return {
-                    visible: isDisplayed && hasSize && isInViewport,
-                    isDisplayed: isDisplayed,
-                    hasSize: hasSize,
-                    isInViewport: isInViewport,
-                    rect: {
-                        top: rect.top,
-                        bottom: rect.bottom,
-                        left: rect.left,
-                        right: rect.right,
-                        width: rect.width,
-                        height: rect.height
-                    }
-                };
-            } catch (e) {
-                return {visible: false, error: e.message};
-            }
-        }
-        """
         try:
-            result = await self.page.evaluate(script, selector)
+            result = await self._call_page_helper("visibility", selector)
             return result if isinstance(result, dict) else {"visible": False, "error": "Unknown error"}
         except Exception as e:
             return {"visible": False, "error": str(e)}
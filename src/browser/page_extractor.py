@@ -16,19 +16,34 @@ class PageExtractor:
         # Кэш для результатов поиска элементов (на время одной итерации)
         self._element_cache: Dict[str, Optional[Dict[str, Any]]] = {}
         self._current_url: Optional[str] = None
-        # Кэш для результатов extract_page_info (на короткое время)
+        # Кэш для результатов extract_page_info: ключ (url, include_text) и время сохранения.
+        # Изменения DOM после действий агента сбрасывает invalidate_cache(), TTL - страховка
+        # на случай изменений без действий (таймеры, подгрузка данных)
         self._page_info_cache: Optional[Dict[str, Any]] = None
-        self._page_info_cache_url: Optional[str] = None
+        self._page_info_cache_key: Optional[tuple] = None
         self._page_info_cache_time: float = 0.0
     
-    async def extract_page_info(self, include_text: bool = True, use_cache: bool = True, cache_ttl: float = 0.5) -> Dict[str, Any]:
+    def invalidate_cache(self):
+        """Сброс кэшей страницы (вызывается после действий, изменяющих DOM: клик, ввод, переход)"""
+        self._page_info_cache = None
+        self._page_info_cache_key = None
+        self._element_cache.clear()
+    
+    async def extract_page_info(self, include_text: bool = True, use_cache: bool = True, cache_ttl: float = 5.0) -> Dict[str, Any]:
         """
         Извлечение структурированной информации о странице с кэшированием
         
+        Кэш действует, пока не изменился URL и не истек TTL; invalidate_cache() сбрасывает
+        его явно. Страница, извлеченная до окончания загрузки (readyState не complete),
+        не кэшируется - ее DOM еще меняется.
+        Каждый вызов возвращает новый словарь верхнего уровня (поверхностная копия):
+        ключи можно добавлять и заменять, не затрагивая кэш. Вложенные списки и словари
+        общие с кэшем - их нельзя изменять на месте.
+        
         Args:
             include_text: Включать ли текстовое содержимое элементов
             use_cache: Использовать ли кэш (по умолчанию True)
-            cache_ttl: Время жизни кэша в секундах (по умолчанию 0.5 сек)
+            cache_ttl: Время жизни кэша в секундах (по умолчанию 5 сек)
             
         Returns:
             Словарь с информацией о странице
@@ -37,9 +52,10 @@ class PageExtractor:
         current_time = time.time()
         
         # Проверяем кэш
-        if use_cache and self._page_info_cache and self._page_info_cache_url == current_url:
-            if current_time - self._page_info_cache_time < cache_ttl:
-                return self._page_info_cache.copy()
+        cache_key = (current_url, include_text)
+        if (use_cache and self._page_info_cache and self._page_info_cache_key == cache_key
+                and current_time - self._page_info_cache_time < cache_ttl):
+            return dict(self._page_info_cache)
         
         # Очищаем кэш при смене URL
         if current_url != self._current_url:
@@ -60,33 +76,56 @@ class PageExtractor:
             "metadata": page_metadata
         }
         
-        # Сохраняем в кэш
-        if use_cache:
-            self._page_info_cache = result.copy()
-            self._page_info_cache_url = current_url
+        # Сохраняем в кэш (readyState читается вместе с метаданными, без отдельного вызова)
+        if use_cache and page_metadata.get("readyState") == "complete":
+            self._page_info_cache = result
+            self._page_info_cache_key = cache_key
             self._page_info_cache_time = current_time
         
-        return result
+        return dict(result)
     
     async def _extract_interactive_elements(self, include_text: bool = True) -> List[Dict[str, Any]]:
         """Извлечение интерактивных элементов (кнопки, ссылки, формы, поля ввода)"""
         script = """
         () => {
             const elements = [];
+            // Селекторы уже добавленных элементов: проверка дубликатов за O(1) вместо поиска по elements
+            const seen = new Set();
+            function addElement(record) {
+                elements.push(record);
+                seen.add(record.selector);
+            }
+            
+            // Кэши стилей и видимости: один элемент проверяется многократно (фильтры категорий,
+            // поле visible, обход предков в isInModal), getComputedStyle вызывается один раз на элемент
+            const styleCache = new WeakMap();
+            const visCache = new WeakMap();
+            function getStyle(element) {
+                let style = styleCache.get(element);
+                if (!style) {
+                    style = window.getComputedStyle(element);
+                    styleCache.set(element, style);
+                }
+                return style;
+            }
             
             // Функция для проверки видимости элемента
             function isVisible(element) {
                 if (!element) return false;
+                let visible = visCache.get(element);
+                if (visible !== undefined) return visible;
                 try {
-                    const style = window.getComputedStyle(element);
-                    return style.display !== 'none' && 
-                           style.visibility !== 'hidden' && 
-                           style.opacity !== '0' &&
-                           element.offsetWidth > 0 && 
-                           element.offsetHeight > 0;
+                    const style = getStyle(element);
+                    visible = style.display !== 'none' && 
+                              style.visibility !== 'hidden' && 
+                              style.opacity !== '0' &&
+                              element.offsetWidth > 0 && 
+                              element.offsetHeight > 0;
                 } catch (e) {
-                    return false;
+                    visible = false;
                 }
+                visCache.set(element, visible);
+                return visible;
             }
             
             // Функция для получения текста элемента - УЛУЧШЕННАЯ ВЕРСИЯ
@@ -136,119 +175,150 @@ class PageExtractor:
                 return element.tagName ? element.tagName.toLowerCase() : 'div';
             }
             
+            // Признаки одного узла: модальное окно, форма, контейнер-карточка
+            function classifyNode(node) {
+                const result = {modal: false, form: false, container: false};
+                try {
+                    const tagName = node.tagName?.toLowerCase() || '';
+                    const role = node.getAttribute('role') || '';
+                    const id = (node.id || '').toLowerCase();
+                    const className = typeof node.className === 'string' ? node.className.toLowerCase() : '';
+                    
+                    // Проверяем, является ли узел контейнером (карточка, блок, item)
+                    result.container = className.includes('card') || 
+                                       className.includes('item') || 
+                                       className.includes('block') ||
+                                       className.includes('container') ||
+                                       id.includes('card') ||
+                                       id.includes('item') ||
+                                       role === 'article' ||
+                                       role === 'region';
+                    result.form = tagName === 'form' || role === 'form';
+                    
+                    const ariaModal = node.getAttribute('aria-modal');
+                    const dataQa = node.getAttribute('data-qa')?.toLowerCase() || '';
+                    const dataTestid = node.getAttribute('data-testid')?.toLowerCase() || '';
+                    
+                    // Проверяем модальные окна по различным признакам (расширенный список)
+                    result.modal = role === 'dialog' || 
+                                   tagName === 'dialog' ||
+                                   ariaModal === 'true' ||
+                                   className.includes('modal') || 
+                                   className.includes('dialog') ||
+                                   className.includes('popup') ||
+                                   className.includes('overlay') ||
+                                   className.includes('backdrop') ||
+                                   id.includes('modal') || 
+                                   id.includes('dialog') ||
+                                   id.includes('popup') ||
+                                   dataQa.includes('modal') ||
+                                   dataQa.includes('dialog') ||
+                                   dataTestid.includes('modal') ||
+                                   dataTestid.includes('dialog') ||
+                                   // Проверка через z-index (модальные окна обычно имеют высокий z-index)
+                                   (parseInt(getStyle(node).zIndex) > 1000 && 
+                                    node.offsetWidth > 100 && node.offsetHeight > 100);
+                } catch (e) {
+                    // Игнорируем ошибки для отдельного узла
+                }
+                return result;
+            }
+            
+            // Расстояния от узла (включительно) вверх до ближайших модального окна, формы и
+            // контейнера. Кэшируются для каждого узла цепочки: соседние элементы списка делят
+            // предков, поэтому подъем останавливается на первом уже классифицированном предке
+            const ancestorCache = new WeakMap();
+            const NO_ANCESTORS = {modal: Infinity, form: Infinity, container: null, containerDist: Infinity};
+            function ancestorChain(node) {
+                const path = [];
+                let current = node;
+                while (current && !ancestorCache.has(current)) {
+                    path.push(current);
+                    current = current.parentElement;
+                }
+                let above = current ? ancestorCache.get(current) : NO_ANCESTORS;
+                for (let i = path.length - 1; i >= 0; i--) {
+                    const own = classifyNode(path[i]);
+                    above = {
+                        modal: own.modal ? 0 : above.modal + 1,
+                        form: own.form ? 0 : above.form + 1,
+                        container: own.container ? path[i] : above.container,
+                        containerDist: own.container ? 0 : above.containerDist + 1
+                    };
+                    ancestorCache.set(path[i], above);
+                }
+                return above;
+            }
+            
+            // Классификация предков элемента: модальное окно (до 20 уровней), форма и
+            // контейнер-карточка (до 10 уровней)
+            function classifyAncestors(element) {
+                const chain = element.parentElement ? ancestorChain(element.parentElement) : NO_ANCESTORS;
+                return {
+                    inModal: chain.modal < 20,
+                    inForm: chain.form < 10,
+                    container: chain.containerDist < 10 ? chain.container : null
+                };
+            }
+            
             // Функция для получения информации о родительском контейнере (карточка, блок)
             function getParentContainerInfo(element) {
                 if (!element) return null;
                 try {
-                    let parent = element.parentElement;
-                    let depth = 0;
-                    while (parent && depth < 10) {
-                        const tagName = parent.tagName?.toLowerCase() || '';
-                        const className = (parent.className || '').toLowerCase();
-                        const id = (parent.id || '').toLowerCase();
-                        const role = parent.getAttribute('role') || '';
-                        
-                        // Проверяем, является ли родитель контейнером (карточка, блок, item)
-                        if (className.includes('card') || 
-                            className.includes('item') || 
-                            className.includes('block') ||
-                            className.includes('container') ||
-                            id.includes('card') ||
-                            id.includes('item') ||
-                            role === 'article' ||
-                            role === 'region') {
-                            const containerText = (parent.innerText || parent.textContent || '').trim().substring(0, 100);
-                            return {
-                                selector: getSelector(parent),
-                                text_preview: containerText,
-                                tag: tagName
-                            };
-                        }
-                        parent = parent.parentElement;
-                        depth++;
-                    }
+                    const container = classifyAncestors(element).container;
+                    if (!container) return null;
+                    const containerText = (container.innerText || container.textContent || '').trim().substring(0, 100);
+                    return {
+                        selector: getSelector(container),
+                        text_preview: containerText,
+                        tag: container.tagName?.toLowerCase() || ''
+                    };
                 } catch (e) {
                     return null;
                 }
-                return null;
             }
             
             // Функция для проверки, находится ли элемент в модальном окне
             function isInModal(element) {
-                if (!element) return false;
-                try {
-                    let parent = element.parentElement;
-                    let depth = 0;
-                    while (parent && depth < 20) {
-                        const tagName = parent.tagName?.toLowerCase();
-                        const role = parent.getAttribute('role');
-                        const id = parent.id?.toLowerCase() || '';
-                        const className = parent.className?.toLowerCase() || '';
-                        const ariaModal = parent.getAttribute('aria-modal');
-                        const dataQa = parent.getAttribute('data-qa')?.toLowerCase() || '';
-                        const dataTestid = parent.getAttribute('data-testid')?.toLowerCase() || '';
-                        
-                        // Проверяем модальные окна по различным признакам (расширенный список)
-                        if (role === 'dialog' || 
-                            tagName === 'dialog' ||
-                            ariaModal === 'true' ||
-                            className.includes('modal') || 
-                            className.includes('dialog') ||
-                            className.includes('popup') ||
-                            className.includes('overlay') ||
-                            className.includes('backdrop') ||
-                            id.includes('modal') || 
-                            id.includes('dialog') ||
-                            id.includes('popup') ||
-                            dataQa.includes('modal') ||
-                            dataQa.includes('dialog') ||
-                            dataTestid.includes('modal') ||
-                            dataTestid.includes('dialog') ||
-                            // Проверка через z-index (модальные окна обычно имеют высокий z-index)
-                            (parseInt(window.getComputedStyle(parent).zIndex) > 1000 && 
-                             parent.offsetWidth > 100 && parent.offsetHeight > 100)) {
-                            return true;
-                        }
-                        parent = parent.parentElement;
-                        depth++;
-                    }
-                    return false;
-                } catch (e) {
-                    return false;
-                }
+                return element ? classifyAncestors(element).inModal : false;
             }
             
             // Функция для проверки, находится ли элемент в форме
             function isInForm(element) {
-                if (!element) return false;
-                try {
-                    let parent = element.parentElement;
-                    let depth = 0;
-                    while (parent && depth < 10) {
-                        const tagName = parent.tagName?.toLowerCase();
-                        const role = parent.getAttribute('role');
-                        
-                        if (tagName === 'form' || role === 'form') {
-                            return true;
-                        }
-                        parent = parent.parentElement;
-                        depth++;
-                    }
-                    return false;
-                } catch (e) {
-                    return false;
-                }
+                return element ? classifyAncestors(element).inForm : false;
             }
             
+            // Один проход по DOM вместо отдельного querySelectorAll на каждую категорию:
+            // элементы раскладываются по категориям (элемент может попасть в несколько),
+            // затем категории обрабатываются в прежнем порядке
+            const categorySelectors = {
+                buttons: 'button, [role="button"], input[type="button"], input[type="submit"]',
+                links: 'a[href]',
+                inputs: 'input, textarea, select',
+                landmarks: '[data-testid], [data-qa], [aria-label], [role]',
+                cards: '[class*="card" i], [class*="item" i], [class*="product" i], [data-qa*="card" i], [data-testid*="card" i]',
+                handlers: '[onclick], [data-action], [data-click], [data-onclick]',
+                lists: '[role="list"], [role="listbox"]',
+                listItems: '[role="listitem"], [role="option"]'
+            };
+            const categories = Object.entries(categorySelectors);
+            const buckets = {};
+            categories.forEach(([name]) => { buckets[name] = []; });
+            document.querySelectorAll(Object.values(categorySelectors).join(', ')).forEach(el => {
+                for (const [name, selector] of categories) {
+                    if (el.matches(selector)) buckets[name].push(el);
+                }
+            });
+            
             // Извлекаем кнопки - УЛУЧШЕННАЯ ВЕРСИЯ (включая невидимые, но важные)
-            document.querySelectorAll('button, [role="button"], input[type="button"], input[type="submit"]').forEach(btn => {
+            buckets.buttons.forEach(btn => {
                 try {
                     if (btn) {
                         const text = getElementText(btn);
                         // Включаем даже если не видим, но есть текст или aria-label
                         if (isVisible(btn) || text || btn.getAttribute('aria-label') || btn.getAttribute('title')) {
                             const parentContainer = getParentContainerInfo(btn);
-                            elements.push({
+                            addElement({
                                 type: 'button',
                                 selector: getSelector(btn),
                                 text: text,
@@ -269,7 +339,7 @@ class PageExtractor:
             });
             
             // Извлекаем ссылки - УЛУЧШЕННАЯ ВЕРСИЯ
-            document.querySelectorAll('a[href]').forEach(link => {
+            buckets.links.forEach(link => {
                 try {
                     if (link) {
                         const text = getElementText(link);
@@ -280,7 +350,7 @@ class PageExtractor:
                         const isImportant = text.length > 0 || href.length > 0;
                         if (isVisible(link) || isImportant) {
                             const parentContainer = getParentContainerInfo(link);
-                            elements.push({
+                            addElement({
                                 type: 'link',
                                 selector: getSelector(link),
                                 text: text || href.split('/').pop() || 'ссылка',
@@ -301,10 +371,10 @@ class PageExtractor:
             });
             
             // Извлекаем поля ввода
-            document.querySelectorAll('input, textarea, select').forEach(input => {
+            buckets.inputs.forEach(input => {
                 try {
                     if (input && isVisible(input)) {
-                        elements.push({
+                        addElement({
                             type: 'input',
                             selector: getSelector(input),
                             input_type: input.type || (input.tagName ? input.tagName.toLowerCase() : 'input'),
@@ -324,14 +394,15 @@ class PageExtractor:
             });
             
             // Извлекаем важные элементы с data-атрибутами или aria-атрибутами
-            document.querySelectorAll('[data-testid], [data-qa], [aria-label], [role]').forEach(el => {
+            buckets.landmarks.forEach(el => {
                 try {
-                    if (el && isVisible(el) && !elements.some(e => e.selector === getSelector(el))) {
+                    const selector = getSelector(el);
+                    if (el && isVisible(el) && !seen.has(selector)) {
                         const role = el.getAttribute('role');
                         if (role && ['navigation', 'search', 'main', 'form'].includes(role)) {
-                            elements.push({
+                            addElement({
                                 type: 'landmark',
-                                selector: getSelector(el),
+                                selector: selector,
                                 role: role,
                                 text: getElementText(el),
                                 tag: el.tagName ? el.tagName.toLowerCase() : 'div',
@@ -346,7 +417,7 @@ class PageExtractor:
             });
             
             // Извлекаем карточки/блоки с кликабельными областями (для ресторанов, товаров и т.д.)
-            document.querySelectorAll('[class*="card" i], [class*="item" i], [class*="product" i], [data-qa*="card" i], [data-testid*="card" i]').forEach(card => {
+            buckets.cards.forEach(card => {
                 try {
                     if (card && isVisible(card)) {
                         // Проверяем, является ли карточка кликабельной
@@ -362,11 +433,11 @@ class PageExtractor:
                             const text = getElementText(card);
                             // Добавляем только если есть текст или изображение
                             if (text || card.querySelector('img')) {
-                                const existing = elements.find(e => e.selector === getSelector(card));
-                                if (!existing) {
-                                    elements.push({
+                                const selector = getSelector(card);
+                                if (!seen.has(selector)) {
+                                    addElement({
                                         type: 'card',
-                                        selector: getSelector(card),
+                                        selector: selector,
                                         text: text,
                                         tag: card.tagName ? card.tagName.toLowerCase() : 'div',
                                         id: card.id || null,
@@ -383,15 +454,16 @@ class PageExtractor:
             });
             
             // Извлекаем элементы с обработчиками событий (onclick, data-action и т.д.)
-            document.querySelectorAll('[onclick], [data-action], [data-click], [data-onclick]').forEach(el => {
+            buckets.handlers.forEach(el => {
                 try {
-                    if (el && isVisible(el) && !elements.some(e => e.selector === getSelector(el))) {
+                    const selector = getSelector(el);
+                    if (el && isVisible(el) && !seen.has(selector)) {
                         const text = getElementText(el);
                         // Добавляем только если есть текст или это важный элемент
                         if (text || el.tagName === 'BUTTON' || el.tagName === 'A' || el.getAttribute('role') === 'button') {
-                            elements.push({
+                            addElement({
                                 type: 'interactive',
-                                selector: getSelector(el),
+                                selector: selector,
                                 text: text,
                                 tag: el.tagName ? el.tagName.toLowerCase() : 'div',
                                 id: el.id || null,
@@ -407,7 +479,7 @@ class PageExtractor:
             
             // УНИВЕРСАЛЬНОЕ извлечение элементов списков (БЕЗ хардкодинга конкретных селекторов)
             // Ищем контейнеры списков с role="list" или role="listbox"
-            document.querySelectorAll('[role="list"], [role="listbox"]').forEach(listContainer => {
+            buckets.lists.forEach(listContainer => {
                 try {
                     if (listContainer && isVisible(listContainer)) {
                         // Ищем элементы списка внутри контейнера
@@ -458,11 +530,11 @@ class PageExtractor:
                                     
                                     // Добавляем элемент списка, если он видим и имеет текст или кликабельные элементы
                                     if (itemText || clickableElements.length > 0 || isItemClickable) {
-                                        const existing = elements.find(e => e.selector === getSelector(listItem));
-                                        if (!existing) {
-                                            elements.push({
+                                        const selector = getSelector(listItem);
+                                        if (!seen.has(selector)) {
+                                            addElement({
                                                 type: 'list_item',
-                                                selector: getSelector(listItem),
+                                                selector: selector,
                                                 text: itemText,
                                                 tag: listItem.tagName ? listItem.tagName.toLowerCase() : 'div',
                                                 id: listItem.id || null,
@@ -490,7 +562,7 @@ class PageExtractor:
             
             // Также ищем элементы с role="listitem" и role="option" вне явных контейнеров списков
             // (на случай если структура списка не использует role="list")
-            document.querySelectorAll('[role="listitem"], [role="option"]').forEach(listItem => {
+            buckets.listItems.forEach(listItem => {
                 try {
                     // Пропускаем если уже обработан как часть контейнера списка
                     if (listItem.closest('[role="list"], [role="listbox"]')) {
@@ -521,11 +593,11 @@ class PageExtractor:
                                               listItem.closest('a') !== null;
                         
                         if (itemText || clickableElements.length > 0 || isItemClickable) {
-                            const existing = elements.find(e => e.selector === getSelector(listItem));
-                            if (!existing) {
-                                elements.push({
+                            const selector = getSelector(listItem);
+                            if (!seen.has(selector)) {
+                                addElement({
                                     type: 'list_item',
-                                    selector: getSelector(listItem),
+                                    selector: selector,
                                     text: itemText,
                                     tag: listItem.tagName ? listItem.tagName.toLowerCase() : 'div',
                                     id: listItem.id || null,
@@ -647,11 +719,11 @@ class PageExtractor:
                                         
                                         // Добавляем только если есть текст или кликабельные элементы
                                         if ((itemText && itemText.length > 5) || clickableElements.length > 0 || isItemClickable) {
-                                            const existing = elements.find(e => e.selector === getSelector(item));
-                                            if (!existing) {
-                                                elements.push({
+                                            const selector = getSelector(item);
+                                            if (!seen.has(selector)) {
+                                                addElement({
                                                     type: 'list_item',
-                                                    selector: getSelector(item),
+                                                    selector: selector,
                                                     text: itemText,
                                                     tag: item.tagName ? item.tagName.toLowerCase() : 'div',
                                                     id: item.id || null,
@@ -804,6 +876,7 @@ class PageExtractor:
             return {
                 title: document.title,
                 url: window.location.href,
+                readyState: document.readyState,
                 description: document.querySelector('meta[name="description"]')?.content || null,
                 viewport: {
                     width: window.innerWidth,
@@ -14,13 +14,14 @@ class ScreenshotManager:
         self.screenshots_dir = PROJECT_ROOT / "screenshots"
         self.screenshots_dir.mkdir(exist_ok=True)
     
-    def generate_screenshot_path(self, description: Optional[str] = None, action: Optional[str] = None) -> Path:
+    def generate_screenshot_path(self, description: Optional[str] = None, action: Optional[str] = None, image_format: str = "png") -> Path:
         """
         Генерация пути для сохранения скриншота
         
         Args:
             description: Описание скриншота (опционально)
             action: Тип действия, при котором сделан скриншот (опционально)
+            image_format: Формат изображения, определяет расширение файла ("png" или "jpeg")
             
         Returns:
             Путь к файлу скриншота
@@ -38,10 +39,11 @@ class ScreenshotManager:
             if safe_description:
                 filename_parts.append(safe_description)
         
-        filename = "_".join(filename_parts) + ".png"
+        extension = ".jpg" if image_format == "jpeg" else f".{image_format}"
+        filename = "_".join(filename_parts) + extension
         return self.screenshots_dir / filename
     
-    async def save_screenshot(self, screenshot_bytes: bytes, description: Optional[str] = None, action: Optional[str] = None) -> Dict[str, Any]:
+    async def save_screenshot(self, screenshot_bytes: bytes, description: Optional[str] = None, action: Optional[str] = None, image_format: str = "png") -> Dict[str, Any]:
         """
         Сохранение скриншота в файл
         
@@ -49,12 +51,13 @@ class ScreenshotManager:
             screenshot_bytes: Байты скриншота
             description: Описание скриншота (опционально)
             action: Тип действия (опционально)
+            image_format: Формат изображения ("png" или "jpeg")
             
         Returns:
             Результат операции с путем к файлу
         """
         try:
-            screenshot_path = self.generate_screenshot_path(description, action)
+            screenshot_path = self.generate_screenshot_path(description, action, image_format)
             
             # Сохраняем скриншот
             with open(screenshot_path, 'wb') as f:
@@ -8,9 +8,10 @@ from rich.live import Live
 from rich.table import Table
 from rich.text import Text
 
-from src.browser.controller import BrowserController
+from src.browser.controller import BrowserController, shutdown_playwright
 from src.browser.session_manager import SessionManager
 from src.agent.main_agent import MainAgent, Logger
+from src.agent.sub_agents import shutdown_client
 
 
 class CLIInterface:
@@ -246,7 +247,6 @@ class CLIInterface:
             self.console.print("[dim]Сохранение текущей сессии...[/dim]")
             await self.browser_controller.close()
             # Даем время на сохранение данных
-            import asyncio
             await asyncio.sleep(1)
         
         # Инициализируем новую сессию
@@ -301,7 +301,10 @@ class CLIInterface:
             await self.browser_controller.close()
             # Даем время на сохранение данных для persistent sessions
             if self.current_session:
-                import asyncio
                 await asyncio.sleep(1)
                 self.console.print(f"[green]Сессия '{self.current_session}' сохранена[/green]")
+        # Драйвер Playwright общий для всех контроллеров - останавливаем его при завершении
+        await shutdown_playwright()
+        # Общий клиент OpenAI sub-агентов закрываем вместе с его пулом соединений
+        await shutdown_client()
 
@@ -0,0 +1,40 @@
+"""Тесты контроллера браузера"""
+from src.browser.controller import (
+    _classify_click_error, _MOUSE_CLICK_ERROR_KINDS, _MOUSE_CLICK_ERROR_MESSAGES
+)
+
+
+def test_classify_click_error_kinds():
+    """Ошибки Playwright сопоставляются с типом по приоритету"""
+    timeout = _classify_click_error("Timeout 5000ms exceeded. element intercepts pointer events", "#buy", 5000)
+    assert timeout["success"] is False
+    assert "Таймаут" in timeout["error"] and "5000" in timeout["error"]
+    
+    intercepted = _classify_click_error("<div class=overlay> intercepts pointer events", "#buy", 5000)
+    assert "перехватывается" in intercepted["error"]
+    
+    not_visible = _classify_click_error("Element is not visible", "#buy", 5000)
+    assert "не виден" in not_visible["error"]
+    
+    not_clickable = _classify_click_error("Element is not clickable at point", "#buy", 5000)
+    assert "не кликабелен" in not_clickable["error"]
+
+
+def test_classify_click_error_other():
+    """Прочие ошибки передаются с исходным текстом"""
+    result = _classify_click_error("Execution context was destroyed", "#buy", 5000)
+    assert "#buy" in result["error"]
+    assert "Execution context was destroyed" in result["error"]
+
+
+def test_classify_mouse_click_error():
+    """Для клика через Mouse API перехват не выделяется в отдельный тип"""
+    result = _classify_click_error(
+        "element intercepts pointer events",
+        "#buy",
+        5000,
+        kinds=_MOUSE_CLICK_ERROR_KINDS,
+        messages=_MOUSE_CLICK_ERROR_MESSAGES
+    )
+    assert "Mouse API" in result["error"]
+    assert "intercepts pointer events" in result["error"]
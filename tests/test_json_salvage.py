@@ -0,0 +1,45 @@
+"""Тесты восстановления битых аргументов функций"""
+from src.agent.main_agent import _salvage_json_object
+
+
+def test_salvage_complete_object():
+    """Целый объект с мусором вокруг разбирается полностью"""
+    assert _salvage_json_object('args: {"a": 1} trailing') == {"a": 1}
+
+
+def test_salvage_flat_truncated():
+    """Плоский объект, оборванный после значения"""
+    assert _salvage_json_object('{"a": "x", "b": 1') == {"a": "x", "b": 1}
+
+
+def test_salvage_comma_inside_string():
+    """Запятая внутри строки не считается точкой среза"""
+    assert _salvage_json_object('{"a": "x, y", "b": tru') == {"a": "x, y"}
+
+
+def test_salvage_escaped_quote():
+    """Экранированная кавычка и скобки внутри строки не ломают разбор"""
+    assert _salvage_json_object('{"a": "q\\"}", "b": tru') == {"a": 'q"}'}
+
+
+def test_salvage_nested_truncated():
+    """Вложенные объекты и массивы закрываются в обратном порядке"""
+    assert _salvage_json_object('{"a": {"b": 1, "c": [1, 2') == {"a": {"b": 1, "c": [1, 2]}}
+    assert _salvage_json_object('{"a": 1, "b": {"c": "d"}, "e": "f') == {"a": 1, "b": {"c": "d"}}
+
+
+def test_salvage_truncated_string_dropped():
+    """Оборванное строковое значение или ключ отбрасывается"""
+    assert _salvage_json_object('{"url": "https://ex') == {}
+    assert _salvage_json_object('{"a": "x", "b') == {"a": "x"}
+
+
+def test_salvage_mismatched_bracket():
+    """Непарная закрывающая скобка обрывает разбор"""
+    assert _salvage_json_object('{"a": [1, 2}') == {"a": [1, 2]}
+
+
+def test_salvage_no_object():
+    """Без объекта возвращается пустой словарь"""
+    assert _salvage_json_object('nothing') == {}
+    assert _salvage_json_object('{"a": ') == {}
@@ -0,0 +1,61 @@
+"""Тесты извлечения информации со страницы"""
+import pytest
+from src.browser.controller import BrowserController
+from src.browser.page_extractor import PageExtractor
+
+
+def _nested(outer: str, depth: int, button_text: str) -> str:
+    """Кнопка внутри outer через depth вложенных div"""
+    return f"<{outer}>" + "<div>" * depth + f"<button>{button_text}</button>" + "</div>" * depth + f"</{outer.split()[0]}>"
+
+
+@pytest.mark.asyncio
+async def test_classify_ancestors_depth_limits():
+    """Модальное окно учитывается до 20 уровней вверх, форма и контейнер - до 10"""
+    controller = BrowserController()
+    try:
+        await controller.start()
+        await controller.page.set_content(
+            _nested('div role="dialog"', 15, "Модальная близко")
+            + _nested('div role="dialog"', 25, "Модальная далеко")
+            + _nested("form", 5, "Форма близко")
+            + _nested("form", 12, "Форма далеко")
+            + _nested('div class="card"', 5, "Карточка близко")
+            + _nested('div class="card"', 12, "Карточка далеко")
+        )
+        
+        extractor = PageExtractor(controller.page)
+        page_info = await extractor.extract_page_info()
+        buttons = {elem["text"]: elem for elem in page_info["interactive_elements"] if elem["type"] == "button"}
+        
+        assert buttons["Модальная близко"]["in_modal"] is True
+        assert buttons["Модальная далеко"]["in_modal"] is False
+        assert buttons["Форма близко"]["in_form"] is True
+        assert buttons["Форма далеко"]["in_form"] is False
+        assert buttons["Карточка близко"]["parent_container"] is not None
+        assert buttons["Карточка далеко"]["parent_container"] is None
+    finally:
+        await controller.close()
+
+
+@pytest.mark.asyncio
+async def test_extract_page_info_returns_copy():
+    """Каждый вызов возвращает новый словарь верхнего уровня, вложенные данные общие с кэшем"""
+    controller = BrowserController()
+    try:
+        await controller.start()
+        await controller.page.set_content("<button>Найти</button><a href='#'>Войти</a>")
+        
+        extractor = PageExtractor(controller.page)
+        first = await extractor.extract_page_info()
+        first["metadata"] = {**first["metadata"], "page_state": "changed"}
+        first["location_context"] = {"section": "test"}
+        second = await extractor.extract_page_info()
+        
+        assert second is not first
+        assert "location_context" not in second
+        assert "page_state" not in second["metadata"]
+        # Повторный вызов берет данные из кэша - список элементов тот же
+        assert second["interactive_elements"] is first["interactive_elements"]
+    finally:
+        await controller.close()
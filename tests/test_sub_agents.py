@@ -0,0 +1,208 @@
+"""Тесты вспомогательных функций sub-агентов (без запросов к OpenAI)"""
+import asyncio
+import pytest
+from src.agent.sub_agents import (
+    _ENC, _HISTORY_MARKER, DOMSubAgent, SubAgent, _PendingBatch, _build_inverted_index,
+    _match_postings, _parse_json_object, _truncate_to_tokens
+)
+
+
+def test_truncate_to_tokens_short_text_unchanged():
+    """Текст в пределах лимита возвращается как есть"""
+    text = "Кнопка: Найти. Ссылка: Войти."
+    assert _truncate_to_tokens(text, 1000) == text
+
+
+def test_truncate_to_tokens_line_boundary():
+    """Длинный список обрезается по лимиту токенов и по концу строки"""
+    text = "\n".join(f"{i}. Элемент страницы номер {i}" for i in range(200))
+    truncated = _truncate_to_tokens(text, 50)
+    
+    assert len(_ENC.encode(truncated)) <= 50
+    assert text.startswith(truncated)
+    assert text[len(truncated)] == "\n"
+
+
+def test_truncate_to_tokens_sentence_boundary():
+    """Текст без переводов строки обрезается по концу предложения"""
+    text = "Это предложение о странице. " * 100
+    truncated = _truncate_to_tokens(text, 40)
+    
+    assert len(_ENC.encode(truncated)) <= 40
+    assert text.startswith(truncated)
+    assert truncated.endswith(".")
+
+
+def _make_context(history_records: int) -> str:
+    """Контекст в формате TokenOptimizer.format_context: шапка страницы и история действий"""
+    head = "URL: https://example.com\nЗаголовок: Example\n" + "\n".join(
+        f"{i}. button: Кнопка {i}" for i in range(5)
+    )
+    history = "".join(f"\n  {i}. ✓ click_element: клик по кнопке {i}" for i in range(1, history_records + 1))
+    return head + _HISTORY_MARKER + history
+
+
+def test_truncate_context_within_budget_unchanged():
+    """Контекст в пределах бюджета не изменяется"""
+    agent = SubAgent("test", "system", context_token_budget=1000)
+    context = _make_context(3)
+    assert agent._truncate_context(context) == context
+
+
+def test_truncate_context_keeps_head_and_latest_history():
+    """Шапка страницы сохраняется, от истории остаются последние целые записи"""
+    agent = SubAgent("test", "system", context_token_budget=300)
+    context = _make_context(100)
+    head = context.partition(_HISTORY_MARKER)[0]
+    truncated = agent._truncate_context(context)
+    
+    assert truncated.startswith(head + _HISTORY_MARKER)
+    assert truncated.endswith("клик по кнопке 100")
+    assert "клик по кнопке 1\n" not in truncated
+    history = truncated.partition(_HISTORY_MARKER)[2]
+    assert history.startswith("\n  ")
+    # Части считаются по отдельности - на стыках токенизация может отличаться на токен
+    assert len(_ENC.encode(truncated)) <= 300 + 2
+
+
+def test_truncate_context_long_head_without_history():
+    """Без истории обрезается только шапка"""
+    agent = SubAgent("test", "system", context_token_budget=50)
+    context = "\n".join(f"{i}. link: Ссылка номер {i}" for i in range(200))
+    truncated = agent._truncate_context(context)
+    
+    assert context.startswith(truncated)
+    assert len(_ENC.encode(truncated)) <= 50
+
+
+@pytest.mark.asyncio
+async def test_pending_batch_lone_question_runs_immediately():
+    """Вопрос без запроса в полете выполняется сразу отдельным батчем"""
+    batches = []
+    
+    async def run_batch(queries):
+        batches.append(list(queries))
+        return [q.upper() for q in queries]
+    
+    pending = _PendingBatch()
+    assert await pending.submit("page", "a", run_batch) == "A"
+    assert await pending.submit("page", "b", run_batch) == "B"
+    assert batches == [["a"], ["b"]]
+
+
+@pytest.mark.asyncio
+async def test_pending_batch_coalesces_questions_during_request():
+    """Вопросы, пришедшие во время запроса, объединяются в следующий батч"""
+    batches = []
+    release = asyncio.Event()
+    
+    async def run_batch(queries):
+        batches.append(list(queries))
+        if len(batches) == 1:
+            await release.wait()
+        return [q.upper() for q in queries]
+    
+    pending = _PendingBatch()
+    first = asyncio.create_task(pending.submit("page", "a", run_batch))
+    await asyncio.sleep(0)
+    rest = [asyncio.create_task(pending.submit("page", q, run_batch)) for q in ("b", "c")]
+    other = asyncio.create_task(pending.submit("other", "d", run_batch))
+    await asyncio.sleep(0)
+    release.set()
+    
+    assert await first == "A"
+    assert [await task for task in rest] == ["B", "C"]
+    assert await other == "D"
+    assert sorted(batches) == [["a"], ["b", "c"], ["d"]]
+
+
+@pytest.mark.asyncio
+async def test_pending_batch_error_reaches_waiting_questions():
+    """Ошибка батча передается всем вопросам этого батча"""
+    release = asyncio.Event()
+    
+    async def run_batch(queries):
+        if queries == ["a"]:
+            await release.wait()
+            return ["A"]
+        raise ValueError("batch failed")
+    
+    pending = _PendingBatch()
+    first = asyncio.create_task(pending.submit("page", "a", run_batch))
+    await asyncio.sleep(0)
+    rest = [asyncio.create_task(pending.submit("page", q, run_batch)) for q in ("b", "c")]
+    await asyncio.sleep(0)
+    release.set()
+    
+    assert await first == "A"
+    for task in rest:
+        with pytest.raises(ValueError):
+            await task
+
+
+def test_merge_equivalent_elements():
+    """Одинаковые элементы одного контейнера схлопываются, исходные словари не изменяются"""
+    card = {"selector": ".card"}
+    elements = [
+        {"type": "button", "text": "В корзину", "selector": "#buy-1", "parent_container": card},
+        {"type": "button", "text": "  в  КОРЗИНУ ", "selector": "#buy-2", "parent_container": card},
+        {"type": "button", "text": "В корзину", "selector": "#buy-3", "parent_container": {"selector": ".other"}},
+        {"type": "list_item", "text": "Письмо", "selector": "#mail-1"},
+        {"type": "list_item", "text": "Письмо", "selector": "#mail-2"},
+        {"type": "container", "text": "", "selector": "div.wrapper"},
+    ]
+    agent = DOMSubAgent()
+    merged = agent._merge_equivalent_elements(elements)
+    
+    assert [elem["selector"] for elem in merged] == ["#buy-1", "#buy-3", "#mail-1", "#mail-2"]
+    assert merged[0]["duplicate_selectors"] == ["#buy-2"]
+    assert "duplicate_selectors" not in elements[0]
+    # Тот же список элементов обрабатывается один раз
+    assert agent._merge_equivalent_elements(elements) is merged
+
+
+def test_merge_equivalent_elements_nothing_to_merge():
+    """Если объединять нечего, возвращается исходный список"""
+    elements = [
+        {"type": "button", "text": "Найти", "selector": "#search"},
+        {"type": "link", "text": "Войти", "selector": "#login"},
+    ]
+    assert DOMSubAgent()._merge_equivalent_elements(elements) is elements
+
+
+def test_inverted_index_substring_match():
+    """Ключевое слово находится как подстрока любого слова значения"""
+    index = _build_inverted_index(["войти в почту", "почтовый ящик", "выйти", ""])
+    
+    assert _match_postings(index, "почт") == {0, 1}
+    assert _match_postings(index, "ящик") == {1}
+    assert _match_postings(index, "йти") == {0, 2}
+    assert _match_postings(index, "корзина") == set()
+
+
+def test_filter_elements_by_relevance():
+    """Элементы с совпадениями идут первыми, результат ограничен TOP_K"""
+    elements = [{"type": "link", "text": f"Ссылка {i}", "selector": f"#link-{i}"} for i in range(50)]
+    elements.append({"type": "button", "text": "Оформить заказ", "selector": "#checkout"})
+    agent = DOMSubAgent()
+    
+    filtered = agent._filter_elements_by_relevance(elements, "Где кнопка оформить заказ?")
+    assert filtered[0]["selector"] == "#checkout"
+    assert len(filtered) == agent.TOP_K
+    
+    # Без ключевых слов сохраняется порядок страницы
+    assert agent._filter_elements_by_relevance(elements, "?") == elements[:agent.TOP_K]
+
+
+def test_parse_json_object():
+    """Первый корректный JSON-объект извлекается из ответа модели"""
+    assert _parse_json_object('```json\n{"success": true, "reason": "ok"}\n```') == {"success": True, "reason": "ok"}
+    assert _parse_json_object('Итог: {не json} {"success": false}') == {"success": False}
+    assert _parse_json_object('{"a": {"b": [1, 2]}} хвост') == {"a": {"b": [1, 2]}}
+
+
+def test_parse_json_object_without_object():
+    """Без корректного объекта возвращается None"""
+    assert _parse_json_object("нет объекта") is None
+    assert _parse_json_object('[1, 2, 3]') is None
+    assert _parse_json_object('{"success": tru') is None